@@ -0,0 +1,90 @@
+# Benchmark of config loading with generated includes, including nested pokemons_refs, from the json
+# file and from a compiled snapshot of it. The rules are mostly for one species each, or all without a
+# name with several bounds.
+#
+# Run from the repository root: python benchmarks/bench_config.py
+
+import json
+import logging
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from notifier.config import Config
+from notifier.utils import get_pokemon_name
+
+RULES_PER_INCLUDE = 10
+
+# every include refs up to this many of the includes before it
+REFS_PER_INCLUDE = 3
+
+
+def make_named_rule(rng):
+    if rng.random() < 0.7:
+        return {'name': get_pokemon_name(rng.randint(1, 251)), 'min_iv': rng.choice([0, 80, 90, 100])}
+
+    return {'min_iv': rng.choice([90, 95, 98, 100])}
+
+
+def make_unnamed_rule(rng):
+    return {'min_iv': rng.randint(0, 100), 'max_lat': round(rng.uniform(40.0, 60.0), 3),
+            'min_lon': round(rng.uniform(0.0, 20.0), 3)}
+
+
+def make_config(make_rule, rule_count, rng):
+    includes = {}
+    notification_settings = {}
+    for i in range(0, max(1, rule_count // RULES_PER_INCLUDE)):
+        count = min(RULES_PER_INCLUDE, rule_count - i * RULES_PER_INCLUDE)
+        include = {'pokemons': [make_rule(rng) for _ in range(0, count)]}
+
+        refs = rng.sample(range(0, i), min(i, rng.randint(0, REFS_PER_INCLUDE)))
+        if refs:
+            include['pokemons_refs'] = ['include_%d' % ref for ref in refs]
+            include['max_lat'] = 60.0
+
+        includes['include_%d' % i] = include
+        notification_settings['setting_%d' % i] = {'includes': ['include_%d' % i]}
+
+    return {'includes': includes, 'notification_settings': notification_settings}
+
+
+def measure(config_file, snapshot_file=None):
+    start = time.time()
+    config = Config(config_file, snapshot_file)
+    return config, time.time() - start
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    rng = random.Random(42)
+    directory = tempfile.mkdtemp()
+    config_file = os.path.join(directory, 'config.json')
+    snapshot_file = os.path.join(directory, 'config.compiled')
+
+    try:
+        print('%8s %8s %12s %12s %12s' % ('mix', 'rules', 'expanded', 'json s', 'snapshot s'))
+        for mix, make_rule in [('named', make_named_rule), ('unnamed', make_unnamed_rule)]:
+            for rule_count in [10, 100, 1000, 10000]:
+                with open(config_file, 'w') as f:
+                    json.dump(make_config(make_rule, rule_count, rng), f)
+
+                config, parsed = measure(config_file)
+
+                # the first load writes the snapshot
+                measure(config_file, snapshot_file)
+                _, restored = measure(config_file, snapshot_file)
+
+                expanded = sum(len(rules) for rules in config.pokemon_includes.itervalues())
+                print('%8s %8d %12d %12.2f %12.2f' % (mix, rule_count, expanded, parsed, restored))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# Memory per tracked encounter of the processed pokemon store: the old dict of base64 ids to datetime,
+# ExpiringKeys with the base64 ids and EncounterIds with the ids decoded to integers.
+#
+# Run from the repository root: python benchmarks/bench_dedupe_memory.py
+
+import base64
+import datetime
+import gc
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from notifier.expiry import EncounterIds, ExpiringKeys
+
+ENCOUNTERS = 300000
+
+
+def get_rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def generate_encounters(rng, now):
+    # fresh strings per encounter, like every message brings
+    for _ in range(0, ENCOUNTERS):
+        yield base64.b64encode(str(rng.getrandbits(64))), now + rng.randint(60, 3600)
+
+
+def fill_dict(encounters):
+    processed = {}
+    for encounter_id, disappear_time in encounters:
+        processed[encounter_id] = datetime.datetime.utcfromtimestamp(disappear_time)
+    return processed
+
+
+def fill_expiring_keys(encounters):
+    processed = ExpiringKeys()
+    for encounter_id, disappear_time in encounters:
+        processed.add(encounter_id, disappear_time)
+    return processed
+
+
+def fill_encounter_ids(encounters):
+    processed = EncounterIds()
+    for encounter_id, disappear_time in encounters:
+        processed.add(encounter_id, disappear_time)
+    return processed
+
+
+def measure(fill, results):
+    gc.collect()
+    before = get_rss()
+    processed = fill(generate_encounters(random.Random(42), int(time.time())))
+    gc.collect()
+    results.put((get_rss() - before, len(processed)))
+
+
+def main():
+    print('%20s %20s' % ('store', 'bytes per encounter'))
+    for name, fill in [('dict of datetime', fill_dict), ('ExpiringKeys', fill_expiring_keys),
+                       ('EncounterIds', fill_encounter_ids)]:
+        # one process per store, so freed memory of the others doesn't count
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=measure, args=(fill, results))
+        process.start()
+        used, count = results.get()
+        process.join()
+        print('%20s %20.0f' % (name, used / float(count)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+# Benchmark of geofence membership, ray cast over all edges vs. the rasterized fence cells.
+#
+# Writes the [Someplace] fence from tests/data/geofence/geofences.txt scaled up to more vertices
+# and runs random points in its bounding box against both.
+#
+# Run from the repository root: python benchmarks/bench_geofence.py
+
+import logging
+import math
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from notifier.config import Config
+from notifier.utils import is_inside_geofence
+
+CENTER = (47.63, -122.32)
+RADIUS = 0.05
+POINTS = 20000
+
+
+def write_geofence_file(file_name, vertices, rng):
+    with open(file_name, 'w') as f:
+        f.write('[Someplace]\n')
+        for i in range(0, vertices):
+            angle = 2 * math.pi * i / vertices
+            r = RADIUS * (1 - 0.2 * rng.random())
+            f.write('%s,%s\n' % (CENTER[0] + r * math.cos(angle), CENTER[1] + r * math.sin(angle)))
+
+
+def make_config(geofence_file):
+    return {
+        'config': {'geofence_file': geofence_file},
+        'includes': {'fenced': {'pokemons': [{'geofence': 'Someplace'}]}},
+        'notification_settings': {'fenced': {'includes': ['fenced']}}
+    }
+
+
+def measure(contains, points):
+    start = time.time()
+    for lat, lon in points:
+        contains(lat, lon)
+
+    return len(points) / (time.time() - start)
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    rng = random.Random(42)
+    tmp_dir = tempfile.mkdtemp()
+    points = [(rng.uniform(CENTER[0] - RADIUS, CENTER[0] + RADIUS),
+               rng.uniform(CENTER[1] - RADIUS, CENTER[1] + RADIUS)) for _ in range(0, POINTS)]
+
+    try:
+        print('%9s %10s %16s %16s %8s' % ('vertices', 'build s', 'ray cast pt/s', 'raster pt/s', 'speedup'))
+        for vertices in [4, 100, 1000, 5000]:
+            geofence_file = os.path.join(tmp_dir, 'geofences.txt')
+            write_geofence_file(geofence_file, vertices, rng)
+
+            start = time.time()
+            config = Config(make_config(geofence_file))
+            build = time.time() - start
+
+            geofence = config.geofences['Someplace']
+            raster = config.geofence_index.rasters['Someplace']
+            ray_cast = measure(lambda lat, lon: is_inside_geofence(geofence, lat, lon), points)
+            rasterized = measure(raster.contains, points)
+            print('%9d %10.2f %16.0f %16.0f %7.1fx' % (vertices, build, ray_cast, rasterized, rasterized / ray_cast))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# Benchmark of pokemon rule matching, linear scan over all includes vs. the species index.
+#
+# Run from the repository root: python benchmarks/bench_pokemon_rules.py
+
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from notifier.config import Config
+from notifier.handler import Handler
+from notifier.utils import get_pokemon_name
+
+RULES_PER_INCLUDE = 10
+MESSAGES = 2000
+
+
+def make_rule(rng):
+    kind = rng.random()
+    if kind < 0.7:
+        rule = {'name': get_pokemon_name(rng.randint(1, 251)), 'min_iv': rng.choice([0, 80, 90, 100])}
+    elif kind < 0.9:
+        min_id = rng.randint(1, 240)
+        rule = {'min_id': min_id, 'max_id': min_id + rng.randint(0, 10)}
+    else:
+        rule = {'min_iv': rng.choice([98, 100])}
+
+    if rng.random() < 0.2:
+        rule['min_lat'], rule['max_lat'] = 40.0, 60.0
+        rule['min_lon'], rule['max_lon'] = 0.0, 20.0
+
+    return rule
+
+
+def make_config(rule_count, rng):
+    includes = {}
+    notification_settings = {}
+    for i in range(0, max(1, rule_count // RULES_PER_INCLUDE)):
+        count = min(RULES_PER_INCLUDE, rule_count - i * RULES_PER_INCLUDE)
+        includes['include_%d' % i] = {'pokemons': [make_rule(rng) for _ in range(0, count)]}
+        notification_settings['setting_%d' % i] = {'includes': ['include_%d' % i]}
+
+    return {'includes': includes, 'notification_settings': notification_settings}
+
+
+def make_pokemon(rng):
+    pokemon_id = rng.randint(1, 251)
+    attack, defense, stamina = rng.randint(0, 15), rng.randint(0, 15), rng.randint(0, 15)
+    return {
+        'id': pokemon_id,
+        'lat': rng.uniform(30.0, 70.0),
+        'lon': rng.uniform(-10.0, 30.0),
+        'attack': attack,
+        'defense': defense,
+        'stamina': stamina,
+        'iv': (attack + defense + stamina) * 100 / float(45),
+        'move_1_id': rng.randint(1, 281),
+        'move_2_id': rng.randint(1, 281)
+    }
+
+
+def match_linear(handler, pokemon):
+    for include_ref in handler.config.pokemon_includes:
+        handler.is_included_pokemon(pokemon, handler.config.pokemon_includes[include_ref])
+
+
+def match_indexed(handler, pokemon):
+    for include_ref, rules in handler.config.pokemon_rule_index.candidates(pokemon['id']):
+        handler.is_included_pokemon(pokemon, rules)
+
+
+def measure(match, handler, pokemons):
+    start = time.time()
+    for pokemon in pokemons:
+        # fresh dict per message, like the handler creates
+        match(handler, dict(pokemon))
+
+    return len(pokemons) / (time.time() - start)
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    rng = random.Random(42)
+    pokemons = [make_pokemon(rng) for _ in range(0, MESSAGES)]
+
+    print('%8s %16s %16s %8s' % ('rules', 'linear msg/s', 'indexed msg/s', 'speedup'))
+    for rule_count in [10, 100, 1000]:
+        handler = Handler(Config(make_config(rule_count, rng)), None)
+        linear = measure(match_linear, handler, pokemons)
+        indexed = measure(match_indexed, handler, pokemons)
+        print('%8d %16.0f %16.0f %7.1fx' % (rule_count, linear, indexed, indexed / linear))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+# Webhook throughput of the notifier thread vs. 1 to N shard processes (the "workers" setting), from
+# receiving the request bodies until all frames are handled.
+#
+# Run from the repository root: python benchmarks/bench_shards.py [max workers]
+
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from notifier.manager import NotifierManager
+from notifier.utils import get_pokemon_name
+
+RULES = 1000
+RULES_PER_INCLUDE = 10
+FRAMES = 20000
+FRAMES_PER_BODY = 50
+
+
+def make_config(workers, rng):
+    includes = {}
+    notification_settings = {}
+    for i in range(0, RULES // RULES_PER_INCLUDE):
+        rules = [{'name': get_pokemon_name(rng.randint(1, 251)), 'min_iv': rng.choice([80, 90, 100])}
+                 for _ in range(0, RULES_PER_INCLUDE)]
+        includes['include_%d' % i] = {'pokemons': rules}
+        notification_settings['setting_%d' % i] = {'includes': ['include_%d' % i]}
+
+    return {
+        'config': {'workers': workers},
+        'includes': includes,
+        'notification_settings': notification_settings
+    }
+
+
+def make_frame(encounter_id, rng):
+    return {
+        'type': 'pokemon',
+        'message': {
+            'encounter_id': str(encounter_id),
+            'spawnpoint_id': str(rng.randint(0, 5000)),
+            'pokemon_id': rng.randint(1, 251),
+            'latitude': rng.uniform(50.0, 51.0),
+            'longitude': rng.uniform(7.0, 8.0),
+            'disappear_time': int(time.time()) + 900,
+            'individual_attack': rng.randint(0, 15),
+            'individual_defense': rng.randint(0, 15),
+            'individual_stamina': rng.randint(0, 15),
+            'move_1': rng.randint(1, 281),
+            'move_2': rng.randint(1, 281)
+        }
+    }
+
+
+def measure(workers, bodies):
+    manager = NotifierManager(make_config(workers, random.Random(42)))
+    manager.start()
+
+    start = time.time()
+    for body in bodies:
+        manager.receive(body)
+
+    manager.queue.join()
+    for shard in manager.shards:
+        shard.queue.join()
+
+    return FRAMES / (time.time() - start)
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    max_workers = int(sys.argv[1]) if len(sys.argv) > 1 else max(2, multiprocessing.cpu_count())
+
+    rng = random.Random(42)
+    frames = [make_frame(encounter_id, rng) for encounter_id in range(0, FRAMES)]
+    bodies = [json.dumps(frames[i:i + FRAMES_PER_BODY]) for i in range(0, FRAMES, FRAMES_PER_BODY)]
+
+    print('%d cores' % multiprocessing.cpu_count())
+    print('%8s %12s %8s' % ('workers', 'frames/s', 'speedup'))
+    baseline = measure(1, bodies)
+    print('%8s %12.0f %7.1fx' % ('thread', baseline, 1.0))
+
+    workers = 2
+    while workers <= max_workers:
+        throughput = measure(workers, bodies)
+        print('%8d %12.0f %7.1fx' % (workers, throughput, throughput / baseline))
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Benchmark of pokemon matching with one notification setting per subscriber, per include vs. the
+# subscription index.
+#
+# Run from the repository root: python benchmarks/bench_subscriptions.py
+
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from notifier.config import Config
+from notifier.handler import Handler
+from notifier.utils import get_pokemon_name
+
+MESSAGES = 2000
+
+# subscribers pick from a small set of popular rules, plus a few of their own
+SHARED_RULES = 50
+OWN_RULES = 2
+
+
+def make_rule(rng):
+    if rng.random() < 0.7:
+        return {'name': get_pokemon_name(rng.randint(1, 251)), 'min_iv': rng.choice([0, 80, 90, 100])}
+
+    return {'min_iv': rng.choice([90, 95, 98, 100])}
+
+
+def make_config(subscribers, rng):
+    shared = [make_rule(rng) for _ in range(0, SHARED_RULES)]
+    includes = {}
+    notification_settings = {}
+    for i in range(0, subscribers):
+        rules = [dict(rule) for rule in rng.sample(shared, 5)] + [make_rule(rng) for _ in range(0, OWN_RULES)]
+        includes['include_%d' % i] = {'pokemons': rules}
+        notification_settings['subscriber_%d' % i] = {'includes': ['include_%d' % i]}
+
+    return {'includes': includes, 'notification_settings': notification_settings}
+
+
+def make_pokemon(rng):
+    attack, defense, stamina = rng.randint(0, 15), rng.randint(0, 15), rng.randint(0, 15)
+    return {
+        'id': rng.randint(1, 251),
+        'lat': rng.uniform(30.0, 70.0),
+        'lon': rng.uniform(-10.0, 30.0),
+        'attack': attack,
+        'defense': defense,
+        'stamina': stamina,
+        'iv': (attack + defense + stamina) * 100 / float(45)
+    }
+
+
+def match_includes(handler, pokemon):
+    return handler.get_pokemon_notification_settings(pokemon)
+
+
+def match_subscriptions(handler, pokemon):
+    return handler.config.subscription_index.get_notification_settings(pokemon)
+
+
+def measure(match, handler, pokemons):
+    start = time.time()
+    for pokemon in pokemons:
+        match(handler, dict(pokemon))
+
+    return len(pokemons) / (time.time() - start)
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    rng = random.Random(42)
+    pokemons = [make_pokemon(rng) for _ in range(0, MESSAGES)]
+
+    print('%12s %16s %16s %8s' % ('subscribers', 'includes msg/s', 'indexed msg/s', 'speedup'))
+    for subscribers in [100, 300, 1000]:
+        config = make_config(subscribers, rng)
+        config['config'] = {'subscriptions': True}
+        handler = Handler(Config(config), None)
+        includes = measure(match_includes, handler, pokemons)
+        indexed = measure(match_subscriptions, handler, pokemons)
+        print('%12d %16.0f %16.0f %7.1fx' % (subscribers, includes, indexed, indexed / includes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+# Time spent in the webhook request before the response goes back, with the body decoded in the
+# request vs. queued raw for the decoder thread (defer_decode), for bodies of 1, 50 and 500 frames.
+#
+# Run from the repository root: python benchmarks/bench_webhook_latency.py
+
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from notifier.manager import NotifierManager
+
+REQUESTS = 200
+WEBHOOK_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests', 'data', 'webhooks')
+
+
+def make_config(defer_decode):
+    return {
+        'config': {'defer_decode': defer_decode},
+        'includes': {'all': {'pokemons': [{'min_id': 1}]}},
+        'notification_settings': {'Default': {'includes': ['all']}}
+    }
+
+
+def make_body(frame_count):
+    frames = []
+    for file_name in ['pokemon-with-encounter.json', 'raid.json', 'gym-details.json']:
+        with open(os.path.join(WEBHOOK_DIR, file_name)) as f:
+            frames.append(json.load(f))
+
+    return json.dumps([frames[i % len(frames)] for i in range(0, frame_count)])
+
+
+def measure(defer_decode, body):
+    manager = NotifierManager(make_config(defer_decode))
+    if manager.decoder is not None:
+        # the decoder competes for the interpreter like in the server, the notifier thread isn't needed
+        manager.decoder.start()
+
+    latencies = []
+    for _ in range(0, REQUESTS):
+        start = time.time()
+        manager.receive(body)
+        latencies.append(time.time() - start)
+
+    if manager.raw_queue is not None:
+        manager.raw_queue.join()
+
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+
+    print('%8s %10s %22s %22s' % ('frames', 'bytes', 'decoded p50/p99 ms', 'deferred p50/p99 ms'))
+    for frame_count in [1, 50, 500]:
+        body = make_body(frame_count)
+        decoded = measure(False, body)
+        deferred = measure(True, body)
+        print('%8d %10d %13.3f / %6.3f %13.3f / %6.3f' % ((frame_count, len(body)) + decoded + deferred))
+
+
+if __name__ == '__main__':
+    main()
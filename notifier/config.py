@@ -1,58 +1,120 @@
+from .gamedata import load_game_data
+from .geofence import GeofenceIndex
+from .ingest import BLOCK
+from .location import DEFAULT_CACHE_SIZE, LocationConstraints
+from .rules import PokemonRule, PokemonRuleIndex, RaidRule, RaidRuleIndex, SubscriptionIndex, get_rule_key, \
+    remove_subsumed_rules, unique_rules
+import cPickle as pickle
+import hashlib
 import logging
 import commentjson as json
+import os
 import re
 
 
 log = logging.getLogger(__name__)
 
+# bump when the layout of compiled config snapshots changes
+SNAPSHOT_VERSION = 1
+
+# attributes of a parsed config, stored in its snapshot
+SNAPSHOT_KEYS = [
+    'settings', 'endpoints', 'trainers', 'notification_settings',
+    'pokemon_includes', 'raid_includes', 'pokemon_includes_to_notifications', 'raid_includes_to_notifications',
+    'geofences', 'geofence_index'
+]
+
+# pokemon settings of an include that its pokemons inherit
+POKEMON_SETTINGS = [
+    'min_id', 'max_id', 'min_iv', 'max_iv', 'min_cp', 'max_cp', 'min_hp', 'max_hp',
+    'min_attack', 'max_attack', 'min_defense', 'max_defense', 'min_stamina', 'max_stamina',
+    'min_lat', 'max_lat', 'min_lon', 'max_lon',
+    'name', 'max_dist', 'center', 'moves', 'geofence'
+]
+
 
 class Config:
-    def __init__(self, config_file):
+    def __init__(self, config_file, snapshot_file=None):
         self.notification_handlers = {}
         self.pokemon_includes_to_notifications = {}
         self.raid_includes_to_notifications = {}
+        self.settings = {}
         self.google_key = None
         self.fetch_sublocality = False
         self.shorten_urls = False
+        self.explain = False
+        self.subscriptions = False
+        self.state_file = None
+        self.queue_size = 0
+        self.queue_policy = BLOCK
+        self.queue_min_time_left = 0
+        self.defer_decode = False
+        self.raw_queue_size = 0
+        self.workers = 1
         self.endpoints = {}
         self.trainers = []
         self.notification_settings = {}
         self.pokemon_includes = {}
         self.raid_includes = {}
+        self.pokemon_rule_index = None
+        self.raid_rule_index = None
+        self.subscription_index = None
         self.geofences = {}
+        self.geofence_index = None
+        self.locations = None
+
+        # the snapshot holds the config as it is after parsing, so restarts skip the json parser,
+        # the ref expansion and the geofence rasters
+        snapshot = None
+        if snapshot_file is not None and isinstance(config_file, str):
+            snapshot = Config.load_snapshot(config_file, snapshot_file)
+
+        if snapshot is not None:
+            for key in SNAPSHOT_KEYS:
+                setattr(self, key, snapshot[key])
+        else:
+            self.parse(Config.read_config(config_file))
 
+            if snapshot_file is not None and isinstance(config_file, str):
+                self.save_snapshot(config_file, snapshot_file)
+
+        self.compile()
+
+        # log some debug info
+        for pokemon_include,notification_setting_refs in self.pokemon_includes_to_notifications.iteritems():
+            log.debug('Notifying %s to %s', pokemon_include, notification_setting_refs)
+
+        log.info('Initialized')
+
+    @staticmethod
+    def read_config(config_file):
         if isinstance(config_file, str):
             with open(config_file) as f:
                 log.info('Loading %s', config_file)
-                parsed = json.load(f)
+                return json.load(f)
         elif isinstance(config_file, dict):
-            parsed = config_file
+            return config_file
         else:
             raise RuntimeError('Unexpected parameter type: %s' % config_file)
 
+    def parse(self, parsed):
+        """
+        Resolves the parsed config into plain data: includes with their refs expanded, the links
+        between includes and notification settings, and the geofences
+        """
         log.debug('Parsing "config"')
-        config = parsed.get('config', {})
-        self.google_key = config.get('google_key', self.google_key)
-        self.fetch_sublocality = config.get('fetch_sublocality', self.fetch_sublocality)
-        self.shorten_urls = config.get('shorten_urls', self.shorten_urls)
-        geofence_file = config.get('geofence_file')
+        self.settings = parsed.get('config', {})
+        geofence_file = self.settings.get('geofence_file')
 
         if geofence_file is not None:
             self.load_geofences(geofence_file)
 
+        # answers which fences contain a point
+        self.geofence_index = GeofenceIndex(self.geofences)
+
         self.endpoints = parsed.get('endpoints', self.endpoints)
         self.trainers = parsed.get('trainers', self.trainers)
 
-        from .simple import Simple
-        self.notification_handlers['simple'] = Simple()
-
-        for endpoint in self.endpoints:
-            endpoint_type = self.endpoints[endpoint].get('type')
-            if endpoint_type == 'discord' and 'discord' not in self.notification_handlers:
-                log.info('Adding Discord to available notification handlers')
-                from .discord import Discord
-                self.notification_handlers['discord'] = Discord()
-
         self.pokemon_includes = parsed.get('includes', {})
         self.raid_includes = parsed.get('raid_includes', {})
 
@@ -60,8 +122,8 @@ class Config:
         parsed_notification_settings = parsed.get('notification_settings', {})
         self.notification_settings = {k: v for k, v in parsed_notification_settings.items() if v.get('enabled', True)}
 
-        self.parse_pokemon_includes()
-        self.parse_raid_includes()
+        self.resolve_pokemon_refs()
+        self.resolve_raid_configurations()
 
         active_pokemon_includes = set()
         active_raid_includes = set()
@@ -103,46 +165,182 @@ class Config:
             # if it's still here, it's enabled
             self.notification_settings[notification_setting].pop('enabled', None)
 
-        # log some debug info
-        for pokemon_include,notification_setting_refs in self.pokemon_includes_to_notifications.iteritems():
-            log.debug('Notifying %s to %s', pokemon_include, notification_setting_refs)
+    def compile(self):
+        """
+        Builds the rules, indexes and notification handlers from the parsed config
+        """
+        config = self.settings
+        self.google_key = config.get('google_key', self.google_key)
+        self.fetch_sublocality = config.get('fetch_sublocality', self.fetch_sublocality)
+        self.shorten_urls = config.get('shorten_urls', self.shorten_urls)
+        # evaluate all rules and log why they matched. slow, for debugging configs only
+        self.explain = config.get('explain', self.explain)
+        # match pokemon per distinct rule instead of per include, for many notification settings sharing rules
+        self.subscriptions = config.get('subscriptions', self.subscriptions)
+        # sqlite file with the processed pokemon, raids and eggs and the gyms, kept over restarts
+        self.state_file = config.get('state_file', self.state_file)
+        # frames waiting for the notifier thread, 0 for no limit, and what to do once that many are waiting
+        self.queue_size = config.get('queue_size', self.queue_size)
+        self.queue_policy = config.get('queue_policy', self.queue_policy)
+        self.queue_min_time_left = config.get('queue_min_time_left', self.queue_min_time_left)
+        # answer webhooks right away and decode their bodies on a separate thread
+        self.defer_decode = config.get('defer_decode', self.defer_decode)
+        # request bodies waiting to be decoded, 0 for no limit. the oldest body is dropped to make room
+        self.raw_queue_size = config.get('raw_queue_size', self.raw_queue_size)
+        # worker processes matching the frames, each with its own handler. only read at startup
+        self.workers = config.get('workers', self.workers)
+
+        # optional precompiled game data, for faster startup
+        game_data_cache = config.get('game_data_cache')
+        if game_data_cache is not None:
+            load_game_data(game_data_cache)
+
+        # location constraints of all rules, with their outcome cached per spawnpoint
+        self.locations = LocationConstraints(self.geofence_index,
+                                             config.get('location_cache_size', DEFAULT_CACHE_SIZE),
+                                             config.get('location_cache_file'))
 
-        log.info('Initialized')
+        from .simple import Simple
+        self.notification_handlers['simple'] = Simple()
 
-    def parse_pokemon_includes(self):
-        self.resolve_pokemon_configurations()
-        self.resolve_pokemon_refs()
+        for endpoint in self.endpoints:
+            endpoint_type = self.endpoints[endpoint].get('type')
+            if endpoint_type == 'discord' and 'discord' not in self.notification_handlers:
+                log.info('Adding Discord to available notification handlers')
+                from .discord import Discord
+                self.notification_handlers['discord'] = Discord()
 
-        # bring the 'pokemons' entry to root level
-        for include in self.pokemon_includes:
-            self.pokemon_includes[include] = self.pokemon_includes[include]['pokemons']
+        self.compile_pokemon_includes()
+        self.compile_raid_includes()
 
-    def parse_raid_includes(self):
-        self.resolve_raid_configurations()
-        #self.resolve_pokemon_refs()
+        # all location constraints are known now
+        self.locations.load_cache()
 
-    def resolve_pokemon_refs(self):
-        for include in self.pokemon_includes:
-            include = self.pokemon_includes[include]
-            if 'pokemons' not in include:
-                include['pokemons'] = []
+        # bucket the rules by species, so messages are only matched against rules that can apply
+        self.pokemon_rule_index = PokemonRuleIndex(self.pokemon_includes)
+        self.raid_rule_index = RaidRuleIndex(self.raid_includes)
+
+        if self.subscriptions:
+            self.subscription_index = SubscriptionIndex(self.pokemon_includes, self.pokemon_includes_to_notifications)
+
+    @staticmethod
+    def get_source_hash(config_file, geofence_file):
+        source_hash = hashlib.sha1()
+        for file_name in [config_file, geofence_file]:
+            if file_name is not None:
+                with open(file_name, 'rb') as f:
+                    source_hash.update(f.read())
 
-            for ref in include.get('pokemons_refs', []):
-                self.add_pokemons_from_ref(ref, include)
+        return source_hash.hexdigest()
 
-            include.pop('pokemons_refs', None)
-            self.resolve_pokemon_configurations()
+    @staticmethod
+    def load_snapshot(config_file, snapshot_file):
+        """
+        Returns the snapshot in snapshot_file, or None if there is none for the current config and
+        geofence files
+        """
+        if not os.path.exists(snapshot_file):
+            return None
+
+        try:
+            with open(snapshot_file, 'rb') as f:
+                snapshot = pickle.load(f)
+
+            if snapshot.get('version') != SNAPSHOT_VERSION or \
+                    snapshot['source_hash'] != Config.get_source_hash(config_file, snapshot['geofence_file']):
+                log.info('Compiled config %s is outdated', snapshot_file)
+                return None
+        except Exception:
+            log.exception('Could not read compiled config %s', snapshot_file)
+            return None
+
+        log.info('Loaded compiled config from %s', snapshot_file)
+        return snapshot
+
+    def save_snapshot(self, config_file, snapshot_file):
+        geofence_file = self.settings.get('geofence_file')
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'source_hash': Config.get_source_hash(config_file, geofence_file),
+            'geofence_file': geofence_file
+        }
+        for key in SNAPSHOT_KEYS:
+            snapshot[key] = getattr(self, key)
+
+        # write and rename, so a crash never leaves a partial snapshot behind
+        tmp_file = snapshot_file + '.tmp'
+        try:
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(snapshot, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_file, snapshot_file)
+        except (IOError, OSError):
+            log.exception('Could not write compiled config %s', snapshot_file)
+
+    def compile_pokemon_includes(self):
+        # bring the 'pokemons' entry to root level and compile the rules. identical rules in different
+        # includes share one compiled rule
+        compiled = {}
+        for include in self.pokemon_includes:
+            rules = []
+            for pokemon in self.pokemon_includes[include]['pokemons']:
+                key = get_rule_key(pokemon)
+                if key not in compiled:
+                    compiled[key] = PokemonRule(pokemon, self.locations)
+                rules.append(compiled[key])
 
-    def add_pokemons_from_ref(self, ref, include):
-        resolved_ref = self.pokemon_includes.get(ref)
+            self.pokemon_includes[include] = rules
 
-        if 'pokemons' in resolved_ref:
-            for pokemon in resolved_ref['pokemons']:
-                include['pokemons'].append(pokemon.copy())
+    def compile_raid_includes(self):
+        for include in self.raid_includes:
+            self.raid_includes[include] = RaidRule(self.raid_includes[include], self.locations)
 
-        if 'pokemons_refs' in resolved_ref:
-            for r in resolved_ref['pokemons_refs']:
-                self.add_pokemons_from_ref(r, include)
+    def resolve_pokemon_refs(self):
+        expanded = {}
+        removed = [0, 0]
+        for include_ref in self.pokemon_includes:
+            self.expand_pokemon_refs(include_ref, expanded, [], removed)
+
+        # subsumed rules are only removed from the final lists. the settings of a referencing include
+        # can turn a subsumed rule into one that matches pokemon the other rule doesn't
+        for include_ref, pokemons in expanded.iteritems():
+            self.pokemon_includes[include_ref]['pokemons'], subsumed = remove_subsumed_rules(pokemons)
+            removed[1] += subsumed
+
+        total = sum(len(pokemons) for pokemons in expanded.itervalues()) + removed[0]
+        log.info('Reduced %d pokemon rules to %d, removed %d duplicates and %d subsumed rules',
+                 total, total - removed[0] - removed[1], removed[0], removed[1])
+
+    def expand_pokemon_refs(self, include_ref, expanded, resolving, removed):
+        """
+        Returns the pokemons of an include with its refs expanded and its settings applied. Every
+        include is expanded once, the includes referencing it copy the result.
+        """
+        pokemons = expanded.get(include_ref)
+        if pokemons is not None:
+            return pokemons
+
+        if include_ref in resolving:
+            raise RuntimeError('Cycle in pokemons_refs: %s' % ' -> '.join(resolving + [include_ref]))
+
+        include = self.pokemon_includes.get(include_ref)
+        if include is None:
+            raise RuntimeError('Unknown include in pokemons_refs of %s: %s' % (resolving[-1], include_ref))
+
+        resolving.append(include_ref)
+        pokemons = include.get('pokemons', [])
+        for ref in include.get('pokemons_refs', []):
+            pokemons.extend(pokemon.copy() for pokemon in self.expand_pokemon_refs(ref, expanded, resolving, removed))
+        resolving.pop()
+
+        self.resolve_pokemon_configurations(include, pokemons)
+
+        # nested refs can pull in the same rules several times
+        unique = unique_rules(pokemons)
+        removed[0] += len(pokemons) - len(unique)
+
+        include['pokemons'] = expanded[include_ref] = unique
+        include.pop('pokemons_refs', None)
+        return unique
 
     def resolve_raid_configurations(self):
         for include in self.raid_includes:
@@ -157,33 +355,13 @@ class Config:
                 self.add_if_missing('name', include, raid_pokemon)
                 self.add_if_missing('geofence', include, raid_pokemon)
 
-    def resolve_pokemon_configurations(self):
-        for include in self.pokemon_includes:
-            include = self.pokemon_includes[include]
-
-            for pokemon in include.get('pokemons', []):
-                self.add_if_missing('min_id', include, pokemon)
-                self.add_if_missing('max_id', include, pokemon)
-                self.add_if_missing('min_iv', include, pokemon)
-                self.add_if_missing('max_iv', include, pokemon)
-                self.add_if_missing('min_cp', include, pokemon)
-                self.add_if_missing('max_cp', include, pokemon)
-                self.add_if_missing('min_hp', include, pokemon)
-                self.add_if_missing('max_hp', include, pokemon)
-                self.add_if_missing('min_attack', include, pokemon)
-                self.add_if_missing('max_attack', include, pokemon)
-                self.add_if_missing('min_defense', include, pokemon)
-                self.add_if_missing('max_defense', include, pokemon)
-                self.add_if_missing('min_stamina', include, pokemon)
-                self.add_if_missing('max_stamina', include, pokemon)
-                self.add_if_missing('min_lat', include, pokemon)
-                self.add_if_missing('max_lat', include, pokemon)
-                self.add_if_missing('min_lon', include, pokemon)
-                self.add_if_missing('max_lon', include, pokemon)
-                self.add_if_missing('name', include, pokemon)
-                self.add_if_missing('max_dist', include, pokemon)
-                self.add_if_missing('moves', include, pokemon)
-                self.add_if_missing('geofence', include, pokemon)
+    @staticmethod
+    def resolve_pokemon_configurations(include, pokemons):
+        # settings on include level apply to all its pokemons, unless they override them
+        keys = [key for key in POKEMON_SETTINGS if key in include]
+        for pokemon in pokemons:
+            for key in keys:
+                Config.add_if_missing(key, include, pokemon)
 
     @staticmethod
     def add_if_missing(key, source, target):
@@ -0,0 +1,268 @@
+from array import array
+import base64
+import itertools
+import time
+
+# one slot per second. keys expiring further ahead stay in their slot for another round
+WHEEL_SLOTS = 3600
+
+# encounter ids are unsigned 64 bit integers, stored in arrays of unsigned longs. those have 64 bits
+# on the 64 bit platforms we run on, python 2 arrays have no explicit 64 bit type
+MAX_KEY = 1 << (array('L').itemsize * 8)
+
+# hash table of CompactExpiringKeys. it is grown before more than 1 / LOAD_FACTOR_DIVISOR of the
+# slots are in use, deleted ones included
+MIN_CAPACITY = 1024
+LOAD_FACTOR_DIVISOR = 2
+DELETED = -1
+
+
+class ExpiringKeys:
+    """
+    Keys with an expiry time in epoch seconds, forgotten once that time has passed.
+
+    The keys are kept in a timing wheel with one slot per second. advance() only visits the slots of
+    the seconds since its last call, so expiring costs O(1) per key, no matter how often it runs.
+    """
+
+    def __init__(self, slots=WHEEL_SLOTS, now=None):
+        self.expiry = {}
+        self.slots = [[] for _ in range(0, slots)]
+        self.current = int(now if now is not None else time.time())
+
+    def __contains__(self, key):
+        return key in self.expiry
+
+    def __len__(self):
+        return len(self.expiry)
+
+    def add(self, key, expires_at):
+        expires_at = int(expires_at)
+        self.expiry[key] = expires_at
+
+        # a key is expired in the second after its expiry, or right away if that has passed already
+        second = max(expires_at + 1, self.current + 1)
+        self.slots[second % len(self.slots)].append(key)
+
+    def get(self, key, default=None):
+        return self.expiry.get(key, default)
+
+    def discard(self, key):
+        # its slot in the wheel is skipped once the key is gone
+        self.expiry.pop(key, None)
+
+    def advance(self, now=None):
+        """
+        Forgets all keys that expired before now
+        """
+        now = int(now if now is not None else time.time())
+        first = max(self.current + 1, now - len(self.slots) + 1)
+
+        for second in range(first, now + 1):
+            index = second % len(self.slots)
+            slot = self.slots[index]
+            if not slot:
+                continue
+
+            kept = []
+            for key in slot:
+                expires_at = self.expiry.get(key)
+                if expires_at is None:
+                    # forgotten through another slot already
+                    continue
+
+                if expires_at < now:
+                    del self.expiry[key]
+                elif (expires_at + 1) % len(self.slots) == index:
+                    # expires in a later round of the wheel. keys added again with another expiry
+                    # are only kept in the slot of their current expiry
+                    kept.append(key)
+
+            self.slots[index] = kept
+
+        self.current = max(self.current, now)
+
+
+def get_encounter_key(encounter_id):
+    """
+    Returns the integer behind an encounter id, which the scanners send as the decimal value of an
+    unsigned 64 bit integer in base64. None if encounter_id isn't one
+    """
+    if isinstance(encounter_id, (int, long)):
+        key = encounter_id
+    else:
+        try:
+            key = int(base64.b64decode(encounter_id))
+        except (TypeError, ValueError):
+            return None
+
+    return key if 0 <= key < MAX_KEY else None
+
+
+class CompactExpiringKeys:
+    """
+    ExpiringKeys for unsigned 64 bit integers, stored in arrays instead of Python objects.
+
+    Keys and expiries live in an open addressing hash table with linear probing. A slot with expiry
+    0 is empty, DELETED marks a removed key so probes continue past it. The timing wheel keeps the
+    keys in one array per second.
+    """
+
+    def __init__(self, slots=WHEEL_SLOTS, now=None):
+        self.capacity = MIN_CAPACITY
+        self.keys = array('L', [0]) * self.capacity
+        self.expiry = array('i', [0]) * self.capacity
+        self.count = 0
+        self.used = 0
+        self.slots = [array('L') for _ in range(0, slots)]
+        self.current = int(now if now is not None else time.time())
+
+    def find(self, key):
+        """
+        Returns the table index of key, or -1
+        """
+        mask = self.capacity - 1
+        index = hash(key) & mask
+        expiry = self.expiry
+        while expiry[index] != 0:
+            if expiry[index] != DELETED and self.keys[index] == key:
+                return index
+            index = (index + 1) & mask
+
+        return -1
+
+    def __contains__(self, key):
+        return self.find(key) >= 0
+
+    def __len__(self):
+        return self.count
+
+    def get(self, key, default=None):
+        index = self.find(key)
+        return self.expiry[index] if index >= 0 else default
+
+    def add(self, key, expires_at):
+        # 0 and DELETED are reserved, an expiry that early has passed anyway
+        expires_at = max(int(expires_at), 1)
+
+        index = self.find(key)
+        if index >= 0:
+            self.expiry[index] = expires_at
+        else:
+            if (self.used + 1) * LOAD_FACTOR_DIVISOR > self.capacity:
+                self.resize()
+
+            mask = self.capacity - 1
+            index = hash(key) & mask
+            while self.expiry[index] > 0:
+                index = (index + 1) & mask
+
+            if self.expiry[index] == 0:
+                self.used += 1
+            self.keys[index] = key
+            self.expiry[index] = expires_at
+            self.count += 1
+
+        second = max(expires_at + 1, self.current + 1)
+        self.slots[second % len(self.slots)].append(key)
+
+    def discard(self, key):
+        index = self.find(key)
+        if index >= 0:
+            self.remove(index)
+
+    def remove(self, index):
+        self.expiry[index] = DELETED
+        self.count -= 1
+
+    def resize(self):
+        # rehash the live keys, which also clears the deleted slots
+        capacity = MIN_CAPACITY
+        while (self.count + 1) * LOAD_FACTOR_DIVISOR * 2 > capacity:
+            capacity *= 2
+
+        keys, expiry = self.keys, self.expiry
+        self.capacity = capacity
+        self.keys = array('L', [0]) * capacity
+        self.expiry = array('i', [0]) * capacity
+        self.used = 0
+
+        mask = capacity - 1
+        for key, expires_at in itertools.izip(keys, expiry):
+            if expires_at > 0:
+                index = hash(key) & mask
+                while self.expiry[index] != 0:
+                    index = (index + 1) & mask
+
+                self.keys[index] = key
+                self.expiry[index] = expires_at
+                self.used += 1
+
+    def advance(self, now=None):
+        """
+        Forgets all keys that expired before now
+        """
+        now = int(now if now is not None else time.time())
+        first = max(self.current + 1, now - len(self.slots) + 1)
+
+        for second in range(first, now + 1):
+            index = second % len(self.slots)
+            slot = self.slots[index]
+            if not slot:
+                continue
+
+            kept = array('L')
+            for key in slot:
+                table_index = self.find(key)
+                if table_index < 0:
+                    continue
+
+                expires_at = self.expiry[table_index]
+                if expires_at < now:
+                    self.remove(table_index)
+                elif (expires_at + 1) % len(self.slots) == index:
+                    kept.append(key)
+
+            self.slots[index] = kept
+
+        self.current = max(self.current, now)
+
+
+class EncounterIds:
+    """
+    Processed encounter ids with their despawn time. Ids that decode to an integer go to a
+    CompactExpiringKeys, anything else to a plain ExpiringKeys.
+    """
+
+    def __init__(self, slots=WHEEL_SLOTS, now=None):
+        self.compact = CompactExpiringKeys(slots, now)
+        self.other = ExpiringKeys(slots, now)
+
+    def __contains__(self, encounter_id):
+        key = get_encounter_key(encounter_id)
+        return key in self.compact if key is not None else encounter_id in self.other
+
+    def __len__(self):
+        return len(self.compact) + len(self.other)
+
+    def get(self, encounter_id, default=None):
+        key = get_encounter_key(encounter_id)
+        return self.compact.get(key, default) if key is not None else self.other.get(encounter_id, default)
+
+    def add(self, encounter_id, expires_at):
+        key = get_encounter_key(encounter_id)
+        if key is not None:
+            self.compact.add(key, expires_at)
+        else:
+            self.other.add(encounter_id, expires_at)
+
+    def discard(self, encounter_id):
+        key = get_encounter_key(encounter_id)
+        if key is not None:
+            self.compact.discard(key)
+        else:
+            self.other.discard(encounter_id)
+
+    def advance(self, now=None):
+        self.compact.advance(now)
+        self.other.advance(now)
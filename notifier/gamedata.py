@@ -0,0 +1,222 @@
+from array import array
+import json
+import logging
+import marshal
+import os
+
+log = logging.getLogger(__name__)
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data')
+DATA_FILES = ['names.json', 'moves.json', 'stats.json', 'cpm.json']
+
+# bump when the cached layout changes
+CACHE_VERSION = 1
+
+# levels 1 to 40 in steps of 0.5
+LEVEL_COUNT = 79
+
+
+def get_level_index(level):
+    """
+    Returns the index of a level like 10, 5.5 or "5.5", or None if it's not a valid level
+    """
+    try:
+        index = float(level) * 2 - 2
+    except (TypeError, ValueError):
+        return None
+
+    if index != int(index) or not 0 <= index < LEVEL_COUNT:
+        return None
+
+    return int(index)
+
+
+class GameData:
+    """
+    Names, moves, base stats and CP multipliers from the data directory, indexed by integer id.
+
+    Lists are indexed by pokemon id, move id or level index, with None (or 0 for the base stat
+    arrays) for ids that don't exist. If cache_file is given, the parsed data is stored there and
+    reused for as long as the json files are unchanged.
+    """
+
+    def __init__(self, data_dir=DATA_DIR, cache_file=None):
+        self.data_dir = data_dir
+        self.pokemon_names = []
+        self.pokemon_ids = {}
+        self.move_names = []
+        self.move_ids = {}
+        self.stats = []
+        self.base_attack = array('H')
+        self.base_defense = array('H')
+        self.base_stamina = array('H')
+        self.cp_multipliers = array('d')
+        self.levels_by_cpm = {}
+
+        source_key = self.get_source_key()
+        if cache_file is None or not self.load_cache(cache_file, source_key):
+            self.load_json()
+
+            if cache_file is not None:
+                self.save_cache(cache_file, source_key)
+
+        self.build_lookups()
+
+    def get_source_key(self):
+        key = [CACHE_VERSION]
+        for file_name in DATA_FILES:
+            stat = os.stat(os.path.join(self.data_dir, file_name))
+            key.append((file_name, stat.st_size, int(stat.st_mtime)))
+
+        return key
+
+    def read_json(self, file_name):
+        with open(os.path.join(self.data_dir, file_name), 'r') as f:
+            return json.load(f)
+
+    def load_json(self):
+        log.info('Loading game data from %s', self.data_dir)
+
+        names = self.read_json('names.json')
+        self.pokemon_names = GameData.to_list(names)
+
+        moves = self.read_json('moves.json')
+        self.move_names = GameData.to_list(moves)
+
+        stats = self.read_json('stats.json')
+        self.stats = GameData.to_list(stats)
+
+        self.cp_multipliers = array('d', [0.0] * LEVEL_COUNT)
+        for level, cp_multiplier in self.read_json('cpm.json').items():
+            level_index = get_level_index(level)
+            if level_index is not None:
+                self.cp_multipliers[level_index] = cp_multiplier
+
+    @staticmethod
+    def to_list(id_to_value):
+        values = [None] * (max(int(k) for k in id_to_value) + 1)
+        for k, value in id_to_value.items():
+            values[int(k)] = value
+
+        return values
+
+    def load_cache(self, cache_file, source_key):
+        try:
+            with open(cache_file, 'rb') as f:
+                cached = marshal.load(f)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return False
+
+        if cached.get('source_key') != source_key:
+            log.info('Game data cache %s is outdated', cache_file)
+            return False
+
+        self.pokemon_names = cached['pokemon_names']
+        self.move_names = cached['move_names']
+        self.stats = cached['stats']
+        self.cp_multipliers = array('d', cached['cp_multipliers'])
+        log.info('Loaded game data from %s', cache_file)
+        return True
+
+    def save_cache(self, cache_file, source_key):
+        cached = {
+            'source_key': source_key,
+            'pokemon_names': self.pokemon_names,
+            'move_names': self.move_names,
+            'stats': self.stats,
+            'cp_multipliers': list(self.cp_multipliers)
+        }
+
+        # write and rename, so a crash never leaves a partial cache behind
+        tmp_file = cache_file + '.tmp'
+        try:
+            with open(tmp_file, 'wb') as f:
+                marshal.dump(cached, f)
+            os.rename(tmp_file, cache_file)
+        except (IOError, OSError):
+            log.exception('Could not write game data cache %s', cache_file)
+
+    def build_lookups(self):
+        self.pokemon_ids = {}
+        for pokemon_id, name in enumerate(self.pokemon_names):
+            if name is not None:
+                self.pokemon_ids[name] = pokemon_id
+
+        # some moves share a name, e.g. fast and charged variants
+        self.move_ids = {}
+        for move_id, name in enumerate(self.move_names):
+            if name is not None:
+                self.move_ids.setdefault(name, []).append(move_id)
+
+        stats = [self.get_stats(pokemon_id) for pokemon_id in range(0, len(self.pokemon_names))]
+        self.base_attack = array('H', [s['attack'] if s else 0 for s in stats])
+        self.base_defense = array('H', [s['defense'] if s else 0 for s in stats])
+        self.base_stamina = array('H', [s['stamina'] if s else 0 for s in stats])
+
+        # the api reports rounded multipliers, so they are compared on the first few characters
+        self.levels_by_cpm = {}
+        for level_index, cp_multiplier in enumerate(self.cp_multipliers):
+            level = (level_index + 2) / 2.0
+            self.levels_by_cpm[str(cp_multiplier)[:5]] = int(level) if level == int(level) else level
+
+    @staticmethod
+    def lookup(values, index):
+        try:
+            index = int(index)
+        except (TypeError, ValueError):
+            return None
+
+        if 0 <= index < len(values):
+            return values[index]
+
+        return None
+
+    def get_pokemon_name(self, pokemon_id):
+        return GameData.lookup(self.pokemon_names, pokemon_id)
+
+    def get_pokemon_id(self, pokemon_name):
+        return self.pokemon_ids.get(pokemon_name)
+
+    def get_pokemon_ids(self):
+        return [pokemon_id for pokemon_id, name in enumerate(self.pokemon_names) if name is not None]
+
+    def get_move_name(self, move_id):
+        return GameData.lookup(self.move_names, move_id)
+
+    def get_move_ids(self, move_name):
+        return self.move_ids.get(move_name, [])
+
+    def get_stats(self, pokemon_id):
+        return GameData.lookup(self.stats, pokemon_id)
+
+    def get_cpm_for_level(self, level):
+        level_index = get_level_index(level)
+        if level_index is None:
+            return None
+
+        return self.cp_multipliers[level_index]
+
+    def get_level_from_cpm(self, cp_multiplier):
+        return self.levels_by_cpm.get(str(cp_multiplier)[:5], -1)
+
+
+game_data = None
+
+
+def get_game_data():
+    """
+    Returns the game data registry, loading it from the json files on first use
+    """
+    if game_data is None:
+        load_game_data()
+
+    return game_data
+
+
+def load_game_data(cache_file=None):
+    """
+    (Re)loads the game data registry, optionally through a precompiled cache file
+    """
+    global game_data
+    game_data = GameData(cache_file=cache_file)
+    return game_data
@@ -0,0 +1,222 @@
+from .utils import *
+import logging
+import math
+
+log = logging.getLogger(__name__)
+
+# size of a grid cell in degrees, roughly 5 km
+DEFAULT_CELL_SIZE = 0.05
+
+# the largest fence covers at most this many cells per side, the cells grow if needed
+MAX_CELLS_PER_SIDE = 64
+
+# resolution limits of the per fence rasters
+MIN_RASTER_SIZE = 4
+MAX_RASTER_SIZE = 128
+
+OUTSIDE = 0
+INSIDE = 1
+BOUNDARY = 2
+
+# where the reference points lie in their cells, in fractions of the cell size. the first x not on
+# the x of a polygon vertex is used, so no edge runs along the walk through a column, and the first y
+# that isn't on the line of an edge of the cell
+REFERENCE_OFFSETS = [0.5, 0.41421356, 0.58578644, 0.31830989, 0.68169011]
+
+
+def get_orientation(ax, ay, bx, by, cx, cy):
+    return (bx - ax) * (cy - ay) - (by - ay) * (cx - ax)
+
+
+def segments_cross(ax, ay, bx, by, cx, cy, dx, dy):
+    """
+    Returns True if segment a-b crosses segment c-d.
+
+    Both tests are half-open: a point on the other segment's line counts as being on its negative
+    side. A segment passing exactly through a vertex then crosses exactly one of the two edges
+    meeting there, or both or neither if it only touches the fence, so the parity stays right.
+    """
+    o1 = get_orientation(ax, ay, bx, by, cx, cy)
+    o2 = get_orientation(ax, ay, bx, by, dx, dy)
+    if (o1 > 0) == (o2 > 0):
+        return False
+
+    o3 = get_orientation(cx, cy, dx, dy, ax, ay)
+    o4 = get_orientation(cx, cy, dx, dy, bx, by)
+    return (o3 > 0) != (o4 > 0)
+
+
+def segment_touches_box(x1, y1, x2, y2, min_x, min_y, max_x, max_y):
+    """
+    Liang-Barsky clipping of segment (x1, y1)-(x2, y2) against a box
+    """
+    t0, t1 = 0.0, 1.0
+    dx, dy = x2 - x1, y2 - y1
+    for p, q in ((-dx, x1 - min_x), (dx, max_x - x1), (-dy, y1 - min_y), (dy, max_y - y1)):
+        if p == 0:
+            if q < 0:
+                return False
+        else:
+            t = q / float(p)
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+            if t0 > t1:
+                return False
+
+    return True
+
+
+class RasterizedGeofence:
+    """
+    A geofence polygon rasterized to a grid over its bounding box.
+
+    Every cell is fully inside, fully outside or on the boundary. Only points in boundary cells need
+    an exact test, which only looks at the edges crossing that cell: a point is inside if the cell's
+    reference point is inside and the segment from the point to it crosses an even number of edges.
+    """
+
+    def __init__(self, polygon, boundaries):
+        self.min_x, self.min_y = boundaries['min']
+        self.max_x, self.max_y = boundaries['max']
+
+        self.size = int(min(MAX_RASTER_SIZE, max(MIN_RASTER_SIZE, 2 * math.sqrt(len(polygon)))))
+        self.cell_width = (self.max_x - self.min_x) / float(self.size) or 1e-9
+        self.cell_height = (self.max_y - self.min_y) / float(self.size) or 1e-9
+
+        self.status = bytearray(self.size * self.size)
+        self.boundary_cells = {}
+
+        # mark the cells crossed by an edge as boundary cells
+        edges = {}
+        for i in range(0, len(polygon)):
+            x1, y1 = polygon[i - 1]
+            x2, y2 = polygon[i]
+            # one tuple per edge, an edge listed in two cells is the same object in both
+            edge = (x1, y1, x2, y2)
+            min_cx, min_cy = self.get_cell(min(x1, x2), min(y1, y2))
+            max_cx, max_cy = self.get_cell(max(x1, x2), max(y1, y2))
+            for cx in range(min_cx, max_cx + 1):
+                for cy in range(min_cy, max_cy + 1):
+                    cell_min_x = self.min_x + cx * self.cell_width
+                    cell_min_y = self.min_y + cy * self.cell_height
+                    if segment_touches_box(x1, y1, x2, y2, cell_min_x, cell_min_y,
+                                           cell_min_x + self.cell_width, cell_min_y + self.cell_height):
+                        edges.setdefault(cx * self.size + cy, []).append(edge)
+
+        # walk each column of reference points from outside the fence, flipping inside/outside for
+        # every edge crossed on the way. the segment between two neighbouring points stays in those
+        # two cells, so only their edges can cross it
+        vertex_xs = set(x for x, _ in polygon)
+        for cx in range(0, self.size):
+            for offset in REFERENCE_OFFSETS:
+                center_x = self.min_x + (cx + offset) * self.cell_width
+                if center_x not in vertex_xs:
+                    break
+
+            inside = False
+            previous_x = center_x
+            previous_y = self.min_y - 0.5 * self.cell_height
+            previous_edges = []
+
+            for cy in range(0, self.size):
+                cell = cx * self.size + cy
+                cell_edges = edges.get(cell, [])
+                for offset in REFERENCE_OFFSETS:
+                    center_y = self.min_y + (cy + offset) * self.cell_height
+                    if all(get_orientation(x1, y1, x2, y2, center_x, center_y) != 0
+                           for x1, y1, x2, y2 in cell_edges):
+                        break
+
+                # edges of both cells count once, fences going back and forth over an edge twice
+                cell_edge_ids = set(id(edge) for edge in cell_edges)
+                crossed_edges = cell_edges + [edge for edge in previous_edges if id(edge) not in cell_edge_ids]
+                for x1, y1, x2, y2 in crossed_edges:
+                    if segments_cross(previous_x, previous_y, center_x, center_y, x1, y1, x2, y2):
+                        inside = not inside
+
+                if cell_edges:
+                    self.status[cell] = BOUNDARY
+                    self.boundary_cells[cell] = (center_x, center_y, inside, cell_edges)
+                else:
+                    self.status[cell] = INSIDE if inside else OUTSIDE
+
+                previous_x, previous_y, previous_edges = center_x, center_y, cell_edges
+
+    def get_cell(self, x, y):
+        cx = min(self.size - 1, max(0, int((x - self.min_x) / self.cell_width)))
+        cy = min(self.size - 1, max(0, int((y - self.min_y) / self.cell_height)))
+        return cx, cy
+
+    def contains(self, x, y):
+        if x < self.min_x or x > self.max_x or y < self.min_y or y > self.max_y:
+            return False
+
+        cx, cy = self.get_cell(x, y)
+        cell = cx * self.size + cy
+        status = self.status[cell]
+        if status != BOUNDARY:
+            return status == INSIDE
+
+        center_x, center_y, inside, edges = self.boundary_cells[cell]
+        for x1, y1, x2, y2 in edges:
+            if segments_cross(x, y, center_x, center_y, x1, y1, x2, y2):
+                inside = not inside
+
+        return inside
+
+
+class GeofenceIndex:
+    """
+    Grid over the bounding boxes of all geofences.
+
+    Each cell lists the fences whose bounding box overlaps it, so finding all fences that contain a
+    point takes one cell lookup plus a test against the rasters of the few fences listed there.
+    """
+
+    def __init__(self, geofences, cell_size=DEFAULT_CELL_SIZE):
+        self.geofences = geofences
+        self.rasters = {}
+        self.cells = {}
+
+        max_extent = 0
+        for geofence in geofences.itervalues():
+            boundaries = geofence['boundaries']
+            if boundaries:
+                max_extent = max(max_extent,
+                                 boundaries['max'][0] - boundaries['min'][0],
+                                 boundaries['max'][1] - boundaries['min'][1])
+        self.cell_size = max(cell_size, max_extent / float(MAX_CELLS_PER_SIDE))
+
+        for name, geofence in geofences.iteritems():
+            boundaries = geofence['boundaries']
+            if not boundaries:
+                continue
+
+            self.rasters[name] = RasterizedGeofence(geofence['polygon'], boundaries)
+
+            min_x, min_y = self.get_cell(*boundaries['min'])
+            max_x, max_y = self.get_cell(*boundaries['max'])
+            for x in range(min_x, max_x + 1):
+                for y in range(min_y, max_y + 1):
+                    self.cells.setdefault((x, y), []).append(name)
+
+        log.info('Indexed %d geofences in %d cells of %.3f degrees', len(geofences), len(self.cells),
+                 self.cell_size)
+
+    def get_cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lon / self.cell_size))
+
+    def lookup(self, lat, lon):
+        """
+        Returns a frozenset with the names of all geofences containing lat, lon
+        """
+        if lat is None or lon is None:
+            return frozenset()
+
+        names = self.cells.get(self.get_cell(lat, lon))
+        if not names:
+            return frozenset()
+
+        return frozenset(name for name in names if self.rasters[name].contains(lat, lon))
@@ -1,57 +1,95 @@
+from .expiry import EncounterIds, ExpiringKeys
 from .utils import *
 import logging
+import time
 
 log = logging.getLogger(__name__)
 
+# seconds between writes of the location cache
+CACHE_SAVE_INTERVAL = 300
+
+# seconds between writes of the processed pokemon, raids, eggs and gyms to the state file
+STATE_SAVE_INTERVAL = 10
+
+# keys added to pokemon and raid dicts for location matching only, removed before notifying
+MATCHING_KEYS = ('location_mask', 'spawnpoint_id')
+
 
 class Handler:
-    def __init__(self, config, notifier):
+    def __init__(self, config, notifier, state=None):
         self.config = config
         self.notifier = notifier
+        self.state = state
 
-        self.processed_pokemons = {}
-        self.processed_raids = {}
-        self.processed_eggs = {}
+        self.processed_pokemons = EncounterIds()
+        self.processed_raids = ExpiringKeys()
+        self.processed_eggs = ExpiringKeys()
         self.gyms = {}
 
-    def clean(self):
-        now = datetime.datetime.utcnow()
-        remove = []
-
-        for encounter_id in self.processed_pokemons:
-            if self.processed_pokemons[encounter_id] < now:
-                remove.append(encounter_id)
-        for encounter_id in remove:
-            del self.processed_pokemons[encounter_id]
-
-        remove = []
-        for key in self.processed_raids:
-            if self.processed_raids[key] < now:
-                remove.append(key)
-        for key in remove:
-            del self.processed_raids[key]
-
-        remove = []
-        for key in self.processed_eggs:
-            if self.processed_eggs[key] < now:
-                remove.append(key)
-        for key in remove:
-            del self.processed_eggs[key]
+        self.next_cache_save = time.time() + CACHE_SAVE_INTERVAL
+        self.next_state_save = time.time() + STATE_SAVE_INTERVAL
+
+        if self.state is not None:
+            self.load_state()
+
+    def load_state(self):
+        processed, self.gyms = self.state.load()
+        for kind, key, expires_at in processed:
+            self.get_processed(kind).add(key, expires_at)
+
+    def get_processed(self, kind):
+        if kind == 'pokemon':
+            return self.processed_pokemons
+        elif kind == 'raid':
+            return self.processed_raids
+        else:
+            return self.processed_eggs
+
+    def set_processed(self, kind, key, expires_at):
+        self.get_processed(kind).add(key, expires_at)
+        if self.state is not None:
+            self.state.add(kind, key, expires_at)
+
+    def set_gym(self, gym_id, gym):
+        self.gyms[gym_id] = gym
+        if self.state is not None:
+            self.state.set_gym(gym_id, gym)
+
+    def set_config(self, config):
+        # the dedupe state and gyms don't depend on the config and are kept
+        self.config.locations.save_cache()
+        self.config = config
+
+    def clean(self, now=None):
+        """
+        Forgets the pokemon, raids and eggs that are gone. Cheap enough to call every second
+        """
+        now = now if now is not None else time.time()
+        self.processed_pokemons.advance(now)
+        self.processed_raids.advance(now)
+        self.processed_eggs.advance(now)
+
+        if now >= self.next_cache_save:
+            self.config.locations.save_cache()
+            self.next_cache_save = now + CACHE_SAVE_INTERVAL
+
+        if self.state is not None and now >= self.next_state_save:
+            self.state.save(now)
+            self.next_state_save = now + STATE_SAVE_INTERVAL
 
     def handle_pokemon(self, message):
         if message['encounter_id'] in self.processed_pokemons:
             log.debug('Encounter ID %s already processed.', message['encounter_id'])
             return
 
-        self.processed_pokemons[message['encounter_id']] = \
-            datetime.datetime.utcfromtimestamp(message['disappear_time'])
+        self.set_processed('pokemon', message['encounter_id'], message['disappear_time'])
 
         # initialize the pokemon dict
         pokemon = {
             'id': message['pokemon_id'],
-            'name': get_pokemon_name(message['pokemon_id']),
             'lat': message['latitude'],
-            'lon': message['longitude']
+            'lon': message['longitude'],
+            'spawnpoint_id': message.get('spawnpoint_id')
         }
 
         if message.get('cp') is not None:
@@ -74,58 +112,67 @@ class Handler:
             pokemon['stamina'] = stamina
             pokemon['iv'] = iv
 
-        # add moves to pokemon dict if found
-        move_1, move_2 = None, None
+        # add move ids to pokemon dict if found. names are resolved when notifying
         if message.get('move_1') is not None:
-            move_1 = get_move_name(message['move_1'])
+            pokemon['move_1_id'] = message['move_1']
         if message.get('move_2') is not None:
-            move_2 = get_move_name(message['move_2'])
+            pokemon['move_2_id'] = message['move_2']
 
-        if move_1 is not None:
-            pokemon['move_1'] = move_1
-        if move_2 is not None:
-            pokemon['move_2'] = move_2
+        if self.config.subscription_index is not None and not self.config.explain:
+            to_notify = self.config.subscription_index.get_notification_settings(pokemon)
+        else:
+            to_notify = self.get_pokemon_notification_settings(pokemon)
+
+        for key in MATCHING_KEYS:
+            pokemon.pop(key, None)
+
+        if to_notify:
+            log.info('Notifying to %s', to_notify)
+            for notification_setting_ref in to_notify:
+                notification_setting = self.config.notification_settings.get(notification_setting_ref)
+                self.notifier.notify_pokemon(pokemon, message, notification_setting)
 
+    def get_pokemon_notification_settings(self, pokemon):
         to_notify = set([])
 
-        # Loop through all active includes and send notifications if appropriate
-        for include_ref in self.config.pokemon_includes:
-            include = self.config.pokemon_includes.get(include_ref)
+        # Loop through the includes with rules that can apply to this species and send notifications if appropriate
+        for include_ref, include in self.config.pokemon_rule_index.candidates(pokemon['id']):
+            notification_setting_refs = self.config.pokemon_includes_to_notifications.get(include_ref)
+
+            # nothing to gain from this include if all its notification settings are already notified
+            if not self.config.explain and to_notify.issuperset(notification_setting_refs or []):
+                continue
+
             match = self.is_included_pokemon(pokemon, include)
 
             if match:
-                notification_setting_refs = self.config.pokemon_includes_to_notifications.get(include_ref)
-
                 if notification_setting_refs is not None:
                     for notification_setting_ref in notification_setting_refs:
                         to_notify.add(notification_setting_ref)
             else:
-                log.debug('No match for %s in %s', pokemon['name'], include_ref)
+                log.debug('No match for pokemon %s in %s', pokemon['id'], include_ref)
 
-        if to_notify:
-            log.info('Notifying to %s', to_notify)
-            for notification_setting_ref in to_notify:
-                notification_setting = self.config.notification_settings.get(notification_setting_ref)
-                self.notifier.notify_pokemon(pokemon, message, notification_setting)
+        return to_notify
 
     def handle_gym_details(self, message):
         parsed_gym = message['id']
-        if parsed_gym not in self.gyms:
-            # first scan of this gym
-            self.gyms[parsed_gym] = {
+        # the ingest stage leaves out the pokemon if no trainers are tracked, None stores them as unknown
+        trainers = [p['trainer_name'] for p in message['pokemon']] if 'pokemon' in message else None
+
+        if parsed_gym not in self.gyms or self.gyms[parsed_gym].get('trainers') is None or trainers is None:
+            # first scan of this gym, or of its trainers
+            self.set_gym(parsed_gym, {
                 'name': message['name'],
                 'lat': message['latitude'],
                 'lon': message['longitude'],
                 'team': message['team'],
-                'pokemons': message['pokemon'],
-                'trainers': [p['trainer_name'] for p in message['pokemon']]
-            }
+                'trainers': trainers
+            })
 
             # no further parsing. we only detect changes from here
             return
 
         gym = self.gyms[parsed_gym]
-        trainers = [p['trainer_name'] for p in message['pokemon']]
 
         for notification_settings in self.config.notification_settings.itervalues():
             if not notification_settings.get('gym'):
@@ -158,14 +205,13 @@ class Handler:
                         self.notifier.notify_gym(data, notification_settings)
 
         # finally update the gym for next time
-        self.gyms[parsed_gym] = {
+        self.set_gym(parsed_gym, {
             'name': message['name'],
             'lat': message['latitude'],
             'lon': message['longitude'],
             'team': message['team'],
-            'pokemons': message['pokemon'],
-            'trainers': [p['trainer_name'] for p in message['pokemon']]
-        }
+            'trainers': trainers
+        })
 
     def handle_raid(self, message):
         egg = message['pokemon_id'] is None
@@ -174,12 +220,12 @@ class Handler:
             if key in self.processed_eggs:
                 log.debug('Egg [%s] already processed.', key)
                 return
-            self.processed_eggs[key] = datetime.datetime.utcfromtimestamp(message['end'])
+            self.set_processed('egg', key, message['end'])
         else:
             if key in self.processed_raids:
                 log.debug('Raid [%s] already processed.', key)
                 return
-            self.processed_raids[key] = datetime.datetime.utcfromtimestamp(message['end'])
+            self.set_processed('raid', key, message['end'])
 
         raid = {
             'lat': message['latitude'],
@@ -193,30 +239,33 @@ class Handler:
             'egg': egg
         }
 
-        if egg:
-            raid['name'] = "Egg"
-        else:
+        if not egg:
             raid['id'] = message['pokemon_id']
-            raid['name'] = get_pokemon_name(message['pokemon_id'])
             raid['cp'] = message['cp']
-            raid['move_1'] = get_move_name(message['move_1'])
-            raid['move_2'] = get_move_name(message['move_2'])
+            raid['move_1_id'] = message['move_1']
+            raid['move_2_id'] = message['move_2']
 
         to_notify = set([])
 
-        # Loop through all active includes and send notifications if appropriate
-        for include_ref in self.config.raid_includes:
-            include = self.config.raid_includes.get(include_ref)
-            match = self.is_included_raid(raid, include)
+        # Loop through the includes that can apply to this level and boss and send notifications if appropriate
+        for include_ref, include, pokemon_rules in self.config.raid_rule_index.candidates(raid):
+            notification_setting_refs = self.config.raid_includes_to_notifications.get(include_ref)
 
-            if match:
-                notification_setting_refs = self.config.raid_includes_to_notifications.get(include_ref)
+            # nothing to gain from this include if all its notification settings are already notified
+            if not self.config.explain and to_notify.issuperset(notification_setting_refs or []):
+                continue
+
+            match = self.is_included_raid(raid, include, pokemon_rules)
 
+            if match:
                 if notification_setting_refs is not None:
                     for notification_setting_ref in notification_setting_refs:
                         to_notify.add(notification_setting_ref)
             else:
-                log.debug('No match for %s in %s', raid['name'], include_ref)
+                log.debug('No match for %s in %s', 'egg' if egg else raid['id'], include_ref)
+
+        for key in MATCHING_KEYS:
+            raid.pop(key, None)
 
         if to_notify:
             log.info('Notifying %s to %s', "egg" if egg else "raid", to_notify)
@@ -225,265 +274,69 @@ class Handler:
                 self.notifier.notify_raid_or_egg(raid, notification_setting)
 
     def is_included_pokemon(self, pokemon, included_list):
+        if not self.config.explain:
+            # fast path, stop at the first matching rule
+            for included_pokemon in included_list:
+                if included_pokemon.matches(pokemon):
+                    return True
+
+            return False
+
+        # explain mode: evaluate and log all matching rules
         matched = False
         for included_pokemon in included_list:
             match = self.pokemon_matches(pokemon, included_pokemon)
             if match[0]:
-                log.info(u"Found match for {} with rules: {}".format(pokemon['name'], match[1]))
+                log.info(u"Found match for pokemon {} with rules: {}".format(pokemon['id'], match[1]))
                 matched = True
 
         return matched
 
-    def raid_matches(self, raid, rules):
-        match_data = []
-
-        egg = raid['egg']
-
-        if egg and not rules.get('egg', True):
-            return False, None
-
-        if not egg and not rules.get('raid', True):
-            return False, None
-
-        levels = rules.get('levels')
-        if levels is not None:
-            if raid['level'] not in levels:
-                return False, None
-
-            match_data.append('levels')
+    def raid_matches(self, raid, rule, pokemon_rules):
+        """
+        Checks the parts of a raid include the index doesn't cover. pokemon_rules are the boss
+        restrictions left for this boss, one of them has to match.
+        """
+        match_data = ['levels'] if rule.levels is not None else []
 
-        if 'geofence' in rules:
-            if not self.is_inside_geofence(rules['geofence'], raid.get('lat'), raid.get('lon')):
+        if rule.location_bits is not None:
+            if self.config.locations.get_mask(raid) & rule.location_bits != rule.location_bits:
                 return False, None
 
-            match_data.append('geofence')
+            match_data.append('location')
 
-        # only process pokemon rules if it's not an egg
-        if not egg:
-            pokemons = rules.get('pokemons', {})
-            for pokemon_rules in pokemons:
-                name = pokemon_rules.get('name')
-                if name is not None:
-                    if name != raid['name']:
-                        return False, None
-                    else:
-                        match_data.append('name')
-
-                # check cp at level
-                min_cp = pokemon_rules.get('min_cp')
-                if min_cp is not None:
-                    if raid['cp'] < min_cp:
-                        return False, None
-
-                    match_data.append('min_cp')
-
-                max_cp = pokemon_rules.get('max_cp')
-                if max_cp is not None:
-                    if raid['cp'] > max_cp:
-                        return False, None
-
-                    match_data.append('max_cp')
-
-                if 'moves' in pokemon_rules:
-                    moves = pokemon_rules['moves']
-                    moves_match = False
-                    for move_set in moves:
-                        move_1 = move_set.get('move_1')
-                        move_2 = move_set.get('move_2')
-                        move_1_match = move_1 is None or move_1 == raid['move_1']
-                        move_2_match = move_2 is None or move_2 == raid['move_2']
-                        if move_1_match and move_2_match:
-                            moves_match = True
-                            break
-                    if not moves_match:
-                        return False, None
+        if not pokemon_rules:
+            return True, match_data
 
-                    match_data.append('moves')
+        for pokemon_rule in pokemon_rules:
+            if pokemon_rule.matches(raid):
+                if pokemon_rule.pokemon_id is not None:
+                    match_data.append('name')
+                match_data.extend(key for key in ['min_cp', 'max_cp', 'moves'] if key in pokemon_rule.rules)
+                return True, match_data
 
-        return True, match_data
+        return False, None
 
-    def pokemon_matches(self, pokemon, pokemon_rules):
+    @staticmethod
+    def pokemon_matches(pokemon, rule):
         match_data = []
 
-        # check name. if name specification doesn't exist, it counts as valid
-        name = pokemon_rules.get('name')
-        if name is not None:
-            if name != pokemon['name']:
-                return False, None
-            else:
-                match_data.append('name')
-
-        # check latitude
-        if not Handler.check_min_max('lat', pokemon_rules, pokemon, match_data):
-            return False, None
-
-        # check longitude
-        if not Handler.check_min_max('lon', pokemon_rules, pokemon, match_data):
-            return False, None
-
-        # check id
-        if not Handler.check_min_max('id', pokemon_rules, pokemon, match_data):
-            return False, None
-
-        # check iv
-        if not Handler.check_min_max('iv', pokemon_rules, pokemon, match_data):
-            return False, None
-
-        # check attack
-        if not Handler.check_min_max('attack', pokemon_rules, pokemon, match_data):
-            return False, None
-
-        # check defense
-        if not Handler.check_min_max('defense', pokemon_rules, pokemon, match_data):
-            return False, None
-
-        # check stamina
-        if not Handler.check_min_max('stamina', pokemon_rules, pokemon, match_data):
-            return False, None
-
-        # check level (raids)
-        if not Handler.check_min_max('level', pokemon_rules, pokemon, match_data):
-            return False, None
-
-        # check cp at level
-        min_cp = pokemon_rules.get('min_cp')
-        if min_cp is not None:
-            if 'attack' not in pokemon or 'defense' not in pokemon or 'stamina' not in pokemon:
-                return False, None
-
-            for level in min_cp:
-                required_cp = min_cp[level]
-                cp = get_cp_for_level(pokemon['id'], int(level), pokemon['attack'], pokemon['defense'],
-                                      pokemon['stamina'])
-                if cp < required_cp:
-                    return False, None
-
-            match_data.append('min_cp')
-
-        max_cp = pokemon_rules.get('max_cp')
-        if max_cp is not None:
-            if 'attack' not in pokemon or 'defense' not in pokemon or 'stamina' not in pokemon:
-                return False, None
-
-            for level in max_cp:
-                required_cp = max_cp[level]
-                cp = get_cp_for_level(pokemon['id'], level, pokemon['attack'], pokemon['defense'], pokemon['stamina'])
-                if cp < required_cp:
-                    return False, None
-
-            match_data.append('max_cp')
-
-        # check hp at level
-        min_hp = pokemon_rules.get('min_hp')
-        if min_hp is not None:
-            if 'stamina' not in pokemon:
+        # the predicates only cover the constraints set in the rule, most selective first
+        for key, predicate in rule.predicates:
+            if not predicate(pokemon):
                 return False, None
 
-            for level in min_hp:
-                required_hp = min_hp[level]
-                hp = get_hp_for_level(pokemon['id'], int(level), pokemon['stamina'])
-                if hp < required_hp:
-                    return False, None
-
-            match_data.append('min_hp')
-
-        max_hp = pokemon_rules.get('max_hp')
-        if max_hp is not None:
-            if 'stamina' not in pokemon:
-                return False, None
-
-            for level in max_hp:
-                required_hp = max_hp[level]
-                hp = get_hp_for_level(pokemon['id'], level, pokemon['stamina'])
-                if hp < required_hp:
-                    return False, None
-
-            match_data.append('max_hp')
-
-        # check moves
-        if 'moves' in pokemon_rules:
-            moves = pokemon_rules['moves']
-            moves_match = False
-            for move_set in moves:
-                move_1 = move_set.get('move_1')
-                move_2 = move_set.get('move_2')
-                move_1_match = move_1 is None or move_1 == pokemon.get('move_1')
-                move_2_match = move_2 is None or move_2 == pokemon.get('move_2')
-                if move_1_match and move_2_match:
-                    moves_match = True
-                    break
-            if not moves_match:
-                return False, None
-
-            match_data.append('moves')
-
-        if 'geofence' in pokemon_rules:
-            if not self.is_inside_geofence(pokemon_rules['geofence'], pokemon.get('lat'), pokemon.get('lon')):
-                return False, None
-
-            match_data.append('geofence')
+            match_data.append(key)
 
         # Passed all checks. This pokemon matches!
         return True, match_data
 
-    @staticmethod
-    def check_min(config_key, included_pokemon, message_key, pokemon, match_data):
-        required_value = included_pokemon.get(config_key)
-        if required_value is None:
-            return True
-
-        pokemon_value = pokemon.get(message_key, -1)
-        if pokemon_value < required_value:
-            return False
-
-        match_data.append(config_key)
-        return True
-
-    @staticmethod
-    def check_max(config_key, included_pokemon, message_key, pokemon, match_data):
-        required_value = included_pokemon.get(config_key)
-        if required_value is None:
-            return True
-
-        pokemon_value = pokemon.get(message_key, 99999)
-        if pokemon_value > required_value:
-            return False
-
-        match_data.append(config_key)
-        return True
-
-    @staticmethod
-    def check_min_max(key, included_pokemon, pokemon, match_data):
-        """
-        Returns True if included_pokemon matches the given pokemon
-        """
-        check_min = Handler.check_min('min_' + key, included_pokemon, key, pokemon, match_data)
-        check_max = Handler.check_max('max_' + key, included_pokemon, key, pokemon, match_data)
-        return check_min and check_max
-
-    def is_included_raid(self, raid, included_list):
-        match = self.raid_matches(raid, included_list)
+    def is_included_raid(self, raid, rule, pokemon_rules):
+        match = self.raid_matches(raid, rule, pokemon_rules)
         if match[0]:
-            log.info(
-                u"Found raid match for {} with rules: {}".format("Egg" if raid['egg'] else raid['name'], match[1]))
+            if self.config.explain:
+                log.info(u"Found raid match for {} with rules: {}".format("egg" if raid['egg'] else raid['id'],
+                                                                         match[1]))
             return True
 
         return False
-
-    def is_inside_geofence(self, geofence_name, lat, lon):
-        geofence = self.config.geofences.get(geofence_name)
-        if geofence is None:
-            log.warning("geofence {} not found", geofence_name)
-            return False
-
-        # fast boundaries check
-        boundaries = geofence['boundaries']
-        min_x = boundaries['min'][0]
-        min_y = boundaries['min'][1]
-        max_x = boundaries['max'][0]
-        max_y = boundaries['max'][1]
-
-        if lat < min_x or lat > max_x or lon < min_y or lon > max_y:
-            return False
-
-        return is_inside_polygon(geofence['polygon'], lat, lon)
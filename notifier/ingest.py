@@ -0,0 +1,281 @@
+from .expiry import EncounterIds, ExpiringKeys
+import json
+import logging
+import Queue
+import time
+import zlib
+
+log = logging.getLogger(__name__)
+
+# what to do with a frame when the queue is full
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+DROP_EXPIRED = 'drop_expired'
+POLICIES = [BLOCK, DROP_OLDEST, DROP_EXPIRED]
+
+# fields of gym_details messages read by the handler, the pokemon are reduced to their trainer
+GYM_FIELDS = ['id', 'name', 'latitude', 'longitude', 'team']
+
+
+def decode_frames(request_body):
+    """
+    Returns the frames of a webhook request body, which holds either one frame or a list of them
+    """
+    data = json.loads(request_body)
+    return [data] if type(data) == dict else data
+
+
+def get_frame_key(data):
+    """
+    Returns the id frames are routed to a shard by: the encounter id of pokemon, the gym id of raids
+    and gyms. None for other frames
+    """
+    message = data.get('message') or {}
+    message_type = data.get('type')
+
+    if message_type == 'pokemon':
+        return message.get('encounter_id')
+    elif message_type == 'raid':
+        return message.get('gym_id')
+    elif message_type == 'gym_details':
+        return message.get('id')
+
+    return None
+
+
+def get_shard(data, shard_count):
+    """
+    Returns the shard of a frame, the same for all frames of an encounter or gym
+    """
+    key = get_frame_key(data)
+    if key is None:
+        return 0
+
+    key = key.encode('utf-8') if isinstance(key, unicode) else str(key)
+    return (zlib.crc32(key) & 0xffffffff) % shard_count
+
+
+def get_frame_expiry(data):
+    """
+    Returns the epoch seconds after which a webhook frame is useless, or None if it doesn't expire
+    """
+    message = data.get('message') or {}
+    message_type = data.get('type')
+
+    if message_type == 'pokemon':
+        return message.get('disappear_time')
+    elif message_type == 'raid':
+        return message.get('end')
+
+    return None
+
+
+class FrameFilter:
+    """
+    Drops webhook frames of types no include or notification setting of a config can use, and strips
+    gym_details frames down to the fields the handler reads.
+
+    The trainers in gyms are kept whenever trainers are listed, so they are known once a notification
+    setting turns on gym notifications. Otherwise the pokemon are left out and the handler stores
+    the trainers as unknown.
+    """
+
+    def __init__(self, config):
+        self.track_trainers = bool(config.trainers)
+
+        self.types = set()
+        if config.pokemon_includes:
+            self.types.add('pokemon')
+        if config.raid_includes:
+            self.types.add('raid')
+        # raids show the name of their gym
+        if config.raid_includes or self.track_trainers:
+            self.types.add('gym_details')
+
+    def apply(self, data):
+        """
+        Returns the frame to queue, or None if it's of no use
+        """
+        message_type = data.get('type')
+        if message_type not in self.types:
+            return None
+
+        if message_type == 'gym_details':
+            message = data['message']
+            gym = dict((field, message.get(field)) for field in GYM_FIELDS)
+            if self.track_trainers:
+                gym['pokemon'] = [{'trainer_name': p.get('trainer_name')} for p in message.get('pokemon', [])]
+
+            return {'type': message_type, 'message': gym}
+
+        return data
+
+
+class DuplicateFilter:
+    """
+    Drops pokemon, raid and egg frames that were seen before, so copies resent by the scanner are
+    never queued. Keys are the encounter id and gym id plus start, like the handler uses, and are
+    kept until the pokemon or raid ends.
+    """
+
+    def __init__(self):
+        self.pokemons = EncounterIds()
+        self.raids = ExpiringKeys()
+        self.eggs = ExpiringKeys()
+        self.checked = 0
+        self.duplicates = 0
+
+    def get_entry(self, data):
+        """
+        Returns the keys of data's kind, its key and its expiry, or None if it's left to the handler
+        """
+        message = data.get('message') or {}
+        message_type = data.get('type')
+
+        if message_type == 'pokemon':
+            seen = self.pokemons
+            key = message.get('encounter_id')
+            expires_at = message.get('disappear_time')
+        elif message_type == 'raid':
+            seen = self.eggs if message.get('pokemon_id') is None else self.raids
+            key = message.get('gym_id') + str(message.get('start')) if message.get('gym_id') else None
+            expires_at = message.get('end')
+        else:
+            return None
+
+        if key is None or expires_at is None:
+            return None
+
+        return seen, key, expires_at
+
+    def is_duplicate(self, data):
+        entry = self.get_entry(data)
+        if entry is None:
+            return False
+
+        seen, key, expires_at = entry
+        self.checked += 1
+        if key in seen:
+            self.duplicates += 1
+            return True
+
+        seen.add(key, expires_at)
+        return False
+
+    def forget(self, data):
+        """
+        Forgets the key of a frame that was dropped before the handler saw it, so the next copy is kept
+        """
+        entry = self.get_entry(data)
+        if entry is not None:
+            seen, key, _ = entry
+            seen.discard(key)
+
+    def clean(self, now=None):
+        self.pokemons.advance(now)
+        self.raids.advance(now)
+        self.eggs.advance(now)
+
+    def get_stats(self):
+        return {
+            'duplicates': self.duplicates,
+            'duplicate_ratio': self.duplicates / float(self.checked) if self.checked else 0.0
+        }
+
+
+class IngestQueue(Queue.Queue):
+    """
+    Queue of webhook frames between the receiver and the notifier thread, bounded by maxsize.
+
+    When it's full, the block policy makes the receiver wait. drop_oldest drops the oldest frame to
+    make room. drop_expired also drops pokemon and raid frames with less than min_time_left seconds
+    left, when they come in and when they are taken out, and only drops the oldest frame if that
+    doesn't make enough room. Dropped frames are counted in shed.
+
+    on_shed is called with every frame put() drops, in the thread that puts frames.
+    """
+
+    def __init__(self, maxsize=0, policy=BLOCK, min_time_left=0, on_shed=None):
+        Queue.Queue.__init__(self, maxsize)
+
+        if policy not in POLICIES:
+            raise RuntimeError('Unknown queue policy %s, use one of %s' % (policy, ', '.join(POLICIES)))
+
+        self.policy = policy
+        self.min_time_left = min_time_left
+        self.on_shed = on_shed
+        self.received = 0
+        self.shed = {'oldest': 0, 'expired': 0}
+
+    def is_expired(self, data, now):
+        expiry = get_frame_expiry(data)
+        return expiry is not None and expiry - now < self.min_time_left
+
+    def put(self, item, block=True, timeout=None):
+        if self.policy == BLOCK:
+            with self.mutex:
+                self.received += 1
+            return Queue.Queue.put(self, item, block, timeout)
+
+        with self.mutex:
+            self.received += 1
+            now = time.time()
+
+            if self.policy == DROP_EXPIRED and self.is_expired(item, now):
+                self.shed['expired'] += 1
+                self.dropped(item)
+                return
+
+            if 0 < self.maxsize <= self._qsize():
+                if self.policy == DROP_EXPIRED:
+                    self.drop_expired(now)
+
+                while self._qsize() >= self.maxsize:
+                    self.dropped(self._get())
+                    self.unfinished_tasks -= 1
+                    self.shed['oldest'] += 1
+
+            self._put(item)
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
+    def drop_expired(self, now):
+        # only called from put(), with the mutex held
+        kept = type(self.queue)()
+        for item in self.queue:
+            if self.is_expired(item, now):
+                self.unfinished_tasks -= 1
+                self.shed['expired'] += 1
+                self.dropped(item)
+            else:
+                kept.append(item)
+
+        self.queue = kept
+
+    def dropped(self, item):
+        if self.on_shed is not None:
+            self.on_shed(item)
+
+    def get(self, block=True, timeout=None):
+        while True:
+            item = Queue.Queue.get(self, block, timeout)
+            if self.policy != DROP_EXPIRED or not self.is_expired(item, time.time()):
+                return item
+
+            # never handed out, so never marked done
+            with self.mutex:
+                self.unfinished_tasks -= 1
+                self.shed['expired'] += 1
+                if self.unfinished_tasks == 0:
+                    self.all_tasks_done.notify_all()
+
+    def get_stats(self):
+        with self.mutex:
+            return {
+                'received': self.received,
+                'queued': self._qsize(),
+                'max_size': self.maxsize,
+                'policy': self.policy,
+                'shed_oldest': self.shed['oldest'],
+                'shed_expired': self.shed['expired']
+            }
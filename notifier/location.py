@@ -0,0 +1,196 @@
+from collections import OrderedDict
+import cPickle as pickle
+import gpxpy.geo
+import logging
+import math
+import os
+
+log = logging.getLogger(__name__)
+
+# location dependent constraints of pokemon and raid rules
+LOCATION_KEYS = ['min_lat', 'max_lat', 'min_lon', 'max_lon', 'max_dist', 'geofence']
+
+DEFAULT_CACHE_SIZE = 100000
+
+# raids and pokemon without a spawnpoint are cached by their rounded coordinates
+COORDINATE_DIGITS = 6
+
+# same radius as gpxpy uses for haversine distances
+EARTH_RADIUS = gpxpy.geo.EARTH_RADIUS
+METERS_PER_DEGREE = EARTH_RADIUS * math.pi / 180
+
+# relative error of the equirectangular approximation accepted without an exact check
+DISTANCE_MARGIN = 0.01
+
+
+class DistanceConstraint:
+    """
+    Checks that a location is within max_dist meters of a center.
+
+    Locations outside a bounding box in degrees are rejected right away, and an equirectangular
+    approximation decides the rest. The exact haversine distance is only computed near the boundary.
+    """
+
+    def __init__(self, center_lat, center_lon, max_dist):
+        self.center_lat = center_lat
+        self.center_lon = center_lon
+        self.max_dist = max_dist
+
+        cos_lat = max(math.cos(math.radians(center_lat)), 1e-6)
+        self.max_dlat = max_dist / METERS_PER_DEGREE
+        self.max_dlon = min(180.0, self.max_dlat / cos_lat)
+
+        # compared to squared distances in degrees, to avoid sqrt
+        self.inner = (max_dist * (1 - DISTANCE_MARGIN) / METERS_PER_DEGREE) ** 2
+        self.outer = (max_dist * (1 + DISTANCE_MARGIN) / METERS_PER_DEGREE) ** 2
+
+    def contains(self, lat, lon):
+        dlat = lat - self.center_lat
+        dlon = (lon - self.center_lon + 180) % 360 - 180
+        if abs(dlat) > self.max_dlat or abs(dlon) > self.max_dlon:
+            return False
+
+        dx = dlon * math.cos(math.radians((lat + self.center_lat) / 2))
+        distance = dlat * dlat + dx * dx
+        if distance <= self.inner:
+            return True
+        if distance > self.outer:
+            return False
+
+        return gpxpy.geo.haversine_distance(self.center_lat, self.center_lon, lat, lon) <= self.max_dist
+
+
+class LocationConstraints:
+    """
+    All distinct location constraints of the configured rules, each assigned a bit.
+
+    A location is evaluated against every constraint at once, and the resulting bitmask is cached by
+    spawnpoint id, or rounded coordinates for raids, since those never move. A rule then only checks
+    that the bits of its own constraints are set.
+    """
+
+    def __init__(self, geofence_index, cache_size=DEFAULT_CACHE_SIZE, cache_file=None):
+        self.geofence_index = geofence_index
+        self.constraints = []
+        self.bits = {}
+        self.distances = {}
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.cache_file = cache_file
+
+    def register(self, key, value):
+        """
+        Returns the bit of a location constraint, e.g. ('min_lat', 12.5), ('geofence', 'Someplace')
+        or ('max_dist', (center_lat, center_lon, meters))
+        """
+        constraint = (key, value)
+        bit = self.bits.get(constraint)
+        if bit is None:
+            if key == 'geofence' and value not in self.geofence_index.geofences:
+                log.warning('geofence %s not found', value)
+
+            if key == 'max_dist':
+                self.distances[constraint] = DistanceConstraint(*value)
+
+            bit = self.bits[constraint] = 1 << len(self.constraints)
+            self.constraints.append(constraint)
+
+        return bit
+
+    def evaluate(self, lat, lon):
+        """
+        Returns the bitmask of all constraints that pass for lat, lon
+        """
+        mask = 0
+        geofences = None
+        for bit, (key, value) in enumerate(self.constraints):
+            if key == 'min_lat':
+                passed = lat >= value
+            elif key == 'max_lat':
+                passed = lat <= value
+            elif key == 'min_lon':
+                passed = lon >= value
+            elif key == 'max_lon':
+                passed = lon <= value
+            elif key == 'max_dist':
+                passed = self.distances[(key, value)].contains(lat, lon)
+            else:
+                if geofences is None:
+                    geofences = self.geofence_index.lookup(lat, lon)
+                passed = value in geofences
+
+            if passed:
+                mask |= 1 << bit
+
+        return mask
+
+    def get_mask(self, item):
+        """
+        Returns the constraint bitmask of a pokemon or raid dict. The result is kept in the dict,
+        so all rules checked for a message share a single lookup.
+        """
+        mask = item.get('location_mask')
+        if mask is not None:
+            return mask
+
+        lat, lon = item['lat'], item['lon']
+        key = item.get('spawnpoint_id') or (round(lat, COORDINATE_DIGITS), round(lon, COORDINATE_DIGITS))
+
+        mask = self.cache.pop(key, None)
+        if mask is None:
+            mask = self.evaluate(lat, lon)
+            if len(self.cache) >= self.cache_size:
+                self.cache.popitem(last=False)
+
+        # most recently used last
+        self.cache[key] = mask
+        item['location_mask'] = mask
+        return mask
+
+    def load_cache(self):
+        """
+        Loads cached masks from cache_file, if it was written for the same constraints
+        """
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return
+
+        try:
+            with open(self.cache_file, 'rb') as f:
+                cached = pickle.load(f)
+        except Exception:
+            log.exception('Could not read location cache %s', self.cache_file)
+            return
+
+        if cached.get('constraints') != self.get_fingerprint():
+            log.info('Location cache %s is outdated', self.cache_file)
+            return
+
+        for key, mask in cached['masks'][-self.cache_size:]:
+            self.cache[key] = mask
+
+        log.info('Loaded %d cached locations from %s', len(self.cache), self.cache_file)
+
+    def save_cache(self):
+        if self.cache_file is None:
+            return
+
+        cached = {
+            'constraints': self.get_fingerprint(),
+            'masks': self.cache.items()
+        }
+
+        # write and rename, so a crash never leaves a partial cache behind
+        tmp_file = self.cache_file + '.tmp'
+        try:
+            with open(tmp_file, 'wb') as f:
+                pickle.dump(cached, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_file, self.cache_file)
+        except (IOError, OSError):
+            log.exception('Could not write location cache %s', self.cache_file)
+
+    def get_fingerprint(self):
+        # the masks are only valid for the same constraints and fences
+        fences = [(name, self.geofence_index.geofences[name]['polygon'])
+                  for key, name in self.constraints
+                  if key == 'geofence' and name in self.geofence_index.geofences]
+        return self.constraints, fences
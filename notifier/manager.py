@@ -1,46 +1,346 @@
-from threading import Thread
+from threading import Lock, Thread
 from .config import Config
 from .handler import Handler
+from .ingest import DROP_OLDEST, DuplicateFilter, FrameFilter, IngestQueue, decode_frames, get_shard
 from .notifier import Notifier
+from .state import HandlerState
 from .utils import *
+import copy
+import itertools
 import logging
+import multiprocessing
 import Queue
+import signal
+import time
 
 log = logging.getLogger(__name__)
 
+# seconds between cleanups of the processed pokemon, raids and eggs
+CLEAN_INTERVAL = 1
+
+# seconds between logs of the queue stats, if frames were dropped
+STATS_INTERVAL = 60
+
+# frames routed to a shard at once, and batches waiting per shard before the notifier thread blocks
+BATCH_SIZE = 100
+SHARD_QUEUE_SIZE = 100
+
+# seconds between checks whether a shard is still alive while its queue is full
+SHARD_PUT_TIMEOUT = 5
+
+# queued to each shard after a reload, for the shards to load the config themselves on a thread
+RELOAD = 'reload'
+
+
+class Shard:
+    """
+    A worker process with its own Handler, fed with batches of frames through a queue
+    """
+
+    def __init__(self, index, target):
+        self.index = index
+        self.queue = multiprocessing.JoinableQueue(SHARD_QUEUE_SIZE)
+        self.routed = 0
+        # written by the shard only
+        self.handled = multiprocessing.Value('L', 0, lock=False)
+        self.process = multiprocessing.Process(target=target, args=(index, self.queue, self.handled),
+                                               name='Shard %d' % index)
+        self.process.daemon = True
+
+    def get_stats(self):
+        return {'routed': self.routed, 'queued': self.routed - self.handled.value}
+
 
 class NotifierManager(Thread):
-    def __init__(self, config_file):
+    def __init__(self, config_file, snapshot_file=None):
         super(NotifierManager, self).__init__()
 
         self.daemon = True
         self.name = "Notifier"
 
-        self.config = Config(config_file)
+        # the config parsing modifies a config dict, keep the original for reloads
+        self.config_file = copy.deepcopy(config_file)
+        self.snapshot_file = snapshot_file
+        self.config = Config(config_file, snapshot_file)
         self.notifier = Notifier(self.config)
-        self.handler = Handler(self.config, self.notifier)
 
-        self.queue = Queue.Queue()
+        # with several workers, frames are routed by encounter or gym id to shard processes, which
+        # create their own handler. otherwise they are handled by this thread
+        self.shards = []
+        self.shard_index = None
+        if self.config.workers > 1:
+            self.handler = None
+            self.shards = [Shard(index, self.run_shard) for index in range(0, self.config.workers)]
+        else:
+            self.handler = Handler(self.config, self.notifier, self.get_state())
+
+        # a reloaded config waiting to be swapped in by the notifier thread
+        self.pending_config = None
+        self.reload_lock = Lock()
+
+        # frames of types nothing in the config uses are dropped before they are queued
+        self.frame_filter = FrameFilter(self.config)
+        self.filtered = 0
+        # copies of frames queued before are dropped as well
+        self.duplicate_filter = DuplicateFilter()
+        self.queue = IngestQueue(self.config.queue_size, self.config.queue_policy, self.config.queue_min_time_left,
+                                 self.duplicate_filter.forget)
+
+        # request bodies waiting for the decoder thread, if decoding is deferred. the receiver must
+        # never wait for room, and bodies can't be judged before decoding, so the oldest one is shed
+        self.raw_queue = None
+        self.decoder = None
+        if self.config.defer_decode:
+            self.raw_queue = IngestQueue(self.config.raw_queue_size, DROP_OLDEST)
+            self.decoder = Thread(target=self.decode, name='Decoder')
+            self.decoder.daemon = True
+
+    def start(self):
+        # fork the shards before any other thread runs
+        for shard in self.shards:
+            shard.process.start()
+
+        if self.decoder is not None:
+            self.decoder.start()
+
+        super(NotifierManager, self).start()
 
     def run(self):
         log.info('Notifier thread started.')
 
+        next_clean = time.time() + CLEAN_INTERVAL
+        next_stats = time.time() + STATS_INTERVAL
+        shed = 0
         while True:
-            for i in range(0, 5000):
-                data = self.queue.get(block=True)
+            # wake up regularly, so expired entries are cleaned while no messages arrive
+            try:
+                data = self.queue.get(block=True, timeout=CLEAN_INTERVAL)
+            except Queue.Empty:
+                data = None
 
-                message_type = data.get('type')
+            if self.pending_config is not None:
+                self.swap_config()
 
-                if message_type == 'pokemon':
-                    self.handler.handle_pokemon(data['message'])
-                elif message_type == 'gym_details':
-                    self.handler.handle_gym_details(data['message'])
-                elif message_type == 'raid':
-                    self.handler.handle_raid(data['message'])
+            if data is not None:
+                if self.shards:
+                    self.route(data)
                 else:
-                    log.debug('Unsupported message type: %s', message_type)
-            self.handler.clean()
+                    self.handle(data)
+                    self.queue.task_done()
+
+            now = time.time()
+            if now >= next_clean and self.handler is not None:
+                self.handler.clean(now)
+                next_clean = now + CLEAN_INTERVAL
+
+            if now >= next_stats:
+                stats = self.get_stats()
+                total_shed = stats['shed_oldest'] + stats['shed_expired'] + stats.get('raw_shed', 0)
+                if total_shed > shed:
+                    log.warning('Dropped frames, queue stats: %s', stats)
+                    shed = total_shed
+                next_stats = now + STATS_INTERVAL
+
+    def route(self, data):
+        """
+        Passes data and the frames queued after it to the shards, up to BATCH_SIZE frames
+        """
+        batches = [[] for _ in self.shards]
+        count = 0
+        while data is not None:
+            batches[get_shard(data, len(self.shards))].append(data)
+            count += 1
+            if count == BATCH_SIZE:
+                break
+
+            try:
+                data = self.queue.get(block=False)
+            except Queue.Empty:
+                data = None
+
+        for shard, batch in itertools.izip(self.shards, batches):
+            if batch:
+                self.put_batch(shard, batch)
+
+        for _ in itertools.repeat(None, count):
+            self.queue.task_done()
+
+    def put_batch(self, shard, batch):
+        """
+        Queues a batch to a shard, restarting the shard if its process died
+        """
+        while True:
+            if not shard.process.is_alive():
+                shard = self.restart_shard(shard)
+
+            try:
+                shard.queue.put(batch, timeout=SHARD_PUT_TIMEOUT)
+            except Queue.Full:
+                continue
+
+            shard.routed += len(batch)
+            return
+
+    def restart_shard(self, shard):
+        log.error('Shard %d died with exit code %s, restarting it. Lost up to %d frames', shard.index,
+                  shard.process.exitcode, shard.routed - shard.handled.value)
+
+        # the queue of the dead process may be left locked, the new one gets its own
+        restarted = Shard(shard.index, self.run_shard)
+        restarted.process.start()
+        self.shards[shard.index] = restarted
+        return restarted
+
+    def run_shard(self, index, queue, handled):
+        # runs in the shard process, on a copy of the manager. a HUP sent to the whole process group
+        # must not kill the shard, the reload reaches it through the queue
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        self.shards = []
+        self.shard_index = index
+        self.set_shard_config(self.config)
+        self.handler = Handler(self.config, self.notifier, self.get_state())
+        log.info('Shard %d started.', index)
+
+        next_clean = time.time() + CLEAN_INTERVAL
+        while True:
+            try:
+                batch = queue.get(block=True, timeout=CLEAN_INTERVAL)
+            except Queue.Empty:
+                batch = None
+
+            if self.pending_config is not None:
+                self.swap_config()
+
+            if batch == RELOAD:
+                # compiled on a thread of the shard, the batches behind it are handled meanwhile
+                self.reload()
+            elif batch is not None:
+                for data in batch:
+                    # a frame the handler chokes on must not take the shard down
+                    try:
+                        self.handle(data)
+                    except Exception:
+                        log.exception('Shard %d could not handle frame %r', index, data)
+                handled.value += len(batch)
+
+            if batch is not None:
+                queue.task_done()
+
+            now = time.time()
+            if now >= next_clean:
+                self.handler.clean(now)
+                next_clean = now + CLEAN_INTERVAL
+
+    def set_shard_config(self, config):
+        # the location cache is written by the first shard only, the others would overwrite it
+        if self.shard_index:
+            config.locations.cache_file = None
+
+    def get_state(self):
+        # the shards share the state file, each writes the keys of its own encounters and gyms
+        return HandlerState(self.config.state_file) if self.config.state_file is not None else None
+
+    def handle(self, data):
+        message_type = data.get('type')
+
+        if message_type == 'pokemon':
+            self.handler.handle_pokemon(data['message'])
+        elif message_type == 'gym_details':
+            self.handler.handle_gym_details(data['message'])
+        elif message_type == 'raid':
+            self.handler.handle_raid(data['message'])
+        else:
+            log.debug('Unsupported message type: %s', message_type)
+
+    def decode(self):
+        log.info('Decoder thread started.')
+
+        while True:
+            request_body = self.raw_queue.get()
+            try:
+                self.enqueue_frames(request_body)
+            except ValueError:
+                log.warning('Could not decode webhook body: %r', request_body[:100])
+            finally:
+                self.raw_queue.task_done()
+
+    def receive(self, request_body):
+        """
+        Queues the frames of a webhook request body, or with deferred decoding the body itself
+        """
+        if self.raw_queue is not None:
+            self.raw_queue.put(request_body)
+        else:
+            self.enqueue_frames(request_body)
+
+    def enqueue_frames(self, request_body):
+        frame_filter = self.frame_filter
+        self.duplicate_filter.clean()
+        for frame in decode_frames(request_body):
+            frame = frame_filter.apply(frame)
+            if frame is None:
+                self.filtered += 1
+            elif not self.duplicate_filter.is_duplicate(frame):
+                self.enqueue(frame)
 
     def enqueue(self, data):
         self.queue.put(data)
 
+    def get_stats(self):
+        stats = self.queue.get_stats()
+        stats['filtered'] = self.filtered
+        stats.update(self.duplicate_filter.get_stats())
+        if self.raw_queue is not None:
+            raw_stats = self.raw_queue.get_stats()
+            stats['raw_queued'] = raw_stats['queued']
+            stats['raw_shed'] = raw_stats['shed_oldest']
+        if self.shards:
+            stats['shards'] = [shard.get_stats() for shard in self.shards]
+
+        return stats
+
+    def reload(self):
+        """
+        Loads the config file again in a separate thread. The notifier thread switches to it before
+        the next message, messages keep being queued meanwhile. Shards load it again the same way
+        once the notifier thread switched.
+        """
+        thread = Thread(target=self.load_config, name='Config reload')
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def load_config(self):
+        with self.reload_lock:
+            log.info('Reloading %s', self.config_file)
+            try:
+                self.pending_config = Config(copy.deepcopy(self.config_file), self.snapshot_file)
+            except Exception:
+                log.exception('Could not reload %s, keeping the current config', self.config_file)
+
+    def swap_config(self):
+        # taken without waiting, a reload holding the lock stores a newer config that is swapped in later
+        if not self.reload_lock.acquire(False):
+            return
+        try:
+            config, self.pending_config = self.pending_config, None
+        finally:
+            self.reload_lock.release()
+
+        if config is None:
+            return
+
+        self.config = config
+        self.frame_filter = FrameFilter(config)
+        self.notifier.set_config(config)
+
+        if self.handler is not None:
+            self.set_shard_config(config)
+            self.handler.set_config(config)
+
+        # the shards follow, frames routed before keep the old config
+        for shard in self.shards:
+            shard.queue.put(RELOAD)
+
+        log.info('Switched to reloaded config')
+
@@ -7,10 +7,17 @@ log = logging.getLogger(__name__)
 class Notifier:
     def __init__(self, config):
         self.config = config
+        self.custom_notification_handlers = {}
 
     def set_notification_handler(self, name, handler):
+        self.custom_notification_handlers[name] = handler
         self.config.notification_handlers[name] = handler
 
+    def set_config(self, config):
+        # handlers set from outside survive a reload
+        config.notification_handlers.update(self.custom_notification_handlers)
+        self.config = config
+
     def notify_pokemon(self, pokemon, message, notification_setting):
         # find the handler and notify
         lat = message['latitude']
@@ -21,8 +28,17 @@ class Notifier:
             'time_left': get_time_left(message['disappear_time']),
             'google_maps': get_google_maps(lat, lon),
             'static_google_maps': get_static_google_maps(lat, lon, self.config.google_key),
-            'gamepress': get_gamepress(message['pokemon_id'])
+            'gamepress': get_gamepress(message['pokemon_id']),
+            'name': get_pokemon_name(pokemon['id'])
         }
+
+        # names are only needed for notifications, matching is done on ids. the ids are replaced, the
+        # names stay in the dict for further notification settings
+        if 'move_1_id' in pokemon:
+            data['move_1'] = get_move_name(pokemon.pop('move_1_id'))
+        if 'move_2_id' in pokemon:
+            data['move_2'] = get_move_name(pokemon.pop('move_2_id'))
+
         pokemon.update(data)
 
         # add sublocality
@@ -70,6 +86,14 @@ class Notifier:
             'static_google_maps': get_static_google_maps(lat, lon, self.config.google_key),
         })
 
+        # names are only needed for notifications, matching is done on ids
+        if raid['egg']:
+            raid['name'] = "Egg"
+        else:
+            raid['name'] = get_pokemon_name(raid['id'])
+            raid['move_1'] = get_move_name(raid.pop('move_1_id'))
+            raid['move_2'] = get_move_name(raid.pop('move_2_id'))
+
         if raid.get('id'):
             raid['gamepress'] = get_gamepress(raid['id'])
 
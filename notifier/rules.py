@@ -0,0 +1,655 @@
+from .gamedata import get_game_data, get_level_index
+from .location import LOCATION_KEYS
+from .tables import get_iv_index, iv_bitmaps
+from .utils import *
+import bisect
+import itertools
+import logging
+
+log = logging.getLogger(__name__)
+
+# order in which the constraints of a rule are checked. cheap and selective checks go first, so most
+# messages are rejected after one or two comparisons
+PREDICATE_ORDER = [
+    'name', 'min_id', 'max_id',
+    'min_iv', 'max_iv',
+    'min_attack', 'max_attack', 'min_defense', 'max_defense', 'min_stamina', 'max_stamina',
+    'min_level', 'max_level',
+    'moves',
+    'location',
+    'at_level'
+]
+
+# cp and hp at level constraints, combined into a single IV bitmap check
+AT_LEVEL_KEYS = ['min_cp', 'max_cp', 'min_hp', 'max_hp']
+
+
+def resolve_pokemon_name(name):
+    """
+    Returns the pokemon id for a name used in the config
+    """
+    pokemon_id = get_game_data().get_pokemon_id(name)
+    if pokemon_id is None:
+        raise RuntimeError('Unknown pokemon in config: %s' % name)
+
+    return pokemon_id
+
+
+def resolve_move_sets(moves):
+    """
+    Returns the move sets of a 'moves' rule as a list of (move_1 ids, move_2 ids), where ids is a
+    frozenset or None if any move matches
+    """
+    move_sets = []
+    for move_set in moves:
+        resolved = []
+        for key in ['move_1', 'move_2']:
+            name = move_set.get(key)
+            if name is None:
+                resolved.append(None)
+                continue
+
+            # fast and charged variants of a move can share the name
+            move_ids = get_game_data().get_move_ids(name)
+            if not move_ids:
+                raise RuntimeError('Unknown move in config: %s' % name)
+            resolved.append(frozenset(move_ids))
+
+        move_sets.append(tuple(resolved))
+
+    return move_sets
+
+
+def move_sets_match(move_sets, move_1, move_2):
+    for move_1_ids, move_2_ids in move_sets:
+        if (move_1_ids is None or move_1 in move_1_ids) and (move_2_ids is None or move_2 in move_2_ids):
+            return True
+
+    return False
+
+
+def get_location_constraint(key, rules):
+    """
+    Returns the value of a location constraint in rules, with the center of max_dist attached
+    """
+    if key != 'max_dist':
+        return rules[key]
+
+    center = rules.get('center')
+    if center is None or len(center) != 2:
+        raise RuntimeError('max_dist requires a center: [lat, lon]')
+
+    return float(center[0]), float(center[1]), rules['max_dist']
+
+
+# constraints with a single numeric bound, where the lower min_ or higher max_ value is the looser one
+BOUND_KEYS = [
+    'min_id', 'max_id', 'min_iv', 'max_iv',
+    'min_attack', 'max_attack', 'min_defense', 'max_defense', 'min_stamina', 'max_stamina',
+    'min_level', 'max_level',
+    'min_lat', 'max_lat', 'min_lon', 'max_lon', 'max_dist'
+]
+
+
+def rule_subsumes(rule, other):
+    """
+    Returns True if every pokemon matching other also matches rule, judging by their constraints
+    """
+    for key, value in rule.iteritems():
+        if key not in other:
+            return False
+
+        other_value = other[key]
+        if value == other_value:
+            continue
+
+        if key not in BOUND_KEYS:
+            return False
+
+        if value > other_value if key.startswith('min_') else value < other_value:
+            return False
+
+    return True
+
+
+def get_rule_key(value):
+    """
+    Returns a hashable key for a rule from the config, equal for rules with equal constraints
+    """
+    if isinstance(value, dict):
+        return dict, tuple(sorted((k, get_rule_key(v)) for k, v in value.iteritems()))
+
+    if isinstance(value, list):
+        return list, tuple(get_rule_key(v) for v in value)
+
+    return value
+
+
+def unique_rules(rules):
+    """
+    Returns rules without exact duplicates, in their original order
+    """
+    unique = []
+    seen = set()
+    for rule in rules:
+        key = get_rule_key(rule)
+        if key not in seen:
+            seen.add(key)
+            unique.append(rule)
+
+    return unique
+
+
+def get_rule_bounds(rule):
+    """
+    Returns (constraints, bounds) of a rule: a frozenset with the keys and values it only matches
+    exactly, and a dict of its numeric bounds with max_ values negated, so lower is looser for all
+    """
+    constraints = []
+    bounds = {}
+    for key, value in rule.iteritems():
+        if key in BOUND_KEYS and isinstance(value, (int, long, float)) and not isinstance(value, bool):
+            bounds[key] = value if key.startswith('min_') else -value
+        else:
+            constraints.append((key, get_rule_key(value)))
+
+    return frozenset(constraints), bounds
+
+
+class BoundsFrontier:
+    """
+    The loosest bounds among rules with the same bound keys, none of them subsuming another. Bounds
+    are added from loose to tight, in the order of their sorted keys.
+    """
+
+    def __init__(self, keys):
+        self.keys = sorted(keys)
+        self.vectors = []
+        # with two keys, the first bounds rise while the second ones fall
+        self.firsts = []
+
+    def subsumes(self, bounds):
+        """
+        Returns True if bounds are as tight as those of a rule in the frontier, or tighter
+        """
+        vector = [bounds[key] for key in self.keys]
+        if not self.vectors:
+            return False
+
+        if len(vector) == 0:
+            return True
+
+        if len(vector) == 1:
+            return self.vectors[0][0] <= vector[0]
+
+        if len(vector) == 2:
+            index = bisect.bisect_right(self.firsts, vector[0]) - 1
+            return index >= 0 and self.vectors[index][1] <= vector[1]
+
+        return any(all(a <= b for a, b in itertools.izip(other, vector)) for other in self.vectors)
+
+    def add(self, bounds):
+        vector = [bounds[key] for key in self.keys]
+        self.vectors.append(vector)
+        if vector:
+            self.firsts.append(vector[0])
+
+
+def get_subsets(items):
+    items = list(items)
+    for mask in xrange(0, 1 << len(items)):
+        yield frozenset(item for bit, item in enumerate(items) if mask & (1 << bit))
+
+
+def remove_subsumed_rules(rules):
+    """
+    Returns (rules, subsumed) without the rules another rule of the list subsumes. rules must not
+    contain duplicates.
+
+    A rule can only be subsumed by one whose exact constraints and bound keys are subsets of its own,
+    so rules are grouped by those. Each group keeps the frontier of its loosest rules, and a rule is
+    only checked against the frontiers of its own group and of the groups that could subsume it.
+    """
+    groups = {}
+    entries = []
+    for rule in rules:
+        constraints, bounds = get_rule_bounds(rule)
+        group = (constraints, frozenset(bounds))
+        entries.append((group, bounds))
+        groups.setdefault(group, []).append(bounds)
+
+    frontiers = {}
+    subsumed_in_group = set()
+    for group, group_bounds in groups.iteritems():
+        frontier = frontiers[group] = BoundsFrontier(group[1])
+        for bounds in sorted(group_bounds, key=lambda b: [b[key] for key in frontier.keys]):
+            if frontier.subsumes(bounds):
+                subsumed_in_group.add(id(bounds))
+            else:
+                frontier.add(bounds)
+
+    kept = []
+    for rule, (group, bounds) in itertools.izip(rules, entries):
+        if id(bounds) in subsumed_in_group:
+            continue
+
+        constraints, bound_keys = group
+        if 1 << (len(constraints) + len(bound_keys)) <= len(frontiers):
+            candidates = ((c, b) for c in get_subsets(constraints) for b in get_subsets(bound_keys))
+        else:
+            candidates = (g for g in frontiers if g[0] <= constraints and g[1] <= bound_keys)
+
+        if not any(candidate != group and candidate in frontiers and frontiers[candidate].subsumes(bounds)
+                   for candidate in candidates):
+            kept.append(rule)
+
+    return kept, len(rules) - len(kept)
+
+
+def normalize_rules(rules):
+    """
+    Returns (rules, duplicates, subsumed) with exact duplicates and rules subsumed by another rule of
+    the list removed. The order of the remaining rules is kept.
+    """
+    unique = unique_rules(rules)
+    kept, subsumed = remove_subsumed_rules(unique)
+    return kept, len(rules) - len(unique), subsumed
+
+
+def register_location_constraints(rules, location_keys, locations):
+    """
+    Returns the combined bits of the location constraints in rules
+    """
+    bits = 0
+    for key in location_keys:
+        bits |= locations.register(key, get_location_constraint(key, rules))
+
+    return bits
+
+
+class PokemonRule:
+    """
+    A pokemon rule from the config, compiled to the predicates it actually uses.
+
+    Each predicate takes the pokemon dict created by the handler and returns True if it passes.
+    Pokemon and move names are resolved to ids here, so matching only compares integers.
+    """
+
+    def __init__(self, rules, locations):
+        self.rules = rules
+        self.predicates = []
+
+        at_level_keys = [key for key in AT_LEVEL_KEYS if key in rules]
+        location_keys = [key for key in LOCATION_KEYS if key in rules]
+
+        for key in PREDICATE_ORDER:
+            if key == 'at_level':
+                if at_level_keys:
+                    self.predicates.append(('/'.join(at_level_keys), PokemonRule.compile_at_level(rules)))
+            elif key == 'location':
+                if location_keys:
+                    self.predicates.append(('/'.join(location_keys),
+                                            PokemonRule.compile_location(rules, location_keys, locations)))
+            elif key in rules:
+                self.predicates.append((key, PokemonRule.compile_predicate(key, rules[key])))
+
+    def matches(self, pokemon):
+        for key, predicate in self.predicates:
+            if not predicate(pokemon):
+                return False
+
+        return True
+
+    def get(self, key, default=None):
+        return self.rules.get(key, default)
+
+    def __repr__(self):
+        return repr(self.rules)
+
+    @staticmethod
+    def compile_predicate(key, value):
+        if key == 'name':
+            pokemon_id = resolve_pokemon_name(value)
+            return lambda pokemon: pokemon['id'] == pokemon_id
+
+        if key == 'moves':
+            return PokemonRule.compile_moves(value)
+
+        # plain min_<field> and max_<field>. missing values never pass
+        field = key[4:]
+        if key.startswith('min_'):
+            return lambda pokemon: pokemon.get(field, -1) >= value
+        else:
+            return lambda pokemon: pokemon.get(field, 99999) <= value
+
+    @staticmethod
+    def compile_moves(moves):
+        move_sets = resolve_move_sets(moves)
+        return lambda pokemon: move_sets_match(move_sets, pokemon.get('move_1_id'), pokemon.get('move_2_id'))
+
+    @staticmethod
+    def compile_location(rules, location_keys, locations):
+        # all location constraints are checked at once against the cached mask of the location
+        bits = register_location_constraints(rules, location_keys, locations)
+        return lambda pokemon: locations.get_mask(pokemon) & bits == bits
+
+    @staticmethod
+    def compile_at_level(rules):
+        checks = []
+        for key in AT_LEVEL_KEYS:
+            for level, required_value in rules.get(key, {}).iteritems():
+                level_index = get_level_index(level)
+                if level_index is None:
+                    raise RuntimeError('Invalid level %s in %s' % (level, key))
+                checks.append((key, level_index, required_value))
+        checks = tuple(checks)
+
+        # the checks only depend on the IVs, so they are precomputed per species into a bitmap of
+        # the IV combinations that pass. a rule for one species keeps its bitmap, the others look
+        # theirs up in the shared iv_bitmaps
+        name = rules.get('name')
+        named_id = resolve_pokemon_name(name) if name is not None else None
+        named_bitmap = iv_bitmaps.get(named_id, checks) if named_id is not None else None
+
+        def predicate(pokemon):
+            if 'attack' not in pokemon or 'defense' not in pokemon or 'stamina' not in pokemon:
+                return False
+
+            if pokemon['id'] == named_id:
+                bitmap = named_bitmap
+            else:
+                bitmap = iv_bitmaps.get(pokemon['id'], checks)
+
+            iv_index = get_iv_index(pokemon['attack'], pokemon['defense'], pokemon['stamina'])
+            return bitmap[iv_index >> 3] & (1 << (iv_index & 7)) != 0
+
+        return predicate
+
+
+class PokemonRuleIndex:
+    """
+    Maps a pokemon id to the includes and rules that can possibly match it.
+
+    Rules are bucketed by their species constraints (name, min_id and max_id) once at config load,
+    so a message is only checked against the rules that can apply to its pokemon id.
+    """
+
+    def __init__(self, includes):
+        self.includes = includes
+        self.index = {}
+
+        known_ids = get_pokemon_ids()
+        per_include = []
+
+        for include_ref in includes:
+            rules = includes[include_ref]
+            wildcards = []
+            specific = {}
+
+            for position, rule in enumerate(rules):
+                bounds = PokemonRuleIndex.get_species_bounds(rule)
+                if bounds is None:
+                    wildcards.append(position)
+                    continue
+
+                for pokemon_id in PokemonRuleIndex.get_species_ids(bounds, known_ids):
+                    if pokemon_id not in specific:
+                        specific[pokemon_id] = []
+                    specific[pokemon_id].append(position)
+
+            wildcard_rules = [rules[position] for position in wildcards]
+            per_include.append((include_ref, rules, wildcards, wildcard_rules, specific))
+
+        for pokemon_id in known_ids:
+            candidates = []
+            for include_ref, rules, wildcards, wildcard_rules, specific in per_include:
+                positions = specific.get(pokemon_id)
+                if positions is None:
+                    # wildcard only, share the list between all species
+                    if wildcard_rules:
+                        candidates.append((include_ref, wildcard_rules))
+                else:
+                    # keep the order the rules were configured in
+                    candidates.append((include_ref, [rules[p] for p in sorted(wildcards + positions)]))
+
+            self.index[pokemon_id] = candidates
+
+        log.info('Indexed %d pokemon rules in %d includes for %d species',
+                 sum(len(rules) for rules in includes.itervalues()), len(includes), len(known_ids))
+
+    def candidates(self, pokemon_id):
+        """
+        Returns a list of (include_ref, rules) with the rules that can possibly match pokemon_id
+        """
+        candidates = self.index.get(pokemon_id)
+        if candidates is None:
+            # species not in the name data, e.g. a newer generation. resolve it once
+            candidates = []
+            for include_ref in self.includes:
+                rules = [r for r in self.includes[include_ref] if PokemonRuleIndex.admits(r, pokemon_id)]
+                if rules:
+                    candidates.append((include_ref, rules))
+
+            self.index[pokemon_id] = candidates
+
+        return candidates
+
+    @staticmethod
+    def get_species_bounds(rule):
+        """
+        Returns (name_id, min_id, max_id) for the rule, or None if it can match any species
+        """
+        name = rule.get('name')
+        min_id = rule.get('min_id')
+        max_id = rule.get('max_id')
+
+        if name is None and min_id is None and max_id is None:
+            return None
+
+        name_id = resolve_pokemon_name(name) if name is not None else None
+        return name_id, min_id, max_id
+
+    @staticmethod
+    def get_species_ids(bounds, known_ids):
+        name_id, min_id, max_id = bounds
+        candidates = [name_id] if name_id is not None else known_ids
+
+        return [i for i in candidates
+                if (min_id is None or i >= min_id) and (max_id is None or i <= max_id)]
+
+    @staticmethod
+    def admits(rule, pokemon_id):
+        bounds = PokemonRuleIndex.get_species_bounds(rule)
+        if bounds is None:
+            return True
+
+        name_id, min_id, max_id = bounds
+        if name_id is not None and name_id != pokemon_id:
+            return False
+
+        return (min_id is None or pokemon_id >= min_id) and (max_id is None or pokemon_id <= max_id)
+
+
+class SubscriptionIndex:
+    """
+    Maps pokemon to the notification settings they have to be sent to, for configs with one
+    notification setting per subscriber.
+
+    Every notification setting gets a bit, and every distinct rule the bits of all settings that
+    include it. Rules are bucketed by species and sorted by their min_iv, so a message only visits
+    the rules of its species that its IV can pass, and skips those whose subscribers are all
+    notified already.
+    """
+
+    def __init__(self, includes, includes_to_notifications):
+        self.notification_setting_refs = sorted(set(ref for refs in includes_to_notifications.itervalues()
+                                                    for ref in refs))
+        setting_bits = dict((ref, 1 << i) for i, ref in enumerate(self.notification_setting_refs))
+
+        # the same compiled rule can be shared by many includes
+        self.rules = {}
+        self.rule_bits = {}
+        for include_ref, rules in includes.iteritems():
+            include_bits = 0
+            for notification_setting_ref in includes_to_notifications.get(include_ref, []):
+                include_bits |= setting_bits[notification_setting_ref]
+
+            for rule in rules:
+                self.rules[id(rule)] = rule
+                self.rule_bits[id(rule)] = self.rule_bits.get(id(rule), 0) | include_bits
+
+        self.index = {}
+        known_ids = get_pokemon_ids()
+        per_species = dict((pokemon_id, []) for pokemon_id in known_ids)
+        for key, rule in self.rules.iteritems():
+            bounds = PokemonRuleIndex.get_species_bounds(rule)
+            pokemon_ids = known_ids if bounds is None else PokemonRuleIndex.get_species_ids(bounds, known_ids)
+            for pokemon_id in pokemon_ids:
+                per_species[pokemon_id].append(rule)
+
+        for pokemon_id, rules in per_species.iteritems():
+            self.index[pokemon_id] = self.get_iv_buckets(rules)
+
+        log.info('Indexed %d distinct pokemon rules for %d notification settings', len(self.rules),
+                 len(self.notification_setting_refs))
+
+    def get_iv_buckets(self, rules):
+        """
+        Returns (thresholds, rules) sorted by min_iv, where rules without min_iv come first
+        """
+        rules = sorted(rules, key=SubscriptionIndex.get_iv_threshold)
+        return ([SubscriptionIndex.get_iv_threshold(rule) for rule in rules],
+                [(rule, self.rule_bits[id(rule)]) for rule in rules])
+
+    @staticmethod
+    def get_iv_threshold(rule):
+        # pokemon without IV are compared as -1, so they only reach rules without min_iv
+        return rule.get('min_iv', -2)
+
+    def candidates(self, pokemon):
+        """
+        Returns a list of (rule, bits) for the rules that can possibly match pokemon
+        """
+        buckets = self.index.get(pokemon['id'])
+        if buckets is None:
+            # species not in the name data. resolve it once
+            rules = [r for r in self.rules.itervalues() if PokemonRuleIndex.admits(r, pokemon['id'])]
+            buckets = self.index[pokemon['id']] = self.get_iv_buckets(rules)
+
+        thresholds, rules = buckets
+        return rules[:bisect.bisect_right(thresholds, pokemon.get('iv', -1))]
+
+    def get_notification_settings(self, pokemon):
+        """
+        Returns the refs of all notification settings with a rule matching pokemon
+        """
+        matched = 0
+        for rule, bits in self.candidates(pokemon):
+            if bits & ~matched and rule.matches(pokemon):
+                matched |= bits
+
+        notification_setting_refs = []
+        while matched:
+            bit = matched & -matched
+            notification_setting_refs.append(self.notification_setting_refs[bit.bit_length() - 1])
+            matched ^= bit
+
+        return notification_setting_refs
+
+
+class RaidPokemonRule:
+    """
+    A raid boss restriction from the 'pokemons' list of a raid include
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self.pokemon_id = resolve_pokemon_name(rules['name']) if 'name' in rules else None
+        self.min_cp = rules.get('min_cp')
+        self.max_cp = rules.get('max_cp')
+        self.move_sets = resolve_move_sets(rules['moves']) if 'moves' in rules else None
+
+    def matches(self, raid):
+        if self.min_cp is not None and raid['cp'] < self.min_cp:
+            return False
+
+        if self.max_cp is not None and raid['cp'] > self.max_cp:
+            return False
+
+        if self.move_sets is not None and not move_sets_match(self.move_sets, raid['move_1_id'],
+                                                              raid['move_2_id']):
+            return False
+
+        return True
+
+
+class RaidRule:
+    """
+    A raid include from the config, compiled.
+
+    Eggs match if eggs are enabled and the level matches. Raids also need one of the boss restrictions
+    in 'pokemons' to match, if there are any.
+    """
+
+    def __init__(self, rules, locations):
+        self.rules = rules
+        self.egg = rules.get('egg', True)
+        self.raid = rules.get('raid', True)
+
+        levels = rules.get('levels')
+        self.levels = frozenset(levels) if levels is not None else None
+
+        location_keys = [key for key in LOCATION_KEYS if key in rules]
+        self.location_bits = register_location_constraints(rules, location_keys, locations) if location_keys else None
+
+        self.pokemon_rules = [RaidPokemonRule(pokemon) for pokemon in rules.get('pokemons', [])]
+
+    def get_pokemon_rules(self, egg, level, pokemon_id):
+        """
+        Returns the boss restrictions that can match a raid or egg of this level and boss. None if this
+        include can't match at all, an empty list if there are no restrictions to check.
+        """
+        if not (self.egg if egg else self.raid):
+            return None
+
+        if self.levels is not None and level not in self.levels:
+            return None
+
+        if egg or not self.pokemon_rules:
+            return []
+
+        pokemon_rules = [r for r in self.pokemon_rules if r.pokemon_id is None or r.pokemon_id == pokemon_id]
+        return pokemon_rules or None
+
+    def __repr__(self):
+        return repr(self.rules)
+
+
+class RaidRuleIndex:
+    """
+    Maps (egg, level, boss id) to the raid includes that can match it, with the boss restrictions
+    left to check. Each key is resolved once, the first time a raid or egg like it is seen.
+    """
+
+    def __init__(self, includes):
+        self.includes = includes
+        self.index = {}
+
+    def candidates(self, raid):
+        """
+        Returns a list of (include_ref, rule, pokemon_rules) for the includes that can match raid
+        """
+        egg = raid['egg']
+        key = (egg, raid['level'], None if egg else raid['id'])
+
+        candidates = self.index.get(key)
+        if candidates is None:
+            candidates = []
+            for include_ref, rule in self.includes.iteritems():
+                pokemon_rules = rule.get_pokemon_rules(*key)
+                if pokemon_rules is not None:
+                    candidates.append((include_ref, rule, pokemon_rules))
+
+            self.index[key] = candidates
+
+        return candidates
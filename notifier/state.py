@@ -0,0 +1,73 @@
+from contextlib import closing
+import json
+import logging
+import sqlite3
+import time
+
+log = logging.getLogger(__name__)
+
+
+class HandlerState:
+    """
+    The processed pokemon, raids and eggs and the known gyms of a Handler in an sqlite file, so
+    they survive a restart.
+
+    Changes are collected and written in one transaction by save(), which also drops the expired
+    entries. A crash loses at most the changes since the last save. Keys are stored as JSON, so
+    integer encounter ids come back as integers rather than strings.
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.pending = []
+        self.pending_gyms = {}
+
+        with closing(self.connect()) as db:
+            with db:
+                db.execute('CREATE TABLE IF NOT EXISTS processed '
+                           '(kind TEXT, key TEXT, expires INTEGER, PRIMARY KEY (kind, key))')
+                db.execute('CREATE TABLE IF NOT EXISTS gyms (id TEXT PRIMARY KEY, data TEXT)')
+
+    def connect(self):
+        # connections can't be shared between threads, and saving is rare enough to open one each time
+        return sqlite3.connect(self.state_file)
+
+    def add(self, kind, key, expires_at):
+        self.pending.append((kind, json.dumps(key), int(expires_at)))
+
+    def set_gym(self, gym_id, gym):
+        self.pending_gyms[gym_id] = gym
+
+    def load(self, now=None):
+        """
+        Returns a list of (kind, key, expires_at) of the entries that haven't expired yet, and a dict
+        of the gyms
+        """
+        now = int(now if now is not None else time.time())
+        with closing(self.connect()) as db:
+            processed = [(kind, json.loads(key), expires_at) for kind, key, expires_at in
+                         db.execute('SELECT kind, key, expires FROM processed WHERE expires >= ?', (now,))]
+            gyms = dict((gym_id, json.loads(data)) for gym_id, data in db.execute('SELECT id, data FROM gyms'))
+
+        log.info('Loaded %d processed entries and %d gyms from %s', len(processed), len(gyms), self.state_file)
+        return processed, gyms
+
+    def save(self, now=None):
+        now = int(now if now is not None else time.time())
+        pending, pending_gyms = self.pending, self.pending_gyms
+        self.pending, self.pending_gyms = [], {}
+
+        try:
+            with closing(self.connect()) as db:
+                with db:
+                    db.executemany('INSERT OR REPLACE INTO processed VALUES (?, ?, ?)', pending)
+                    db.executemany('INSERT OR REPLACE INTO gyms VALUES (?, ?)',
+                                   [(gym_id, json.dumps(gym)) for gym_id, gym in pending_gyms.iteritems()])
+                    db.execute('DELETE FROM processed WHERE expires < ?', (now,))
+        except sqlite3.Error:
+            log.exception('Could not write state to %s', self.state_file)
+
+            # try again with the next save
+            self.pending = pending + self.pending
+            pending_gyms.update(self.pending_gyms)
+            self.pending_gyms = pending_gyms
@@ -0,0 +1,171 @@
+from .gamedata import LEVEL_COUNT, get_game_data
+from array import array
+from collections import OrderedDict
+from threading import Lock
+import logging
+import math
+
+log = logging.getLogger(__name__)
+
+IV_COUNT = 16 * 16 * 16
+
+
+def get_iv_index(iv_attack, iv_defense, iv_stamina):
+    return (iv_attack << 8) | (iv_defense << 4) | iv_stamina
+
+
+class SpeciesTable:
+    """
+    CP and HP of one species for every (level, attack IV, defense IV, stamina IV).
+
+    The CP table is filled one level at a time, the first time that level is asked for.
+    """
+
+    def __init__(self, attack, defense, stamina, cp_multipliers):
+        self.attack = attack
+        self.defense = defense
+        self.stamina = stamina
+        self.cp_multipliers = cp_multipliers
+        self.cp_tables = [None] * LEVEL_COUNT
+        self.hp_tables = [None] * LEVEL_COUNT
+
+    def get_cp(self, level_index, iv_index):
+        cp_table = self.cp_tables[level_index]
+        if cp_table is None:
+            cp_table = self.cp_tables[level_index] = self.build_cp_table(level_index)
+
+        return cp_table[iv_index]
+
+    def get_hp(self, level_index, iv_stamina):
+        hp_table = self.hp_tables[level_index]
+        if hp_table is None:
+            hp_table = self.hp_tables[level_index] = self.build_hp_table(level_index)
+
+        return hp_table[iv_stamina]
+
+    def build_cp_table(self, level_index):
+        cp_multiplier = self.cp_multipliers[level_index]
+        factor = math.pow(cp_multiplier, 2) / float(10)
+
+        cp_table = array('H')
+        for iv_attack in range(0, 16):
+            attack = self.attack + iv_attack
+            for iv_defense in range(0, 16):
+                attack_defense = attack * math.sqrt(self.defense + iv_defense)
+                for iv_stamina in range(0, 16):
+                    cp = attack_defense * math.sqrt(self.stamina + iv_stamina) * factor
+                    cp_table.append(int(math.floor(cp)))
+
+        return cp_table
+
+    def build_hp_table(self, level_index):
+        cp_multiplier = self.cp_multipliers[level_index]
+        return array('H', [int(math.floor((self.stamina + iv_stamina) * cp_multiplier)) for iv_stamina in range(0, 16)])
+
+
+class SpeciesTables:
+    """
+    Least recently used SpeciesTables, at most max_species of them.
+
+    Shared by the notifier thread and a config being reloaded next to it, hence the lock.
+    """
+
+    def __init__(self, max_species=64):
+        self.max_species = max_species
+        self.tables = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, pokemon_id):
+        """
+        Returns the SpeciesTable for pokemon_id, or None if there are no base stats for it
+        """
+        with self.lock:
+            table = self.tables.pop(pokemon_id, None)
+            if table is None:
+                game_data = get_game_data()
+                if game_data.get_stats(pokemon_id) is None:
+                    return None
+
+                table = SpeciesTable(game_data.base_attack[pokemon_id], game_data.base_defense[pokemon_id],
+                                     game_data.base_stamina[pokemon_id], game_data.cp_multipliers)
+                if len(self.tables) >= self.max_species:
+                    self.tables.popitem(last=False)
+
+            self.tables[pokemon_id] = table
+            return table
+
+
+species_tables = SpeciesTables()
+
+
+class IvBitmaps:
+    """
+    IV bitmaps by species and checks, at most max_bitmaps of them. Rules with the same checks share
+    their bitmaps.
+
+    Bitmaps are looked up for every pokemon, so a hit only marks the bitmap as used instead of
+    reordering. When one has to go, the oldest bitmap not used since it was last passed over is
+    evicted, a close approximation of least recently used.
+    """
+
+    def __init__(self, max_bitmaps=4096):
+        self.max_bitmaps = max_bitmaps
+        self.bitmaps = OrderedDict()
+        self.used = set()
+        self.lock = Lock()
+
+    def get(self, pokemon_id, checks):
+        """
+        Returns the bitmap of get_iv_bitmap for pokemon_id and a tuple of checks
+        """
+        key = (pokemon_id, checks)
+        bitmap = self.bitmaps.get(key)
+        if bitmap is not None:
+            self.used.add(key)
+            return bitmap
+
+        # shared by the notifier thread and a config being reloaded next to it
+        with self.lock:
+            bitmap = self.bitmaps.get(key)
+            if bitmap is None:
+                bitmap = get_iv_bitmap(pokemon_id, checks)
+                while len(self.bitmaps) >= self.max_bitmaps:
+                    oldest, oldest_bitmap = self.bitmaps.popitem(last=False)
+                    if oldest in self.used:
+                        self.used.discard(oldest)
+                        self.bitmaps[oldest] = oldest_bitmap
+
+                self.bitmaps[key] = bitmap
+
+            return bitmap
+
+
+def get_iv_bitmap(pokemon_id, checks):
+    """
+    Returns a bytearray with one bit per IV index, set if the IV combination passes all checks.
+
+    checks is a list of (key, level_index, required_value), where key is one of min_cp, max_cp,
+    min_hp or max_hp. Species without base stats never pass.
+    """
+    bitmap = bytearray(IV_COUNT // 8)
+
+    table = species_tables.get(pokemon_id)
+    if table is None:
+        return bitmap
+
+    for iv_index in range(0, IV_COUNT):
+        for key, level_index, required_value in checks:
+            if key.endswith('_cp'):
+                value = table.get_cp(level_index, iv_index)
+            else:
+                value = table.get_hp(level_index, iv_index & 15)
+
+            if value < required_value if key.startswith('min_') else value > required_value:
+                break
+        else:
+            bitmap[iv_index >> 3] |= 1 << (iv_index & 7)
+
+    return bitmap
+
+
+iv_bitmaps = IvBitmaps()
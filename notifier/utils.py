@@ -1,4 +1,4 @@
-import json
+from .gamedata import get_game_data
 import datetime
 import requests
 import logging
@@ -9,31 +9,22 @@ log = logging.getLogger(__name__)
 
 
 def get_pokemon_name(pokemon_id):
-    if not hasattr(get_pokemon_name, 'names'):
-        with open('data/names.json', 'r') as f:
-            get_pokemon_name.names = json.load(f)
-
-    return get_pokemon_name.names.get(str(pokemon_id), 'unknown')
+    name = get_game_data().get_pokemon_name(pokemon_id)
+    return name if name is not None else 'unknown'
 
 
 def get_pokemon_id(pokemon_name):
-    if not hasattr(get_pokemon_id, 'ids'):
-        if not hasattr(get_pokemon_name, 'names'):
-            get_pokemon_name(1) # initialize it
+    pokemon_id = get_game_data().get_pokemon_id(pokemon_name)
+    return str(pokemon_id) if pokemon_id is not None else '-1'
 
-        get_pokemon_id.ids = {}
-        for id, name in get_pokemon_name.names.iteritems():
-            get_pokemon_id.ids[name] = str(id)
 
-    return get_pokemon_id.ids.get(pokemon_name, '-1')
+def get_pokemon_ids():
+    return get_game_data().get_pokemon_ids()
 
 
 def get_move_name(move_id):
-    if not hasattr(get_move_name, 'names'):
-        with open('data/moves.json', 'r') as f:
-            get_move_name.names = json.load(f)
-
-    return get_move_name.names.get(str(move_id), 'unknown')
+    name = get_game_data().get_move_name(move_id)
+    return name if name is not None else 'unknown'
 
 
 def get_team_name(team_id):
@@ -119,38 +110,15 @@ def get_distance(lat1, lon1, lat2, lon2):
 
 
 def get_stats(pokemon_id):
-    if not hasattr(get_pokemon_name, 'stats'):
-        with open('data/stats.json', 'r') as f:
-            get_stats.stats = json.load(f)
-
-    return get_stats.stats.get(str(pokemon_id))
+    return get_game_data().get_stats(pokemon_id)
 
 
 def get_cpm_for_level(level):
-    if not hasattr(get_cpm_for_level, 'cpm'):
-        with open('data/cpm.json', 'r') as f:
-            get_cpm_for_level.cpm = json.load(f)
-
-    return get_cpm_for_level.cpm.get(str(level))
+    return get_game_data().get_cpm_for_level(level)
 
 
 def get_level_from_cpm(cpm_in):
-    if not hasattr(get_level_from_cpm, 'levels'):
-        if not hasattr(get_cpm_for_level, 'cpm'):
-            get_cpm_for_level(1)
-
-    cpm_in = str(cpm_in)
-    max_length = 5
-
-    if len(cpm_in) > max_length:
-        cpm_in = cpm_in[:max_length]
-
-    level_to_cpm = {}
-    for level,cpm in get_cpm_for_level.cpm.iteritems():
-        cpm_cmp = str(cpm)[:max_length]
-        level_to_cpm[cpm_cmp] = level
-
-    return int(level_to_cpm.get(cpm_in, '-1'))
+    return get_game_data().get_level_from_cpm(cpm_in)
 
 
 def get_cp_for_level(pokemon_id, level, iv_attack, iv_defense, iv_stamina):
@@ -177,6 +145,20 @@ def get_hp_for_level(pokemon_id, level, iv_stamina):
     return int(math.floor(hp))
 
 
+def is_inside_geofence(geofence, lat, lon):
+    # fast boundaries check
+    boundaries = geofence['boundaries']
+    min_x = boundaries['min'][0]
+    min_y = boundaries['min'][1]
+    max_x = boundaries['max'][0]
+    max_y = boundaries['max'][1]
+
+    if lat < min_x or lat > max_x or lon < min_y or lon > max_y:
+        return False
+
+    return is_inside_polygon(geofence['polygon'], lat, lon)
+
+
 def is_inside_polygon(polygon, x, y):
     n = len(polygon)
     inside = False
@@ -2,8 +2,9 @@
 
 import configargparse
 import logging
+import signal
 
-from flask import Flask, request
+from flask import Flask, abort, request
 from gevent import wsgi
 
 from server import Receiver
@@ -14,7 +15,26 @@ app = Flask(__name__)
 
 @app.route('/', methods=['POST'])
 def webhook_receiver():
-    receiver.process(request.data)
+    return receiver.process(request.data)
+
+
+@app.route('/reload', methods=['POST'])
+def reload_config():
+    # admin route, local requests only
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(403)
+
+    receiver.reload()
+    return ""
+
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    # admin route, local requests only
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        abort(403)
+
+    return receiver.get_stats()
 
 
 if __name__ == '__main__':
@@ -22,9 +42,14 @@ if __name__ == '__main__':
     parser.add_argument('--host', help='Host', default='localhost')
     parser.add_argument('-p', '--port', help='Port', type=int, default=8000)
     parser.add_argument('-c', '--config', help="config.json file to use", default="config/config.json")
+    parser.add_argument('--compiled-config', help="Compiled config file for faster restarts, rebuilt when the "
+                                                  "config or geofence file changes", default=None)
     args = parser.parse_args()
  
-    receiver = Receiver(args.config)
+    receiver = Receiver(args.config, args.compiled_config)
+
+    # kill -HUP reloads the config without dropping webhooks or the list of notified pokemon
+    signal.signal(signal.SIGHUP, lambda signum, frame: receiver.reload())
 
     # Removes logging of each received request to flask server
     logging.getLogger('pywsgi').setLevel(logging.WARNING)
@@ -7,7 +7,7 @@ from notifier.manager import NotifierManager
 
 
 class Receiver():
-    def __init__(self, config):
+    def __init__(self, config, snapshot_file=None):
         # Setup logging
         with open('logging.yaml') as f:
             logging.config.dictConfig(yaml.load(f))
@@ -17,16 +17,16 @@ class Receiver():
         # Remove logging of each sent request to discord
         logging.getLogger('requests').setLevel(logging.WARNING)
 
-        self.notifiermanager = NotifierManager(config)
+        self.notifiermanager = NotifierManager(config, snapshot_file)
         self.notifiermanager.start()
 
 
-    def process(self, request_body):
-        data = json.loads(request_body)
-        if type(data) == dict:
-            self.notifiermanager.enqueue(data)
-        else:
-            for frame in data:
-                self.notifiermanager.enqueue(frame)
+    def reload(self):
+        self.notifiermanager.reload()
+
+    def get_stats(self):
+        return json.dumps(self.notifiermanager.get_stats())
 
+    def process(self, request_body):
+        self.notifiermanager.receive(request_body)
         return ""
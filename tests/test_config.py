@@ -0,0 +1,109 @@
+from notifier.config import Config
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestConfig(unittest.TestCase):
+    @staticmethod
+    def _make_config(includes):
+        return {
+            'includes': includes,
+            'notification_settings': {
+                'Default': {
+                    'includes': ['main']
+                }
+            }
+        }
+
+    def _get_rules(self, includes):
+        config = Config(self._make_config(includes))
+        return [rule.rules for rule in config.pokemon_includes['main']]
+
+    def test_nested_refs(self):
+        rules = self._get_rules({
+            'main': {'pokemons': [{'name': 'Dragonite'}], 'pokemons_refs': ['middle', 'inner'], 'max_lat': 50},
+            'middle': {'pokemons': [{'name': 'Snorlax'}], 'pokemons_refs': ['inner'], 'min_iv': 90},
+            'inner': {'pokemons': [{'name': 'Lapras'}]}
+        })
+
+        # settings apply to the own and referenced pokemons, innermost include first. Lapras from
+        # middle has a min_iv, so the one from inner subsumes it
+        self.assertEqual(rules, [
+            {'name': 'Dragonite', 'max_lat': 50},
+            {'name': 'Snorlax', 'min_iv': 90, 'max_lat': 50},
+            {'name': 'Lapras', 'max_lat': 50}
+        ])
+
+    def test_subsumed_rules_across_refs(self):
+        rules = self._get_rules({
+            'main': {'pokemons_refs': ['good', 'perfect']},
+            'good': {'pokemons': [{'min_iv': 90}]},
+            'perfect': {'pokemons': [{'min_iv': 100}, {'min_iv': 90}]}
+        })
+        self.assertEqual(rules, [{'min_iv': 90}])
+
+    def test_ref_cycles(self):
+        self.assertRaises(RuntimeError, Config, self._make_config({
+            'main': {'pokemons_refs': ['other']},
+            'other': {'pokemons_refs': ['main']}
+        }))
+        self.assertRaises(RuntimeError, Config, self._make_config({'main': {'pokemons_refs': ['main']}}))
+
+    def test_unknown_refs(self):
+        self.assertRaises(RuntimeError, Config, self._make_config({'main': {'pokemons_refs': ['missing']}}))
+
+
+class TestConfigSnapshot(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.directory, 'config.json')
+        self.geofence_file = os.path.join(self.directory, 'geofences.txt')
+        self.snapshot_file = os.path.join(self.directory, 'config.compiled')
+
+        shutil.copy('tests/data/geofence/geofences.txt', self.geofence_file)
+        with open(self.config_file, 'w') as f:
+            json.dump({
+                'config': {'geofence_file': self.geofence_file},
+                'includes': {'main': {'pokemons': [{'name': 'Dragonite'}], 'geofence': 'Someplace'}},
+                'notification_settings': {'Default': {'includes': ['main']}}
+            }, f)
+
+        self.read_config = Config.__dict__['read_config']
+
+    def tearDown(self):
+        Config.read_config = self.read_config
+        shutil.rmtree(self.directory)
+
+    def _load_without_parsing(self):
+        def fail(config_file):
+            raise AssertionError('config parsed again')
+
+        Config.read_config = staticmethod(fail)
+        try:
+            return Config(self.config_file, self.snapshot_file)
+        finally:
+            Config.read_config = self.read_config
+
+    def test_snapshot(self):
+        config = Config(self.config_file, self.snapshot_file)
+        self.assertTrue(os.path.exists(self.snapshot_file))
+
+        restored = self._load_without_parsing()
+        self.assertEqual(restored.pokemon_includes['main'][0].rules, config.pokemon_includes['main'][0].rules)
+        self.assertEqual(restored.geofence_index.lookup(0.5, 0.5), config.geofence_index.lookup(0.5, 0.5))
+        self.assertEqual(restored.pokemon_includes_to_notifications, {'main': ['Default']})
+
+    def test_outdated_snapshot(self):
+        Config(self.config_file, self.snapshot_file)
+
+        with open(self.geofence_file, 'a') as f:
+            f.write('\n[Elsewhere]\n0,0\n0,1\n1,1\n')
+
+        self.assertRaises(AssertionError, self._load_without_parsing)
+
+        config = Config(self.config_file, self.snapshot_file)
+        self.assertTrue('Elsewhere' in config.geofences)
+        self.assertTrue('Elsewhere' in self._load_without_parsing().geofences)
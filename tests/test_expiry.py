@@ -0,0 +1,127 @@
+from notifier.expiry import CompactExpiringKeys, EncounterIds, ExpiringKeys, get_encounter_key
+import base64
+import unittest
+
+
+class TestExpiringKeys(unittest.TestCase):
+    def setUp(self):
+        self.keys = ExpiringKeys(slots=10, now=1000)
+
+    def test_expiry(self):
+        self.keys.add('a', 1002)
+        self.keys.add('b', 1005)
+
+        self.keys.advance(1002)
+        self.assertTrue('a' in self.keys)
+
+        self.keys.advance(1003)
+        self.assertFalse('a' in self.keys)
+        self.assertTrue('b' in self.keys)
+
+        self.keys.advance(1006)
+        self.assertEqual(len(self.keys), 0)
+
+    def test_already_expired(self):
+        self.keys.add('a', 900)
+        self.assertTrue('a' in self.keys)
+
+        self.keys.advance(1001)
+        self.assertFalse('a' in self.keys)
+
+    def test_later_rounds(self):
+        self.keys.add('a', 1025)
+
+        self.keys.advance(1020)
+        self.assertTrue('a' in self.keys)
+
+        self.keys.advance(1026)
+        self.assertFalse('a' in self.keys)
+
+    def test_long_pause(self):
+        for i in range(0, 30):
+            self.keys.add(i, 1000 + i)
+
+        self.keys.advance(2000)
+        self.assertEqual(len(self.keys), 0)
+        self.assertEqual(sum(len(slot) for slot in self.keys.slots), 0)
+
+    def test_added_again(self):
+        self.keys.add('a', 1002)
+        self.keys.advance(1004)
+        self.keys.add('a', 1008)
+
+        self.keys.advance(1005)
+        self.assertEqual(self.keys.get('a'), 1008)
+
+        self.keys.advance(1009)
+        self.assertFalse('a' in self.keys)
+
+
+class TestCompactExpiringKeys(unittest.TestCase):
+    def setUp(self):
+        self.keys = CompactExpiringKeys(slots=10, now=1000)
+
+    def test_expiry(self):
+        self.keys.add(1, 1002)
+        self.keys.add(2 ** 64 - 1, 1025)
+        self.assertEqual(self.keys.get(2 ** 64 - 1), 1025)
+
+        self.keys.advance(1003)
+        self.assertFalse(1 in self.keys)
+        self.assertTrue(2 ** 64 - 1 in self.keys)
+
+        self.keys.advance(1026)
+        self.assertEqual(len(self.keys), 0)
+
+    def test_resize(self):
+        for key in range(0, 5000):
+            self.keys.add(key * 1024, 1000 + key % 20)
+
+        self.assertEqual(len(self.keys), 5000)
+        self.assertTrue(all(key * 1024 in self.keys for key in range(0, 5000)))
+
+        self.keys.advance(1010)
+        self.assertEqual(len(self.keys), 2500)
+        self.assertFalse(1024 in self.keys)
+        self.assertTrue(19 * 1024 in self.keys)
+
+        # deleted slots are reused
+        for key in range(0, 5000):
+            self.keys.add(key * 1024 + 1, 1100)
+        self.assertEqual(len(self.keys), 7500)
+        self.assertTrue(all(key * 1024 + 1 in self.keys for key in range(0, 5000)))
+
+
+class TestEncounterIds(unittest.TestCase):
+    def test_encounter_keys(self):
+        self.assertEqual(get_encounter_key('MTA0MjA0NDU4NTU4NzI1NTQ5MjE='), 10420445855872554921)
+        self.assertEqual(get_encounter_key(12345), 12345)
+        self.assertIsNone(get_encounter_key('not base64!'))
+        self.assertIsNone(get_encounter_key(base64.b64encode(str(2 ** 64))))
+
+    def test_mixed_ids(self):
+        encounter_ids = EncounterIds(slots=10, now=1000)
+        encounter_ids.add('MTA0MjA0NDU4NTU4NzI1NTQ5MjE=', 1002)
+        encounter_ids.add('something else', 1002)
+
+        self.assertTrue('MTA0MjA0NDU4NTU4NzI1NTQ5MjE=' in encounter_ids)
+        self.assertTrue('something else' in encounter_ids)
+        self.assertEqual(len(encounter_ids.compact), 1)
+
+        encounter_ids.advance(1003)
+        self.assertEqual(len(encounter_ids), 0)
+
+    def test_discard(self):
+        encounter_ids = EncounterIds(slots=10, now=1000)
+        encounter_ids.add('MTA0MjA0NDU4NTU4NzI1NTQ5MjE=', 1002)
+        encounter_ids.add('something else', 1002)
+
+        encounter_ids.discard('MTA0MjA0NDU4NTU4NzI1NTQ5MjE=')
+        encounter_ids.discard('something else')
+        encounter_ids.discard('never added')
+        self.assertEqual(len(encounter_ids), 0)
+
+        # added again after the discard
+        encounter_ids.add('something else', 1005)
+        encounter_ids.advance(1003)
+        self.assertTrue('something else' in encounter_ids)
@@ -0,0 +1,64 @@
+from notifier import gamedata
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestGameData(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'gamedata.cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lookups(self):
+        game_data = gamedata.GameData()
+        self.assertEqual(game_data.get_pokemon_name(133), 'Eevee')
+        self.assertEqual(game_data.get_pokemon_name("133"), 'Eevee')
+        self.assertIsNone(game_data.get_pokemon_name(9999))
+        self.assertIsNone(game_data.get_pokemon_name(-1))
+        self.assertEqual(game_data.get_pokemon_id('Eevee'), 133)
+        self.assertEqual(game_data.get_move_name(2), 'Quick Attack')
+        self.assertEqual(game_data.base_attack[149], game_data.get_stats(149)['attack'])
+        self.assertEqual(game_data.base_attack[300], 0)
+
+    def test_level_index(self):
+        self.assertEqual(gamedata.get_level_index(1), 0)
+        self.assertEqual(gamedata.get_level_index("5.5"), 9)
+        self.assertEqual(gamedata.get_level_index(40), 78)
+        self.assertIsNone(gamedata.get_level_index(41))
+        self.assertIsNone(gamedata.get_level_index("5.2"))
+
+        for level_index in range(0, gamedata.LEVEL_COUNT):
+            self.assertEqual(gamedata.get_level_index(level_index / 2.0 + 1), level_index)
+
+    def test_levels(self):
+        game_data = gamedata.GameData()
+        self.assertEqual(game_data.get_cpm_for_level("5.5"), game_data.get_cpm_for_level(5.5))
+        self.assertIsNone(game_data.get_cpm_for_level(41))
+        self.assertEqual(game_data.get_level_from_cpm(game_data.get_cpm_for_level("5.5")), 5.5)
+
+    def test_cache(self):
+        uncached = gamedata.GameData(cache_file=self.cache_file)
+        self.assertTrue(os.path.exists(self.cache_file))
+
+        cached = gamedata.GameData(cache_file=self.cache_file)
+        self.assertEqual(cached.pokemon_names, uncached.pokemon_names)
+        self.assertEqual(cached.move_ids, uncached.move_ids)
+        self.assertEqual(cached.stats, uncached.stats)
+        self.assertEqual(cached.cp_multipliers, uncached.cp_multipliers)
+
+    def test_outdated_cache(self):
+        game_data = gamedata.GameData()
+        game_data.save_cache(self.cache_file, ['outdated'])
+
+        self.assertFalse(game_data.load_cache(self.cache_file, game_data.get_source_key()))
+        self.assertEqual(gamedata.GameData(cache_file=self.cache_file).get_pokemon_name(1), 'Bulbasaur')
+
+    def test_corrupt_cache(self):
+        with open(self.cache_file, 'wb') as f:
+            f.write(b'garbage')
+
+        self.assertEqual(gamedata.GameData(cache_file=self.cache_file).get_pokemon_name(1), 'Bulbasaur')
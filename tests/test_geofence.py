@@ -0,0 +1,90 @@
+from notifier.geofence import GeofenceIndex, RasterizedGeofence, INSIDE, OUTSIDE
+from notifier.utils import is_inside_geofence
+import math
+import random
+import unittest
+
+
+def make_geofence(polygon):
+    xs = [x for x, _ in polygon]
+    ys = [y for _, y in polygon]
+    return {'boundaries': {'min': [min(xs), min(ys)], 'max': [max(xs), max(ys)]}, 'polygon': polygon}
+
+
+class TestGeofenceIndex(unittest.TestCase):
+    def setUp(self):
+        self.geofences = {
+            'Someplace': make_geofence([(47.69030553853416, -122.3214340209961),
+                                        (47.64128858814697, -122.41310119628906),
+                                        (47.572077942751605, -122.31868743896484),
+                                        (47.62393666282315, -122.22599029541016)]),
+            'Square': make_geofence([(47.6, -122.4), (47.7, -122.4), (47.7, -122.3), (47.6, -122.3)]),
+            'Elsewhere': make_geofence([(10, 10), (10, 11), (11, 11), (11, 10)])
+        }
+        self.index = GeofenceIndex(self.geofences)
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup(47.63527390649546, -122.376708984375), frozenset(['Someplace', 'Square']))
+        self.assertEqual(self.index.lookup(47.59292021272622, -122.26753234863281), frozenset())
+        self.assertEqual(self.index.lookup(47.69, -122.39), frozenset(['Square']))
+        self.assertEqual(self.index.lookup(10.5, 10.5), frozenset(['Elsewhere']))
+        self.assertEqual(self.index.lookup(-45, 170), frozenset())
+        self.assertEqual(self.index.lookup(None, None), frozenset())
+
+    def test_large_fence_grows_cells(self):
+        index = GeofenceIndex({'Large': make_geofence([(0, 0), (0, 50), (50, 50), (50, 0)])})
+        self.assertTrue(len(index.cells) <= 65 * 65)
+        self.assertEqual(index.lookup(25, 25), frozenset(['Large']))
+
+
+class TestRasterizedGeofence(unittest.TestCase):
+    @staticmethod
+    def make_star(vertices, center=(47.63, -122.32), radius=0.05, jitter=0.5):
+        rng = random.Random(vertices)
+        polygon = []
+        for i in range(0, vertices):
+            angle = 2 * math.pi * i / vertices
+            r = radius * (1 - rng.random() * jitter)
+            polygon.append((center[0] + r * math.cos(angle), center[1] + r * math.sin(angle)))
+        return polygon
+
+    def assert_same_as_ray_cast(self, polygon, points=1000):
+        geofence = make_geofence(polygon)
+        raster = RasterizedGeofence(polygon, geofence['boundaries'])
+        rng = random.Random(1)
+        min_x, min_y = geofence['boundaries']['min']
+        max_x, max_y = geofence['boundaries']['max']
+
+        for _ in range(0, points):
+            x, y = rng.uniform(min_x - 0.01, max_x + 0.01), rng.uniform(min_y - 0.01, max_y + 0.01)
+            self.assertEqual(raster.contains(x, y), is_inside_geofence(geofence, x, y), (x, y))
+
+    def test_simple_fence(self):
+        self.assert_same_as_ray_cast([(47.69030553853416, -122.3214340209961),
+                                      (47.64128858814697, -122.41310119628906),
+                                      (47.572077942751605, -122.31868743896484),
+                                      (47.62393666282315, -122.22599029541016)])
+
+    def test_round_fences(self):
+        # vertices on the lines the raster walks along
+        polygon = [(52.6, 13.0), (52.0, 13.5), (51.0, 13.0), (52.0, 12.0)]
+        raster = RasterizedGeofence(polygon, make_geofence(polygon)['boundaries'])
+        self.assertTrue(raster.contains(51.902, 12.597))
+        self.assert_same_as_ray_cast(polygon)
+
+        rng = random.Random(2)
+        for _ in range(0, 150):
+            polygon = [(round(rng.uniform(51, 53), 1), round(rng.uniform(12, 14), 1))
+                       for _ in range(0, rng.randint(3, 12))]
+            self.assert_same_as_ray_cast(polygon, points=200)
+
+    def test_large_fence(self):
+        self.assert_same_as_ray_cast(self.make_star(1500))
+
+    def test_cell_states(self):
+        polygon = self.make_star(1500, jitter=0.05)
+        raster = RasterizedGeofence(polygon, make_geofence(polygon)['boundaries'])
+
+        self.assertTrue(INSIDE in raster.status)
+        self.assertTrue(OUTSIDE in raster.status)
+        self.assertTrue(len(raster.boundary_cells) < len(raster.status) / 2)
@@ -0,0 +1,173 @@
+from notifier.config import Config
+from notifier.ingest import DuplicateFilter, FrameFilter, IngestQueue, decode_frames, get_frame_expiry, get_shard
+import json
+import Queue
+import time
+import unittest
+
+
+class TestIngestQueue(unittest.TestCase):
+    @staticmethod
+    def _make_pokemon(encounter_id, time_left):
+        return {'type': 'pokemon', 'message': {'encounter_id': encounter_id,
+                                               'disappear_time': int(time.time()) + time_left}}
+
+    def test_decode_frames(self):
+        self.assertEqual(decode_frames('{"type": "raid", "message": {}}'), [{'type': 'raid', 'message': {}}])
+        self.assertEqual(len(decode_frames('[{"type": "raid"}, {"type": "pokemon"}]')), 2)
+        self.assertRaises(ValueError, decode_frames, '[{"type": ')
+
+    def test_shard(self):
+        raid = {'type': 'raid', 'message': {'gym_id': u'GYMID='}}
+        gym = {'type': 'gym_details', 'message': {'id': 'GYMID='}}
+        self.assertEqual(get_shard(raid, 4), get_shard(gym, 4))
+        self.assertEqual(get_shard({'type': 'pokestop', 'message': {}}, 4), 0)
+
+        shards = set(get_shard({'type': 'pokemon', 'message': {'encounter_id': str(i)}}, 4) for i in range(0, 100))
+        self.assertEqual(shards, set([0, 1, 2, 3]))
+
+    def test_frame_expiry(self):
+        self.assertEqual(get_frame_expiry({'type': 'raid', 'message': {'end': 10}}), 10)
+        self.assertEqual(get_frame_expiry({'type': 'pokemon', 'message': {'disappear_time': 20}}), 20)
+        self.assertIsNone(get_frame_expiry({'type': 'gym_details', 'message': {}}))
+
+    def test_block(self):
+        queue = IngestQueue(1)
+        queue.put(self._make_pokemon('a', 600))
+        self.assertRaises(Queue.Full, queue.put, self._make_pokemon('b', 600), True, 0.01)
+
+    def test_drop_oldest(self):
+        queue = IngestQueue(2, 'drop_oldest')
+        for encounter_id in ['a', 'b', 'c']:
+            queue.put(self._make_pokemon(encounter_id, 600))
+
+        self.assertEqual(queue.get()['message']['encounter_id'], 'b')
+        self.assertEqual(queue.get_stats()['shed_oldest'], 1)
+        self.assertEqual(queue.get_stats()['received'], 3)
+
+    def test_drop_expired(self):
+        queue = IngestQueue(2, 'drop_expired', min_time_left=60)
+
+        # too late on arrival
+        queue.put(self._make_pokemon('a', 30))
+        self.assertEqual(queue.qsize(), 0)
+
+        # expired while waiting, makes room before the oldest is dropped
+        queue.put(self._make_pokemon('b', 600))
+        queue.put(self._make_pokemon('c', 600))
+        queue.queue[0]['message']['disappear_time'] = int(time.time())
+        queue.put({'type': 'gym_details', 'message': {}})
+
+        self.assertEqual(queue.get()['message']['encounter_id'], 'c')
+        self.assertEqual(queue.get()['type'], 'gym_details')
+        self.assertEqual(queue.get_stats()['shed_expired'], 2)
+        self.assertEqual(queue.get_stats()['shed_oldest'], 0)
+
+    def test_expired_on_get(self):
+        queue = IngestQueue(0, 'drop_expired', min_time_left=60)
+        queue.put(self._make_pokemon('a', 600))
+        queue.put(self._make_pokemon('b', 600))
+        queue.queue[0]['message']['disappear_time'] = int(time.time())
+
+        self.assertEqual(queue.get()['message']['encounter_id'], 'b')
+        self.assertEqual(queue.get_stats()['shed_expired'], 1)
+
+        queue.task_done()
+        self.assertEqual(queue.unfinished_tasks, 0)
+        queue.join()
+
+    def test_unknown_policy(self):
+        self.assertRaises(RuntimeError, IngestQueue, 10, 'drop_everything')
+
+
+class TestFrameFilter(unittest.TestCase):
+    @staticmethod
+    def _make_filter(raids=False, trainers=False):
+        config = {
+            'includes': {'all': {'pokemons': [{'min_id': 1}]}},
+            'notification_settings': {'Default': {'includes': ['all'], 'gym': trainers}}
+        }
+        if raids:
+            config['raid_includes'] = {'all': {'levels': [5]}}
+            config['notification_settings']['Default']['raid_includes'] = ['all']
+        if trainers:
+            config['trainers'] = ['Trainer1']
+
+        return FrameFilter(Config(config))
+
+    @staticmethod
+    def _get_data(webhook):
+        with open('tests/data/webhooks/' + webhook + '.json') as f:
+            return json.load(f)
+
+    def test_types(self):
+        frame_filter = self._make_filter()
+        pokemon = self._get_data('pokemon-with-encounter')
+        self.assertIs(frame_filter.apply(pokemon), pokemon)
+        self.assertIsNone(frame_filter.apply(self._get_data('raid')))
+        self.assertIsNone(frame_filter.apply(self._get_data('gym-details')))
+        self.assertIsNone(frame_filter.apply({'type': 'pokestop', 'message': {}}))
+
+    def test_gyms_for_raids(self):
+        frame_filter = self._make_filter(raids=True)
+        self.assertIsNotNone(frame_filter.apply(self._get_data('raid')))
+
+        gym = frame_filter.apply(self._get_data('gym-details'))['message']
+        self.assertEqual(gym['name'], 'GymName')
+        self.assertFalse('pokemon' in gym)
+        self.assertFalse('url' in gym)
+
+    def test_gyms_for_trainers(self):
+        frame_filter = self._make_filter(trainers=True)
+        self.assertIsNone(frame_filter.apply(self._get_data('raid')))
+
+        gym = frame_filter.apply(self._get_data('gym-details'))['message']
+        self.assertEqual([p['trainer_name'] for p in gym['pokemon']], ['Trainer1', 'Trainer2', 'Trainer3', 'Trainer4'])
+        self.assertEqual(gym['pokemon'][0].keys(), ['trainer_name'])
+
+
+class TestDuplicateFilter(unittest.TestCase):
+    @staticmethod
+    def _get_data(webhook):
+        with open('tests/data/webhooks/' + webhook + '.json') as f:
+            return json.load(f)
+
+    def test_duplicates(self):
+        duplicate_filter = DuplicateFilter()
+        pokemon = self._get_data('pokemon-with-encounter')
+        pokemon['message']['disappear_time'] = int(time.time()) + 600
+        raid, egg = self._get_data('raid'), self._get_data('egg')
+        for data in [raid, egg]:
+            data['message'].update({'gym_id': 'gym', 'start': 100, 'end': int(time.time()) + 600})
+
+        self.assertFalse(duplicate_filter.is_duplicate(pokemon))
+        self.assertTrue(duplicate_filter.is_duplicate(pokemon))
+
+        # the egg and the raid hatched from it are both kept
+        self.assertFalse(duplicate_filter.is_duplicate(egg))
+        self.assertFalse(duplicate_filter.is_duplicate(raid))
+        self.assertTrue(duplicate_filter.is_duplicate(raid))
+
+        self.assertFalse(duplicate_filter.is_duplicate(self._get_data('gym-details')))
+        self.assertEqual(duplicate_filter.get_stats(), {'duplicates': 2, 'duplicate_ratio': 0.4})
+
+    def test_shed_frames_are_forgotten(self):
+        duplicate_filter = DuplicateFilter()
+        queue = IngestQueue(2, 'drop_oldest', on_shed=duplicate_filter.forget)
+        frames = [TestIngestQueue._make_pokemon(encounter_id, 600) for encounter_id in ['a', 'b', 'c']]
+        for data in frames:
+            self.assertFalse(duplicate_filter.is_duplicate(data))
+            queue.put(data)
+
+        # a later copy of the shed frame is kept, copies of the queued ones are still dropped
+        self.assertFalse(duplicate_filter.is_duplicate(frames[0]))
+        self.assertTrue(duplicate_filter.is_duplicate(frames[1]))
+
+    def test_expired(self):
+        duplicate_filter = DuplicateFilter()
+        pokemon = self._get_data('pokemon-with-encounter')
+        pokemon['message']['disappear_time'] = int(time.time()) + 10
+
+        self.assertFalse(duplicate_filter.is_duplicate(pokemon))
+        duplicate_filter.clean(time.time() + 20)
+        self.assertFalse(duplicate_filter.is_duplicate(pokemon))
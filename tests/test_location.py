@@ -0,0 +1,100 @@
+from notifier.geofence import GeofenceIndex
+from notifier.location import DistanceConstraint, LocationConstraints
+import gpxpy.geo
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+
+def make_locations(cache_size=100, cache_file=None):
+    polygon = [(47.6, -122.4), (47.7, -122.4), (47.7, -122.3), (47.6, -122.3)]
+    geofences = {'Square': {'boundaries': {'min': [47.6, -122.4], 'max': [47.7, -122.3]}, 'polygon': polygon}}
+    return LocationConstraints(GeofenceIndex(geofences), cache_size, cache_file)
+
+
+class TestLocationConstraints(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_file = os.path.join(self.tmp_dir, 'locations.cache')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_register(self):
+        locations = make_locations()
+        self.assertEqual(locations.register('min_lat', 47.0), 1)
+        self.assertEqual(locations.register('geofence', 'Square'), 2)
+        self.assertEqual(locations.register('min_lat', 47.0), 1)
+        self.assertEqual(locations.register('min_lat', 48.0), 4)
+
+    def test_evaluate(self):
+        locations = make_locations()
+        locations.register('min_lat', 47.0)
+        locations.register('geofence', 'Square')
+        locations.register('geofence', 'Unknown')
+        locations.register('max_lon', -123.0)
+
+        self.assertEqual(locations.evaluate(47.65, -122.35), 1 | 2)
+        self.assertEqual(locations.evaluate(46.0, -124.0), 8)
+
+    def test_cached_by_spawnpoint(self):
+        locations = make_locations()
+        locations.register('geofence', 'Square')
+
+        self.assertEqual(locations.get_mask({'lat': 47.65, 'lon': -122.35, 'spawnpoint_id': 'abc'}), 1)
+
+        # spawnpoints never move, so the cached outcome is used
+        self.assertEqual(locations.get_mask({'lat': 0, 'lon': 0, 'spawnpoint_id': 'abc'}), 1)
+        self.assertEqual(locations.get_mask({'lat': 0, 'lon': 0, 'spawnpoint_id': 'def'}), 0)
+
+        # without a spawnpoint the rounded coordinates are the key
+        self.assertEqual(locations.get_mask({'lat': 47.65, 'lon': -122.35}), 1)
+        self.assertEqual(locations.cache[(47.65, -122.35)], 1)
+
+    def test_bounded(self):
+        locations = make_locations(cache_size=2)
+        locations.register('min_lat', 0)
+        for spawnpoint_id in ['a', 'b', 'a', 'c']:
+            locations.get_mask({'lat': 1, 'lon': 1, 'spawnpoint_id': spawnpoint_id})
+
+        self.assertEqual(list(locations.cache.keys()), ['a', 'c'])
+
+    def test_persistence(self):
+        locations = make_locations(cache_file=self.cache_file)
+        locations.register('geofence', 'Square')
+        locations.get_mask({'lat': 47.65, 'lon': -122.35, 'spawnpoint_id': 'abc'})
+        locations.save_cache()
+
+        loaded = make_locations(cache_file=self.cache_file)
+        loaded.register('geofence', 'Square')
+        loaded.load_cache()
+        self.assertEqual(loaded.cache, {'abc': 1})
+
+        # different constraints, different bits
+        outdated = make_locations(cache_file=self.cache_file)
+        outdated.register('min_lat', 1)
+        outdated.load_cache()
+        self.assertEqual(outdated.cache, {})
+
+
+class TestDistanceConstraint(unittest.TestCase):
+    def test_same_as_haversine(self):
+        rng = random.Random(1)
+        for center_lat, center_lon in [(47.63, -122.32), (59.9, 10.7), (-33.9, 151.2), (0.5, 179.99)]:
+            for max_dist in [100, 2000, 50000]:
+                constraint = DistanceConstraint(center_lat, center_lon, max_dist)
+                spread = 3 * max_dist / 111000.0
+                for _ in range(0, 500):
+                    lat = center_lat + rng.uniform(-spread, spread)
+                    lon = center_lon + rng.uniform(-spread, spread)
+                    expected = gpxpy.geo.haversine_distance(center_lat, center_lon, lat, lon) <= max_dist
+                    self.assertEqual(constraint.contains(lat, lon), expected, (center_lat, center_lon, lat, lon))
+
+    def test_max_dist_constraint(self):
+        locations = make_locations()
+        locations.register('max_dist', (47.65, -122.35, 2000))
+
+        self.assertEqual(locations.evaluate(47.66, -122.36), 1)
+        self.assertEqual(locations.evaluate(47.70, -122.35), 0)
@@ -1,6 +1,9 @@
 from notifier import Notifier, NotificationHandler
 from notifier.manager import NotifierManager
 import json
+import os
+import signal
+import time
 import unittest
 
 
@@ -80,6 +83,8 @@ class TestNotifier(unittest.TestCase):
             self.assertEqual(pokemon['move_2'], u'Swift')
             self.assertAlmostEqual(pokemon['iv'], 44.44, places=2)
             self.assertFalse('form' in pokemon)
+            self.assertFalse('move_1_id' in pokemon)
+            self.assertFalse('move_2_id' in pokemon)
 
         self.notificationhandler.on_pokemon = test
         self.notifierhandler.handle_pokemon(data['message'])
@@ -147,6 +152,275 @@ class TestNotifier(unittest.TestCase):
         self.notifierhandler.handle_raid(raid_data)
         self.assertTrue(self.notificationhandler.notify_raid_called)
 
+    def test_fast_path_stops_at_first_match(self):
+        data = self._get_data("pokemon-without-encounter")
+        rules = [CountingRule(True), CountingRule(True)]
+        self.config.pokemon_includes['default_pokemon'] = rules
+        self.config.pokemon_rule_index.index = {data['message']['pokemon_id']: [('default_pokemon', rules)]}
+
+        self.notificationhandler.on_pokemon = lambda settings, pokemon: None
+        self.notifierhandler.handle_pokemon(data['message'])
+
+        self.assertTrue(self.notificationhandler.notify_pokemon_called)
+        self.assertEqual([rule.calls for rule in rules], [1, 0])
+
+    def test_fast_path_skips_notified_includes(self):
+        data = self._get_data("pokemon-without-encounter")
+        rules = [CountingRule(True)]
+        other_rules = [CountingRule(True)]
+        self.config.pokemon_includes_to_notifications['other_pokemon'] = ['Default']
+        self.config.pokemon_rule_index.index = {
+            data['message']['pokemon_id']: [('default_pokemon', rules), ('other_pokemon', other_rules)]
+        }
+
+        self.notificationhandler.on_pokemon = lambda settings, pokemon: None
+        self.notifierhandler.handle_pokemon(data['message'])
+
+        self.assertEqual(rules[0].calls, 1)
+        self.assertEqual(other_rules[0].calls, 0)
+
+    def test_explain_mode(self):
+        config = self._make_config({"min_id": 0, "max_id": 999})
+        config['config']['explain'] = True
+        self.notifiermanager = NotifierManager(config)
+        self.notifiermanager.notifier.set_notification_handler("simple", self.notificationhandler)
+        self.assertTrue(self.notifiermanager.config.explain)
+
+        data = self._get_data("pokemon-without-encounter")
+        self.notificationhandler.on_pokemon = lambda settings, pokemon: None
+        self.notifiermanager.handler.handle_pokemon(data['message'])
+
+        self.assertTrue(self.notificationhandler.notify_pokemon_called)
+
+    def test_subscriptions(self):
+        config = self._make_config({"min_id": 0, "max_id": 999})
+        config['config']['subscriptions'] = True
+        self.notifiermanager = NotifierManager(config)
+        self.notifiermanager.notifier.set_notification_handler("simple", self.notificationhandler)
+        self.assertIsNotNone(self.notifiermanager.config.subscription_index)
+
+        data = self._get_data("pokemon-without-encounter")
+        self.notificationhandler.on_pokemon = lambda settings, pokemon: None
+        self.notifiermanager.handler.handle_pokemon(data['message'])
+
+        self.assertTrue(self.notificationhandler.notify_pokemon_called)
+
+    def test_reload(self):
+        data = self._get_data("pokemon-without-encounter")
+        self.notificationhandler.on_pokemon = lambda settings, pokemon: None
+        self.notifierhandler.handle_pokemon(data['message'])
+
+        self.notifiermanager.config_file['includes']['default_pokemon']['pokemons'] = [{'min_id': 999}]
+        self.notifiermanager.reload().join()
+        self.assertIs(self.notifierhandler.config, self.config)
+
+        # swapped by the notifier thread before the next message
+        self.notifiermanager.swap_config()
+        self.assertIsNot(self.notifierhandler.config, self.config)
+        self.assertIs(self.notifier.config, self.notifierhandler.config)
+        self.assertTrue(data['message']['encounter_id'] in self.notifierhandler.processed_pokemons)
+        self.assertIs(self.notifier.config.notification_handlers['simple'], self.notificationhandler)
+
+        self.notificationhandler.notify_pokemon_called = False
+        data['message']['encounter_id'] = 'other'
+        self.notifierhandler.handle_pokemon(data['message'])
+        self.assertFalse(self.notificationhandler.notify_pokemon_called)
+
+    def test_swap_during_reload(self):
+        self.notifiermanager.reload().join()
+        pending_config = self.notifiermanager.pending_config
+
+        # a reload storing its config meanwhile must not be overwritten or cleared
+        with self.notifiermanager.reload_lock:
+            self.notifiermanager.swap_config()
+        self.assertIs(self.notifiermanager.pending_config, pending_config)
+        self.assertIs(self.notifiermanager.config, self.config)
+
+        self.notifiermanager.swap_config()
+        self.assertIsNone(self.notifiermanager.pending_config)
+        self.assertIs(self.notifiermanager.config, pending_config)
+
+    def test_failed_reload(self):
+        self.notifiermanager.config_file['includes'] = {}
+        self.notifiermanager.config_file['raid_includes'] = {}
+        self.notifiermanager.reload().join()
+
+        self.assertIsNone(self.notifiermanager.pending_config)
+
+    def test_gym_trainers_unknown(self):
+        self.config.trainers = ['Trainer1']
+        self.config.notification_settings['Default']['gym'] = True
+        joined = []
+        self.notificationhandler.on_gym = lambda endpoint, gym: joined.append(gym['trainer_name'])
+        data = self._get_data("gym-details")['message']
+
+        # stored while no trainers were tracked, Trainer1 was in the gym already
+        stripped = dict((key, value) for key, value in data.items() if key != 'pokemon')
+        self.notifierhandler.handle_gym_details(stripped)
+        self.assertIsNone(self.notifierhandler.gyms[data['id']]['trainers'])
+
+        self.notifierhandler.handle_gym_details(data)
+        self.assertEqual(joined, [])
+
+        data['pokemon'] = data['pokemon'][1:]
+        self.notifierhandler.handle_gym_details(data)
+        data['pokemon'] = self._get_data("gym-details")['message']['pokemon']
+        self.notifierhandler.handle_gym_details(data)
+        self.assertEqual(joined, ['Trainer1'])
+
+    def test_receive(self):
+        raid, egg = self._get_data("raid"), self._get_data("egg")
+        for data in [raid, egg]:
+            data['message']['end'] = int(time.time()) + 600
+
+        self.notifiermanager.receive(json.dumps([raid, egg]))
+        self.assertEqual(self.notifiermanager.queue.qsize(), 2)
+
+        # resent by another worker
+        self.notifiermanager.receive(json.dumps(raid))
+        self.assertEqual(self.notifiermanager.queue.qsize(), 2)
+        self.assertEqual(self.notifiermanager.get_stats()['duplicates'], 1)
+
+        self.assertRaises(ValueError, self.notifiermanager.receive, '[{"type": ')
+
+    def test_deferred_decode(self):
+        config = self._make_config()
+        config['config']['defer_decode'] = True
+        self.notifiermanager = NotifierManager(config)
+
+        self.notifiermanager.receive(json.dumps([self._get_data("raid"), self._get_data("egg")]))
+        self.notifiermanager.receive('[{"type": ')
+        self.assertEqual(self.notifiermanager.queue.qsize(), 0)
+        self.assertEqual(self.notifiermanager.get_stats()['raw_queued'], 2)
+
+        # invalid bodies are logged by the decoder thread
+        self.notifiermanager.decoder.start()
+        self.notifiermanager.raw_queue.join()
+        self.assertEqual(self.notifiermanager.queue.qsize(), 2)
+
+    def test_deferred_decode_sheds_bodies(self):
+        config = self._make_config()
+        config['config']['defer_decode'] = True
+        config['config']['raw_queue_size'] = 1
+        config['config']['queue_size'] = 10
+        self.notifiermanager = NotifierManager(config)
+
+        # a full raw queue drops the oldest body instead of blocking the receiver
+        egg = self._get_data("egg")
+        self.notifiermanager.receive(json.dumps([self._get_data("raid")]))
+        self.notifiermanager.receive(json.dumps([egg]))
+        stats = self.notifiermanager.get_stats()
+        self.assertEqual(stats['raw_queued'], 1)
+        self.assertEqual(stats['raw_shed'], 1)
+
+        self.notifiermanager.decoder.start()
+        self.notifiermanager.raw_queue.join()
+        self.assertEqual(self.notifiermanager.queue.get_nowait(), egg)
+
+    def test_shards(self):
+        config = self._make_config()
+        config['config']['workers'] = 2
+        self.notifiermanager = NotifierManager(config)
+        self.config = self.notifiermanager.config
+        self.assertIsNone(self.notifiermanager.handler)
+        self.notifiermanager.start()
+
+        frames = []
+        for encounter_id in range(0, 20):
+            data = self._get_data("pokemon-with-encounter")
+            data['message']['encounter_id'] = str(encounter_id)
+            data['message']['disappear_time'] = int(time.time()) + 600
+            frames.append(data)
+        self.notifiermanager.receive(json.dumps(frames))
+
+        self.notifiermanager.queue.join()
+        for shard in self.notifiermanager.shards:
+            shard.queue.join()
+        shards = self.notifiermanager.get_stats()['shards']
+        self.assertEqual(sum(shard['routed'] for shard in shards), 20)
+        self.assertEqual([shard['queued'] for shard in shards], [0, 0])
+
+        # the shards reload after the notifier thread, without holding up the next frames
+        self.notifiermanager.reload().join()
+        self.notifiermanager.receive(json.dumps(self._get_data("pokemon-without-encounter")))
+        self.notifiermanager.queue.join()
+        self.assertIsNot(self.notifiermanager.config, self.config)
+        for shard in self.notifiermanager.shards:
+            shard.queue.join()
+            self.assertTrue(shard.process.is_alive())
+
+    def test_dead_shards(self):
+        config = self._make_config()
+        config['config']['workers'] = 2
+        self.notifiermanager = NotifierManager(config)
+        self.notifiermanager.start()
+
+        # frames the handler fails on are logged, the shard keeps running
+        self.notifiermanager.enqueue({'type': 'pokemon', 'message': {'encounter_id': 'broken'}})
+        self.notifiermanager.queue.join()
+        for shard in self.notifiermanager.shards:
+            shard.queue.join()
+            self.assertTrue(shard.process.is_alive())
+
+        # a HUP to the process group reloads the parent, the shards ignore it
+        for shard in self.notifiermanager.shards:
+            os.kill(shard.process.pid, signal.SIGHUP)
+        time.sleep(0.1)
+        for shard in self.notifiermanager.shards:
+            self.assertTrue(shard.process.is_alive())
+
+        # a shard that died is restarted instead of blocking the notifier thread
+        dead = self.notifiermanager.shards[0]
+        dead.process.terminate()
+        dead.process.join()
+
+        for encounter_id in range(0, 10):
+            data = self._get_data("pokemon-without-encounter")
+            data['message']['encounter_id'] = str(encounter_id)
+            self.notifiermanager.enqueue(data)
+        self.notifiermanager.queue.join()
+
+        self.assertIsNot(self.notifiermanager.shards[0], dead)
+        for shard in self.notifiermanager.shards:
+            shard.queue.join()
+            self.assertTrue(shard.process.is_alive())
+        self.assertEqual([shard['queued'] for shard in self.notifiermanager.get_stats()['shards']], [0, 0])
+
+    def test_raid_name_and_moves(self):
+        config = self._make_config()
+        config['raid_includes']['default_raid']['pokemons'] = [{'name': 'Lugia', 'moves': [{'move_1': 'Extrasensory'}]}]
+        self.notifiermanager = NotifierManager(config)
+        self.notifiermanager.notifier.set_notification_handler("simple", self.notificationhandler)
+
+        def test(endpoint, raid):
+            self.assertEqual(raid['name'], 'Lugia')
+            self.assertEqual(raid['move_1'], 'Extrasensory')
+            self.assertFalse('move_1_id' in raid)
+            self.assertFalse('move_2_id' in raid)
+
+        self.notificationhandler.on_raid = test
+        self.notifiermanager.handler.handle_raid(self._get_data("raid")['message'])
+
+        self.assertTrue(self.notificationhandler.notify_raid_called)
+
+    def test_raid_other_name(self):
+        config = self._make_config()
+        config['raid_includes']['default_raid']['pokemons'] = [{'name': 'Blastoise'}]
+        self.notifiermanager = NotifierManager(config)
+        self.notifiermanager.notifier.set_notification_handler("simple", self.notificationhandler)
+
+        self.notifiermanager.handler.handle_raid(self._get_data("raid")['message'])
+
+        self.assertFalse(self.notificationhandler.notify_raid_called)
+
+    def test_unknown_names_are_rejected(self):
+        config = self._make_config({"name": "Missingno"})
+        self.assertRaises(RuntimeError, NotifierManager, config)
+
+        config = self._make_config()
+        config['raid_includes']['default_raid']['pokemons'] = [{'moves': [{'move_2': 'Hyper Bean'}]}]
+        self.assertRaises(RuntimeError, NotifierManager, config)
+
     def setup_geofence(self):
         config = self._make_config()
         config['config']['geofence_file'] = "tests/data/geofence/geofences.txt"
@@ -168,6 +442,9 @@ class TestNotifier(unittest.TestCase):
 
         def test_geofence(endpoint, pokemon):
             self.assertIsNotNone(pokemon)
+            self.assertFalse('location_mask' in pokemon)
+            self.assertFalse('spawnpoint_id' in pokemon)
+            self.assertFalse('move_1_id' in pokemon)
 
         self.notificationhandler.on_pokemon = test_geofence
         self.notifierhandler.handle_pokemon(message)
@@ -210,6 +487,7 @@ class TestNotifier(unittest.TestCase):
 
         def test_geofence(endpoint, pokemon):
             self.assertIsNotNone(pokemon)
+            self.assertFalse('location_mask' in pokemon)
 
         self.notificationhandler.on_raid = test_geofence
         self.notifierhandler.handle_raid(message)
@@ -233,6 +511,17 @@ def get_geofence_coords(inside):
         return 47.59292021272622, -122.26753234863281
 
 
+class CountingRule:
+    def __init__(self, result):
+        self.result = result
+        self.calls = 0
+        self.predicates = [('counting', self.matches)]
+
+    def matches(self, pokemon):
+        self.calls += 1
+        return self.result
+
+
 class TestNotificationHandler(NotificationHandler):
     notify_gym_called = False
     notify_raid_called = False
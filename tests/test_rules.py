@@ -0,0 +1,255 @@
+from notifier.gamedata import get_game_data
+from notifier.geofence import GeofenceIndex
+from notifier.handler import Handler
+from notifier.location import LocationConstraints
+from notifier.rules import PokemonRule, PokemonRuleIndex, RaidRule, RaidRuleIndex, SubscriptionIndex, \
+    normalize_rules, remove_subsumed_rules, rule_subsumes, unique_rules
+import random
+import unittest
+
+
+class TestPokemonRuleIndex(unittest.TestCase):
+    def setUp(self):
+        self.includes = {
+            'named': [{'name': 'Eevee'}, {'name': 'Pidgey', 'min_iv': 90}],
+            'ranged': [{'min_id': 130, 'max_id': 140}],
+            'wildcard': [{'min_iv': 100}]
+        }
+        self.index = PokemonRuleIndex(self.includes)
+
+    def test_named_rules(self):
+        candidates = dict(self.index.candidates(133))
+        self.assertEqual(candidates['named'], [{'name': 'Eevee'}])
+
+        candidates = dict(self.index.candidates(16))
+        self.assertEqual(candidates['named'], [{'name': 'Pidgey', 'min_iv': 90}])
+        self.assertFalse('ranged' in candidates)
+
+    def test_ranged_rules(self):
+        self.assertTrue('ranged' in dict(self.index.candidates(130)))
+        self.assertTrue('ranged' in dict(self.index.candidates(140)))
+        self.assertFalse('ranged' in dict(self.index.candidates(141)))
+
+    def test_wildcard_rules(self):
+        for pokemon_id in [1, 133, 721]:
+            self.assertEqual(dict(self.index.candidates(pokemon_id))['wildcard'], [{'min_iv': 100}])
+
+    def test_unknown_species(self):
+        candidates = dict(self.index.candidates(9999))
+        self.assertEqual(candidates.keys(), ['wildcard'])
+
+    def test_rule_order_is_kept(self):
+        index = PokemonRuleIndex({'mixed': [{'min_iv': 90}, {'name': 'Eevee'}, {'min_iv': 80}]})
+        self.assertEqual(dict(index.candidates(133))['mixed'], [{'min_iv': 90}, {'name': 'Eevee'}, {'min_iv': 80}])
+        self.assertEqual(dict(index.candidates(1))['mixed'], [{'min_iv': 90}, {'min_iv': 80}])
+
+
+class TestPokemonRule(unittest.TestCase):
+    def setUp(self):
+        self.locations = LocationConstraints(GeofenceIndex({}))
+
+    @staticmethod
+    def _make_pokemon(**kwargs):
+        pokemon = {'id': 149, 'lat': 10.0, 'lon': 20.0}
+        pokemon.update(kwargs)
+        return pokemon
+
+    def test_only_configured_constraints(self):
+        rule = PokemonRule({'name': 'Dragonite', 'min_iv': 90}, self.locations)
+        self.assertEqual([key for key, _ in rule.predicates], ['name', 'min_iv'])
+
+    def test_selective_constraints_first(self):
+        rule = PokemonRule({'geofence': 'x', 'min_lat': 1, 'min_cp': {'30': 10}, 'min_iv': 90}, self.locations)
+        self.assertEqual([key for key, _ in rule.predicates], ['min_iv', 'min_lat/geofence', 'min_cp'])
+
+    def test_missing_values(self):
+        rule = PokemonRule({'min_iv': 0}, self.locations)
+        self.assertFalse(Handler.pokemon_matches(self._make_pokemon(), rule)[0])
+
+        rule = PokemonRule({'max_iv': 100}, self.locations)
+        self.assertFalse(Handler.pokemon_matches(self._make_pokemon(), rule)[0])
+        self.assertTrue(Handler.pokemon_matches(self._make_pokemon(iv=50), rule)[0])
+
+    def test_cp_at_level(self):
+        pokemon = self._make_pokemon(attack=15, defense=15, stamina=15)
+
+        # Dragonite at level 39 with 15,15,15 == 3530
+        self.assertTrue(Handler.pokemon_matches(pokemon, PokemonRule({'min_cp': {'39': 3530}}, self.locations))[0])
+        self.assertFalse(Handler.pokemon_matches(pokemon, PokemonRule({'min_cp': {'39': 3531}}, self.locations))[0])
+        self.assertTrue(Handler.pokemon_matches(pokemon, PokemonRule({'max_cp': {'39': 3530}}, self.locations))[0])
+        self.assertFalse(Handler.pokemon_matches(pokemon, PokemonRule({'max_cp': {'39': 3529}}, self.locations))[0])
+
+        # half levels
+        self.assertTrue(Handler.pokemon_matches(pokemon, PokemonRule({'min_cp': {'5.5': 300}}, self.locations))[0])
+
+    def test_hp_at_level(self):
+        pokemon = self._make_pokemon(attack=15, defense=15, stamina=15)
+
+        # Dragonite at level 39 with 15,15,15 == 154
+        self.assertTrue(Handler.pokemon_matches(pokemon, PokemonRule({'min_hp': {'39': 154}}, self.locations))[0])
+        self.assertFalse(Handler.pokemon_matches(pokemon, PokemonRule({'max_hp': {'39': 153}}, self.locations))[0])
+
+    def test_moves(self):
+        rule = PokemonRule({'moves': [{'move_1': 'Dragon Breath'}, {'move_2': 'Hyper Beam'}]}, self.locations)
+        dragon_breath_ids = get_game_data().get_move_ids('Dragon Breath')
+        hyper_beam_id = get_game_data().get_move_ids('Hyper Beam')[0]
+        steel_wing_id = get_game_data().get_move_ids('Steel Wing')[0]
+
+        for move_id in dragon_breath_ids:
+            self.assertTrue(rule.matches(self._make_pokemon(move_1_id=move_id)))
+        self.assertTrue(rule.matches(self._make_pokemon(move_2_id=hyper_beam_id)))
+        self.assertFalse(rule.matches(self._make_pokemon(move_1_id=steel_wing_id)))
+
+    def test_location(self):
+        rule = PokemonRule({'min_lat': 5, 'max_lat': 15, 'max_lon': 25}, self.locations)
+        self.assertTrue(rule.matches(self._make_pokemon()))
+        self.assertFalse(rule.matches(self._make_pokemon(lat=16)))
+        self.assertFalse(rule.matches(self._make_pokemon(lon=26)))
+
+    def test_max_dist(self):
+        rule = PokemonRule({'max_dist': 2000, 'center': [10.01, 20.01]}, self.locations)
+        self.assertEqual([key for key, _ in rule.predicates], ['max_dist'])
+        self.assertTrue(rule.matches(self._make_pokemon()))
+        self.assertFalse(rule.matches(self._make_pokemon(lat=10.05)))
+
+        self.assertRaises(RuntimeError, PokemonRule, {'max_dist': 2000}, self.locations)
+
+    def test_unknown_names(self):
+        self.assertRaises(RuntimeError, PokemonRule, {'name': 'Missingno'}, {})
+        self.assertRaises(RuntimeError, PokemonRule, {'moves': [{'move_1': 'Splash Attack'}]}, {})
+
+    def test_match_data(self):
+        rule = PokemonRule({'name': 'Dragonite', 'min_lat': 5, 'max_lat': 15}, self.locations)
+        self.assertEqual(Handler.pokemon_matches(self._make_pokemon(), rule), (True, ['name', 'min_lat/max_lat']))
+
+    def test_cp_and_hp_combined(self):
+        rule = PokemonRule({'name': 'Dragonite', 'min_cp': {'39': 3500}, 'max_hp': {'39': 154}}, self.locations)
+        self.assertEqual([key for key, _ in rule.predicates], ['name', 'min_cp/max_hp'])
+
+        self.assertTrue(rule.matches(self._make_pokemon(attack=15, defense=15, stamina=15)))
+        self.assertFalse(rule.matches(self._make_pokemon(attack=0, defense=0, stamina=15)))
+        self.assertFalse(rule.matches(self._make_pokemon(iv=100)))
+
+
+class TestRaidRuleIndex(unittest.TestCase):
+    def setUp(self):
+        locations = LocationConstraints(GeofenceIndex({}))
+        self.includes = {
+            'eggs': RaidRule({'raid': False, 'levels': [4, 5]}, locations),
+            'tyranitar': RaidRule({'egg': False, 'pokemons': [{'name': 'Tyranitar'}]}, locations),
+            'legendary': RaidRule({'levels': [5], 'pokemons': [{'name': 'Lugia'}, {'name': 'Ho-Oh'}]}, locations),
+            'all': RaidRule({}, locations)
+        }
+        self.index = RaidRuleIndex(self.includes)
+
+    @staticmethod
+    def _make_raid(level, pokemon_id=None):
+        raid = {'egg': pokemon_id is None, 'level': level, 'lat': 10.0, 'lon': 20.0}
+        if pokemon_id is not None:
+            raid.update({'id': pokemon_id, 'cp': 20000, 'move_1_id': 1, 'move_2_id': 2})
+        return raid
+
+    def _get_candidates(self, raid):
+        return dict((include_ref, pokemon_rules) for include_ref, _, pokemon_rules in self.index.candidates(raid))
+
+    def test_eggs(self):
+        candidates = self._get_candidates(self._make_raid(5))
+        self.assertEqual(sorted(candidates.keys()), ['all', 'eggs', 'legendary'])
+
+        # boss restrictions don't apply to eggs
+        self.assertEqual(candidates['legendary'], [])
+        self.assertEqual(sorted(self._get_candidates(self._make_raid(3)).keys()), ['all'])
+
+    def test_bosses(self):
+        candidates = self._get_candidates(self._make_raid(4, 248))
+        self.assertEqual(sorted(candidates.keys()), ['all', 'tyranitar'])
+
+        candidates = self._get_candidates(self._make_raid(5, 250))
+        self.assertEqual(sorted(candidates.keys()), ['all', 'legendary'])
+        self.assertEqual([r.pokemon_id for r in candidates['legendary']], [250])
+
+    def test_candidates_are_memoized(self):
+        self.assertIs(self.index.candidates(self._make_raid(5, 249)), self.index.candidates(self._make_raid(5, 249)))
+        self.assertEqual(len(self.index.index), 1)
+
+    def test_any_boss_rule_matches(self):
+        handler = Handler(None, None)
+        rule = RaidRule({'pokemons': [{'name': 'Lugia', 'min_cp': 50000}, {'name': 'Lugia', 'max_cp': 30000}]},
+                        LocationConstraints(GeofenceIndex({})))
+        pokemon_rules = rule.get_pokemon_rules(False, 5, 249)
+
+        self.assertEqual(len(pokemon_rules), 2)
+        self.assertEqual(handler.raid_matches(self._make_raid(5, 249), rule, pokemon_rules), (True, ['name', 'max_cp']))
+
+
+class TestSubscriptionIndex(unittest.TestCase):
+    def setUp(self):
+        locations = LocationConstraints(GeofenceIndex({}))
+        dragonite = PokemonRule({'name': 'Dragonite'}, locations)
+        perfect = PokemonRule({'min_iv': 100}, locations)
+        good = PokemonRule({'min_iv': 90}, locations)
+
+        includes = {
+            'dragonite': [dragonite],
+            'perfect': [perfect],
+            'good': [good, dragonite]
+        }
+        includes_to_notifications = {
+            'dragonite': ['alice', 'bob'],
+            'perfect': ['carol'],
+            'good': ['dave']
+        }
+        self.index = SubscriptionIndex(includes, includes_to_notifications)
+
+    def test_shared_rules(self):
+        self.assertEqual(len(self.index.rules), 3)
+        self.assertEqual(sorted(self.index.get_notification_settings({'id': 149})), ['alice', 'bob', 'dave'])
+
+    def test_iv_buckets(self):
+        self.assertEqual(len(self.index.candidates({'id': 1})), 0)
+        self.assertEqual(len(self.index.candidates({'id': 1, 'iv': 95})), 1)
+        self.assertEqual(len(self.index.candidates({'id': 1, 'iv': 100})), 2)
+        self.assertEqual(len(self.index.candidates({'id': 149, 'iv': 100})), 3)
+
+    def test_notification_settings(self):
+        self.assertEqual(self.index.get_notification_settings({'id': 1, 'iv': 100}), ['carol', 'dave'])
+        self.assertEqual(self.index.get_notification_settings({'id': 1, 'iv': 80}), [])
+        self.assertEqual(self.index.get_notification_settings({'id': 9999, 'iv': 91}), ['dave'])
+
+
+class TestNormalizeRules(unittest.TestCase):
+    def test_subsumes(self):
+        self.assertTrue(rule_subsumes({'min_iv': 80}, {'min_iv': 90}))
+        self.assertTrue(rule_subsumes({'min_iv': 80}, {'min_iv': 90, 'name': 'Eevee'}))
+        self.assertTrue(rule_subsumes({'max_dist': 500, 'center': [1, 2]}, {'max_dist': 100, 'center': [1, 2]}))
+        self.assertFalse(rule_subsumes({'min_iv': 90}, {'min_iv': 80}))
+        self.assertFalse(rule_subsumes({'min_iv': 80, 'name': 'Eevee'}, {'min_iv': 90}))
+        self.assertFalse(rule_subsumes({'max_dist': 500, 'center': [1, 2]}, {'max_dist': 100, 'center': [1, 3]}))
+        self.assertFalse(rule_subsumes({'min_cp': {'30': 100}}, {'min_cp': {'30': 200}}))
+
+    def test_duplicates_and_subsumed(self):
+        rules = [{'min_iv': 90}, {'name': 'Eevee'}, {'min_iv': 80}, {'name': 'Eevee'}, {'min_iv': 100}]
+        self.assertEqual(normalize_rules(rules), ([{'name': 'Eevee'}, {'min_iv': 80}], 1, 2))
+
+    def test_same_as_pairwise(self):
+        rng = random.Random(1)
+        for _ in range(0, 200):
+            rules = []
+            for _ in range(0, rng.randint(1, 50)):
+                rule = {}
+                if rng.random() < 0.5:
+                    rule['name'] = rng.choice(['Eevee', 'Lapras'])
+                if rng.random() < 0.2:
+                    rule['geofence'] = rng.choice(['Someplace', 'Elsewhere'])
+                for key in ['min_iv', 'max_iv', 'min_lat', 'max_dist']:
+                    if rng.random() < 0.4:
+                        rule[key] = rng.choice([0, 50, 80, 90, 100])
+                rules.append(rule)
+
+            rules = unique_rules(rules)
+            pairwise = [rule for rule in rules
+                        if not any(other is not rule and rule_subsumes(other, rule) for other in rules)]
+            self.assertEqual(remove_subsumed_rules(rules)[0], pairwise)
+
+    def test_equivalent_rules(self):
+        self.assertEqual(normalize_rules([{'min_iv': 90.0}, {'min_iv': 90}]), ([{'min_iv': 90.0}], 1, 0))
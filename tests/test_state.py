@@ -0,0 +1,60 @@
+from notifier.handler import Handler
+from notifier.state import HandlerState
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+class TestHandlerState(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.directory, 'state.db')
+        self.now = int(time.time())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_restore(self):
+        handler = Handler(None, None, HandlerState(self.state_file))
+        handler.set_processed('pokemon', 'MTA0MjA0NDU4NTU4NzI1NTQ5MjE=', self.now + 600)
+        handler.set_processed('pokemon', 12345678901234567, self.now + 600)
+        handler.set_processed('pokemon', 'gone', self.now - 10)
+        handler.set_processed('raid', 'gym1500000000', self.now + 600)
+        handler.set_processed('egg', 'gym1500000000', self.now + 300)
+        handler.handle_gym_details({'id': 'gym', 'name': 'Fountain', 'latitude': 1.0, 'longitude': 2.0,
+                                    'team': 1, 'pokemon': [{'trainer_name': 'Ash'}]})
+        handler.state.save(self.now)
+
+        restored = Handler(None, None, HandlerState(self.state_file))
+        self.assertTrue('MTA0MjA0NDU4NTU4NzI1NTQ5MjE=' in restored.processed_pokemons)
+        self.assertTrue(12345678901234567 in restored.processed_pokemons)
+        self.assertFalse('gone' in restored.processed_pokemons)
+        self.assertTrue('gym1500000000' in restored.processed_raids)
+        self.assertEqual(restored.processed_eggs.get('gym1500000000'), self.now + 300)
+        self.assertEqual(restored.gyms['gym']['name'], 'Fountain')
+        self.assertEqual(restored.gyms['gym']['trainers'], ['Ash'])
+
+    def test_expired_entries_are_dropped(self):
+        state = HandlerState(self.state_file)
+        state.add('pokemon', 'a', self.now + 5)
+        state.save(self.now)
+        state.save(self.now + 10)
+
+        self.assertEqual(HandlerState(self.state_file).load(self.now)[0], [])
+
+    def test_failed_save_is_retried(self):
+        state = HandlerState(self.state_file)
+        state.add('pokemon', 'a', self.now + 5)
+
+        os.remove(self.state_file)
+        os.mkdir(self.state_file)
+        state.save(self.now)
+        self.assertEqual(len(state.pending), 1)
+
+        os.rmdir(self.state_file)
+        HandlerState(self.state_file)
+        state.save(self.now)
+        self.assertEqual(len(state.pending), 0)
+        self.assertEqual(len(HandlerState(self.state_file).load(self.now)[0]), 1)
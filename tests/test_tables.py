@@ -0,0 +1,53 @@
+from notifier import gamedata
+from notifier import tables
+from notifier import utils
+import unittest
+
+
+class TestTables(unittest.TestCase):
+    def test_cp_matches_formula(self):
+        table = tables.SpeciesTables().get(149)
+        for level in ["1", "5.5", "39", "40"]:
+            level_index = gamedata.get_level_index(level)
+            for ivs in [(0, 0, 0), (15, 15, 15), (3, 11, 7)]:
+                self.assertEqual(table.get_cp(level_index, tables.get_iv_index(*ivs)),
+                                 utils.get_cp_for_level(149, level, *ivs))
+                self.assertEqual(table.get_hp(level_index, ivs[2]), utils.get_hp_for_level(149, level, ivs[2]))
+
+    def test_unknown_species(self):
+        self.assertIsNone(tables.SpeciesTables().get(9999))
+
+    def test_bounded(self):
+        species_tables = tables.SpeciesTables(max_species=2)
+        first = species_tables.get(1)
+        species_tables.get(2)
+        species_tables.get(1)
+        species_tables.get(3)
+
+        self.assertEqual(list(species_tables.tables.keys()), [1, 3])
+        self.assertIs(species_tables.get(1), first)
+
+    def test_iv_bitmap(self):
+        checks = [('min_cp', gamedata.get_level_index(20), 1500), ('max_hp', gamedata.get_level_index(30), 140)]
+        bitmap = tables.get_iv_bitmap(149, checks)
+
+        for ivs in [(0, 0, 0), (15, 15, 15), (15, 0, 0), (10, 10, 3), (7, 15, 15)]:
+            expected = utils.get_cp_for_level(149, 20, *ivs) >= 1500 and utils.get_hp_for_level(149, 30, ivs[2]) <= 140
+            iv_index = tables.get_iv_index(*ivs)
+            self.assertEqual(bitmap[iv_index >> 3] & (1 << (iv_index & 7)) != 0, expected)
+
+    def test_iv_bitmap_unknown_species(self):
+        bitmap = tables.get_iv_bitmap(9999, [('min_cp', 0, 0)])
+        self.assertEqual(bitmap, bytearray(tables.IV_COUNT // 8))
+
+    def test_iv_bitmaps_shared_and_bounded(self):
+        iv_bitmaps = tables.IvBitmaps(max_bitmaps=2)
+        checks = (('min_cp', gamedata.get_level_index(20), 1500),)
+        first = iv_bitmaps.get(149, checks)
+        self.assertIs(iv_bitmaps.get(149, tuple(list(checks))), first)
+        self.assertEqual(first, tables.get_iv_bitmap(149, checks))
+
+        iv_bitmaps.get(150, checks)
+        iv_bitmaps.get(149, checks)
+        iv_bitmaps.get(151, checks)
+        self.assertEqual(list(iv_bitmaps.bitmaps.keys()), [(149, checks), (151, checks)])